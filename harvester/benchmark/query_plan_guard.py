@@ -0,0 +1,246 @@
+""" Guards the query plans of the heavy harvester SQL statements against regressions.
+
+Seeds a local PostGIS database (e.g. the dev-db image) with scaled synthetic trees, waterings and radolan data
+in the scratch schema harvester_benchmark, runs the statements under EXPLAIN (ANALYZE, FORMAT JSON) and fails if
+
+    - a table that should be read by an index is read by a sequential scan
+    - the planner cost or the execution time exceeds the budget stored in query_plan_budgets.json
+
+Data modifying statements are rolled back after being explained. Usage:
+
+    python query_plan_guard.py --trees 200000
+    python query_plan_guard.py --trees 200000 --update-budgets
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+import psycopg2
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from radolan_db_utils import (
+    INSERT_RADOLAN_DATA_SQL,
+    UPDATE_TREES_SQL,
+    UPDATE_TREES_BUFFERED_SQL,
+)
+from build_radolan_grid import RADOLAN_GRID_SQL
+from mapbox_tree_update import TREES_EXPORT_SQL
+from synthetic_data import seed_database, use_schema
+
+logging.basicConfig()
+logging.root.setLevel(logging.INFO)
+
+load_dotenv()
+
+DEFAULT_BUDGET_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "query_plan_budgets.json"
+)
+
+# Headroom applied to measured values when storing new budgets
+COST_HEADROOM = 1.5
+TIME_HEADROOM = 2.0
+
+INDEX_NODE_TYPES = ("Index Scan", "Index Only Scan", "Bitmap Heap Scan")
+
+
+def build_checks(db_conn, limit_days):
+    """Builds the statements to guard together with the tables they must read via an index
+
+    Args:
+        db_conn: the database connection
+        limit_days (int): radolan window in days
+
+    Returns:
+        list[dict]: name, sql, params and index_relations of every check
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(
+            "SELECT id FROM radolan_geometry ORDER BY id OFFSET (SELECT COUNT(*) / 2 FROM radolan_geometry) LIMIT 1;"
+        )
+        cell_id = cur.fetchone()[0]
+    days = [0] * (limit_days * 24)
+    return [
+        {
+            "name": "upload_radolan_data_in_db",
+            "sql": INSERT_RADOLAN_DATA_SQL,
+            "params": None,
+            "index_relations": ["radolan_geometry"],
+        },
+        {
+            "name": "build_radolan_grid",
+            "sql": RADOLAN_GRID_SQL,
+            "params": (limit_days,),
+            "index_relations": [],
+        },
+        {
+            "name": "update_trees_in_database",
+            "sql": UPDATE_TREES_SQL,
+            "params": (days, 100, cell_id, days, 100),
+            "index_relations": ["trees"],
+        },
+        {
+            "name": "update_trees_in_database_buffered",
+            "sql": UPDATE_TREES_BUFFERED_SQL,
+            "params": (days, 100, cell_id, days, 100),
+            "index_relations": ["trees"],
+        },
+        {
+            "name": "generate_trees_csv",
+            "sql": TREES_EXPORT_SQL,
+            "params": None,
+            "index_relations": [],
+        },
+    ]
+
+
+def prepare_radolan_temp(db_conn):
+    """Fills radolan_temp like one hourly upload: rain polygons covering every third grid cell
+
+    Args:
+        db_conn: the database connection
+    """
+    with db_conn.cursor() as cur:
+        cur.execute("DELETE FROM radolan_temp;")
+        cur.execute(
+            """
+            INSERT INTO radolan_temp (geometry, value, measured_at)
+            SELECT ST_Multi(geometry), 5, NOW() FROM radolan_geometry WHERE id % 3 = 0;
+            """
+        )
+        cur.execute("ANALYZE radolan_temp;")
+    db_conn.commit()
+
+
+def plan_nodes(plan):
+    """Yields all nodes of an EXPLAIN JSON plan"""
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def explain(db_conn, sql, params):
+    """Runs the statement under EXPLAIN (ANALYZE, FORMAT JSON) and rolls back its effects
+
+    Args:
+        db_conn: the database connection
+        sql (str): the statement
+        params (tuple): the statement parameters
+
+    Returns:
+        dict: the top level EXPLAIN JSON object
+    """
+    with db_conn.cursor() as cur:
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+        result = cur.fetchone()[0]
+    db_conn.rollback()
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]
+
+
+def check_plan(check, result, budget):
+    """Checks a plan against index expectations and budgets
+
+    Args:
+        check (dict): the check definition
+        result (dict): the EXPLAIN JSON object
+        budget (dict): max_total_cost and max_execution_ms or None
+
+    Returns:
+        list[str]: descriptions of all violations
+    """
+    violations = []
+    nodes = list(plan_nodes(result["Plan"]))
+    for relation in check["index_relations"]:
+        index_reads = [
+            node
+            for node in nodes
+            if node.get("Relation Name") == relation
+            and node["Node Type"] in INDEX_NODE_TYPES
+        ]
+        if not index_reads:
+            violations.append(f"{relation} is not read by an index scan")
+    if budget is not None:
+        total_cost = result["Plan"]["Total Cost"]
+        execution_ms = result["Execution Time"]
+        if total_cost > budget["max_total_cost"]:
+            violations.append(
+                f"total cost {total_cost:.0f} exceeds budget {budget['max_total_cost']:.0f}"
+            )
+        if execution_ms > budget["max_execution_ms"]:
+            violations.append(
+                f"execution time {execution_ms:.0f}ms exceeds budget {budget['max_execution_ms']:.0f}ms"
+            )
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trees", type=int, default=200000, help="number of synthetic trees")
+    parser.add_argument("--limit-days", type=int, default=30, help="radolan window in days")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the previously seeded scratch schema")
+    parser.add_argument("--budgets", default=DEFAULT_BUDGET_FILE, help="budget file")
+    parser.add_argument("--update-budgets", action="store_true", help="store measured values plus headroom as budgets")
+    args = parser.parse_args()
+
+    for env_var in ["PG_SERVER", "PG_PORT", "PG_USER", "PG_PASS", "PG_DB"]:
+        if env_var not in os.environ:
+            logging.error("❌Environmental Variable {} does not exist".format(env_var))
+            sys.exit(1)
+
+    db_conn = psycopg2.connect(
+        dbname=os.getenv("PG_DB"),
+        user=os.getenv("PG_USER"),
+        password=os.getenv("PG_PASS"),
+        host=os.getenv("PG_SERVER"),
+        port=os.getenv("PG_PORT"),
+    )
+    if args.skip_seed:
+        use_schema(db_conn)
+    else:
+        seed_database(db_conn, args.trees, args.limit_days)
+    prepare_radolan_temp(db_conn)
+
+    budgets = {}
+    if os.path.exists(args.budgets):
+        with open(args.budgets) as budget_file:
+            budgets = json.load(budget_file)
+    elif not args.update_budgets:
+        logging.warning(f"No budgets at {args.budgets}, only index usage is checked")
+
+    failed = False
+    measured = {}
+    for check in build_checks(db_conn, args.limit_days):
+        result = explain(db_conn, check["sql"], check["params"])
+        total_cost = result["Plan"]["Total Cost"]
+        execution_ms = result["Execution Time"]
+        measured[check["name"]] = {
+            "max_total_cost": round(total_cost * COST_HEADROOM, 2),
+            "max_execution_ms": round(execution_ms * TIME_HEADROOM, 2),
+        }
+        violations = check_plan(
+            check, result, None if args.update_budgets else budgets.get(check["name"])
+        )
+        logging.info(
+            f"{'❌' if violations else '✅'} {check['name']}: cost={total_cost:.0f} time={execution_ms:.0f}ms"
+        )
+        for violation in violations:
+            logging.error(f"  {violation}")
+        failed = failed or len(violations) > 0
+
+    if args.update_budgets:
+        with open(args.budgets, "w") as out:
+            json.dump(measured, out, indent=2)
+        logging.info(f"Updated budgets {args.budgets}")
+
+    db_conn.close()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+""" Benchmarks the stages of the harvest and export pipeline on synthetic data at several scales.
+
+Results are written as JSON and compared against a stored baseline, e.g.:
+
+    python run_benchmark.py --scales small,medium
+    python run_benchmark.py --scales small,medium --update-baseline
+
+Stages needing GDAL (crop/project/polygonize/extract) are skipped if no cutline shapefile is available,
+stages needing a database (build_radolan_grid, generate_trees_csv) are skipped if PG_* variables are not set.
+The database stages run in a scratch schema, the harvester tables are never touched.
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from download_radolan_data import unzip_radolan_data
+from project_radolan_data import project_radolan_data, polygonize_data
+from radolan_window import crop_radolan_ascii
+from extract_radolan_data import extract_radolan_data_from_shapefile
+from build_radolan_grid import build_radolan_grid
+from mapbox_tree_update import generate_trees_csv
+from synthetic_data import generate_radolan_archives, seed_database, BERLIN_REGION
+
+logging.basicConfig()
+logging.root.setLevel(logging.INFO)
+
+load_dotenv()
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE_FILE = os.path.join(BENCHMARK_DIR, "baselines.json")
+DEFAULT_SHAPE_FILE = os.path.join(BENCHMARK_DIR, "..", "assets", "buffer.shp")
+
+# Number of days of RADOLAN data and number of trees per scale
+SCALES = {
+    "small": {"days": 1, "trees": 10000},
+    "medium": {"days": 7, "trees": 100000},
+    "large": {"days": 30, "trees": 850000},
+}
+
+# Allowed slowdown against the baseline before a stage counts as regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def measure(function, repeat):
+    """Runs the given function repeat times
+
+    Args:
+        function (callable): function to measure, returns the number of processed rows
+        repeat (int): number of runs
+
+    Returns:
+        dict: median and single run durations in seconds and processed rows
+    """
+    durations = []
+    rows = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = function()
+        durations.append(time.perf_counter() - start)
+    return {
+        "median_seconds": statistics.median(durations),
+        "runs_seconds": durations,
+        "rows": rows,
+    }
+
+
+def benchmark_file_stages(days, repeat, hours_sample, shape_file, temp_dir):
+    """Benchmarks the file based stages on synthetic RADOLAN archives
+
+    Args:
+        days (int): number of days of synthetic data
+        repeat (int): number of runs per stage
+        hours_sample (int): number of hourly files to run crop/project/polygonize/extract for
+        shape_file (str): cutline shapefile or None to skip the GDAL stages
+        temp_dir (str): scratch directory
+
+    Returns:
+        dict: results per stage
+    """
+    results = {}
+    archive_dir = os.path.join(temp_dir, "archives")
+    archives = generate_radolan_archives(
+        archive_dir, datetime(2024, 6, 1), days
+    )
+
+    def unzip():
+        unzip_dir = os.path.join(temp_dir, "unzip")
+        shutil.rmtree(unzip_dir, ignore_errors=True)
+        os.makedirs(unzip_dir)
+        copies = [shutil.copy(archive, unzip_dir) for archive in archives]
+        return len(unzip_radolan_data(copies, unzip_dir))
+
+    results["unzip_radolan_data"] = measure(unzip, repeat)
+
+    if shape_file is None or not os.path.exists(shape_file):
+        logging.warning("No cutline shapefile available, skipping project/polygonize/extract")
+        return results
+
+    hourly_files = sorted(glob.glob(os.path.join(temp_dir, "unzip", "**", "*.asc"), recursive=True))
+    hourly_files = hourly_files[:hours_sample]
+    cropped_files = []
+    projected_files = []
+    polygonized_files = []
+
+    def crop():
+        cropped_files.clear()
+        for hourly_file in hourly_files:
+            hourly_dir = tempfile.mkdtemp(dir=temp_dir)
+            cropped_files.append(crop_radolan_ascii(hourly_file, shape_file, hourly_dir))
+        return len(cropped_files)
+
+    def project():
+        projected_files.clear()
+        for hourly_file in cropped_files:
+            hourly_dir = tempfile.mkdtemp(dir=temp_dir)
+            projected_files.append(project_radolan_data(hourly_file, shape_file, hourly_dir))
+        return len(projected_files)
+
+    def polygonize():
+        polygonized_files.clear()
+        for projected_file in projected_files:
+            polygonized_files.append(
+                polygonize_data(projected_file, tempfile.mkdtemp(dir=temp_dir))
+            )
+        return len(polygonized_files)
+
+    def extract():
+        return sum(
+            len(extract_radolan_data_from_shapefile(polygonized_file, datetime(2024, 6, 1)))
+            for polygonized_file in polygonized_files
+        )
+
+    results["crop_radolan_ascii"] = measure(crop, repeat)
+    results["project_radolan_data"] = measure(project, repeat)
+    results["polygonize_data"] = measure(polygonize, repeat)
+    results["extract_radolan_data_from_shapefile"] = measure(extract, repeat)
+    return results
+
+
+def benchmark_database_stages(trees, repeat, limit_days, db_conn, temp_dir):
+    """Benchmarks the database based stages in a scratch schema seeded with synthetic data
+
+    Args:
+        trees (int): number of synthetic trees
+        repeat (int): number of runs per stage
+        limit_days (int): number of days of radolan data
+        db_conn: the database connection
+        temp_dir (str): scratch directory
+
+    Returns:
+        dict: results per stage
+    """
+    seed_database(db_conn, trees, limit_days, BERLIN_REGION)
+    results = {}
+    results["build_radolan_grid"] = measure(
+        lambda: len(build_radolan_grid(limit_days, db_conn)), repeat
+    )
+
+    def export():
+        trees_csv_full_path, _ = generate_trees_csv(temp_dir, db_conn)
+        db_conn.commit()
+        with open(trees_csv_full_path) as trees_csv:
+            return sum(1 for _ in trees_csv) - 1
+
+    results["generate_trees_csv"] = measure(export, repeat)
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Compares the results with the baseline
+
+    Args:
+        results (dict): results per scale and stage
+        baseline (dict): baseline per scale and stage
+        tolerance (float): default allowed relative slowdown
+
+    Returns:
+        list[str]: descriptions of all regressions
+    """
+    regressions = []
+    for scale, stages in results.items():
+        for stage, result in stages.items():
+            reference = baseline.get("results", {}).get(scale, {}).get(stage)
+            if reference is None:
+                logging.info(f"  {scale}/{stage}: {result['median_seconds']:.3f}s (no baseline)")
+                continue
+            allowed = reference.get("max_regression", tolerance)
+            ratio = result["median_seconds"] / reference["median_seconds"]
+            logging.info(
+                f"  {scale}/{stage}: {result['median_seconds']:.3f}s, baseline {reference['median_seconds']:.3f}s ({ratio:.2f}x)"
+            )
+            if ratio > 1 + allowed:
+                regressions.append(
+                    f"{scale}/{stage} took {result['median_seconds']:.3f}s, {ratio:.2f}x the baseline (allowed {1 + allowed:.2f}x)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="small", help=f"comma separated list of {', '.join(SCALES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the median is reported")
+    parser.add_argument("--hours-sample", type=int, default=24, help="hourly files for project/polygonize/extract")
+    parser.add_argument("--limit-days", type=int, default=30, help="radolan window of the database stages")
+    parser.add_argument("--shape-file", default=os.getenv("SURROUNDING_SHAPE_FILE", DEFAULT_SHAPE_FILE))
+    parser.add_argument("--output", default="benchmark-results.json", help="file to write the results to")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE, help="baseline file to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed relative slowdown")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as new baseline")
+    args = parser.parse_args()
+
+    db_conn = None
+    if all(env_var in os.environ for env_var in ["PG_SERVER", "PG_PORT", "PG_USER", "PG_PASS", "PG_DB"]):
+        import psycopg2
+
+        db_conn = psycopg2.connect(
+            dbname=os.getenv("PG_DB"),
+            user=os.getenv("PG_USER"),
+            password=os.getenv("PG_PASS"),
+            host=os.getenv("PG_SERVER"),
+            port=os.getenv("PG_PORT"),
+        )
+    else:
+        logging.warning("PG_* environment variables not set, skipping database stages")
+
+    results = {}
+    for scale in args.scales.split(","):
+        logging.info(f"🏁 Benchmarking scale {scale}: {SCALES[scale]}")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            results[scale] = benchmark_file_stages(
+                SCALES[scale]["days"], args.repeat, args.hours_sample, args.shape_file, temp_dir
+            )
+            if db_conn is not None:
+                results[scale].update(
+                    benchmark_database_stages(
+                        SCALES[scale]["trees"], args.repeat, args.limit_days, db_conn, temp_dir
+                    )
+                )
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+        },
+        "scales": {scale: SCALES[scale] for scale in results},
+        "results": results,
+    }
+    with open(args.output, "w") as out:
+        json.dump(report, out, indent=2)
+    logging.info(f"Written benchmark results to {args.output}")
+
+    if args.update_baseline:
+        baseline = {"results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        baseline["environment"] = report["environment"]
+        for scale, stages in results.items():
+            scale_baseline = baseline["results"].setdefault(scale, {})
+            for stage, result in stages.items():
+                previous = scale_baseline.get(stage, {})
+                scale_baseline[stage] = {"median_seconds": result["median_seconds"]}
+                if "max_regression" in previous:
+                    scale_baseline[stage]["max_regression"] = previous["max_regression"]
+        with open(args.baseline, "w") as out:
+            json.dump(baseline, out, indent=2)
+        logging.info(f"Updated baseline {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        logging.warning(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        return
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        for regression in regressions:
+            logging.error(f"❌ Regression: {regression}")
+        sys.exit(1)
+    logging.info("✅ No performance regressions")
+
+
+if __name__ == "__main__":
+    main()
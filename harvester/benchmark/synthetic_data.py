@@ -0,0 +1,338 @@
+""" Generates reproducible synthetic inputs for benchmarking the harvester:
+
+    - hourly RADOLAN RW files in DWD's ESRI ASCII format (900x900 cells), packed into daily RW-YYYYMMDD.tar.gz archives
+    - a synthetic tree population, watering and adoption data and a radolan grid for a configurable region,
+      seeded into a scratch schema of a PostGIS database
+"""
+
+import io
+import os
+import math
+import tarfile
+import logging
+import numpy
+from datetime import datetime
+from datetime import timedelta
+
+# Header of the hourly RADOLAN RW ASCII files of the DWD
+RADOLAN_ASCII_HEADER = (
+    "ncols 900\n"
+    "nrows 900\n"
+    "xllcorner -523462\n"
+    "yllcorner -4658645\n"
+    "cellsize 1000\n"
+    "NODATA_value -1"
+)
+RADOLAN_GRID_SIZE = 900
+
+# Bounding box (min lng, min lat, max lng, max lat) of Berlin
+BERLIN_REGION = (13.08, 52.33, 13.77, 52.68)
+
+BENCHMARK_SCHEMA = "harvester_benchmark"
+
+
+def generate_hourly_radolan_field(rng, rain_probability=0.3):
+    """Generates the values of one hourly RADOLAN file: a few rain cells on dry background
+
+    Args:
+        rng (numpy.random.RandomState): the random generator
+        rain_probability (float): probability that it rains at all in this hour
+
+    Returns:
+        numpy.ndarray: 900x900 int array of precipitation in 0.1 mm, -1 for missing values
+    """
+    field = numpy.zeros((RADOLAN_GRID_SIZE, RADOLAN_GRID_SIZE), dtype=numpy.int32)
+    if rng.random_sample() < rain_probability:
+        rows, cols = numpy.ogrid[:RADOLAN_GRID_SIZE, :RADOLAN_GRID_SIZE]
+        for _ in range(rng.randint(1, 8)):
+            center_row, center_col = rng.randint(0, RADOLAN_GRID_SIZE, size=2)
+            radius = rng.randint(10, 120)
+            intensity = rng.randint(1, 60)
+            distance = numpy.hypot(rows - center_row, cols - center_col)
+            blob = numpy.clip(intensity * (1 - distance / radius), 0, None)
+            field += blob.astype(numpy.int32)
+    # DWD marks cells outside of the radar coverage as missing
+    field[:5, :] = -1
+    field[-5:, :] = -1
+    return field
+
+
+def generate_radolan_archives(path, start_date, days, seed=42):
+    """Writes daily RW-YYYYMMDD.tar.gz archives containing 24 hourly RW_YYYYMMDD-HH50.asc files each
+
+    Args:
+        path (str): directory to write the archives to
+        start_date (datetime): first day to generate data for
+        days (int): number of days to generate data for
+        seed (int): seed of the random generator
+
+    Returns:
+        list[str]: full paths of the generated archives
+    """
+    rng = numpy.random.RandomState(seed)
+    os.makedirs(path, exist_ok=True)
+    archives = []
+    for day in range(days):
+        date = start_date + timedelta(days=day)
+        archive_path = os.path.join(path, f"RW-{date.strftime('%Y%m%d')}.tar.gz")
+        with tarfile.open(archive_path, "w:gz") as archive:
+            for hour in range(24):
+                measured_at = date.replace(hour=hour, minute=50)
+                buffer = io.BytesIO()
+                numpy.savetxt(
+                    buffer,
+                    generate_hourly_radolan_field(rng),
+                    fmt="%d",
+                    header=RADOLAN_ASCII_HEADER,
+                    comments="",
+                )
+                info = tarfile.TarInfo(measured_at.strftime("RW_%Y%m%d-%H%M.asc"))
+                info.size = buffer.tell()
+                buffer.seek(0)
+                archive.addfile(info, buffer)
+        archives.append(archive_path)
+        logging.info(f"Generated synthetic radolan archive {archive_path}")
+    return archives
+
+
+def generate_trees(count, region=BERLIN_REGION, seed=42):
+    """Generates a synthetic tree population, clustered along streets like real tree cadastres
+
+    Args:
+        count (int): number of trees
+        region (tuple): bounding box (min lng, min lat, max lng, max lat)
+        seed (int): seed of the random generator
+
+    Returns:
+        list[tuple]: (id, lng, lat, pflanzjahr, bezirk) for each tree
+    """
+    rng = numpy.random.RandomState(seed)
+    min_lng, min_lat, max_lng, max_lat = region
+    streets = max(count // 50, 1)
+    street_lngs = rng.uniform(min_lng, max_lng, streets)
+    street_lats = rng.uniform(min_lat, max_lat, streets)
+    street_index = rng.randint(0, streets, count)
+    lngs = numpy.clip(street_lngs[street_index] + rng.normal(0, 0.002, count), min_lng, max_lng)
+    lats = numpy.clip(street_lats[street_index] + rng.normal(0, 0.001, count), min_lat, max_lat)
+    pflanzjahre = numpy.where(rng.random_sample(count) < 0.1, 0, rng.randint(1900, 2024, count))
+    districts = [f"Bezirk {i + 1}" for i in range(12)]
+    district_cols = 4
+    district_rows = 3
+    district_index = (
+        numpy.floor((lngs - min_lng) / (max_lng - min_lng) * district_cols).clip(0, district_cols - 1)
+        + numpy.floor((lats - min_lat) / (max_lat - min_lat) * district_rows).clip(0, district_rows - 1) * district_cols
+    ).astype(int)
+    return [
+        (f"{i:08d}", float(lngs[i]), float(lats[i]), int(pflanzjahre[i]), districts[district_index[i]])
+        for i in range(count)
+    ]
+
+
+def generate_radolan_cells(region=BERLIN_REGION, cell_size_m=1000):
+    """Generates a grid of roughly square 1km cells covering the region, like radolan_geometry
+
+    Args:
+        region (tuple): bounding box (min lng, min lat, max lng, max lat)
+        cell_size_m (int): edge length of a cell in meters
+
+    Returns:
+        list[tuple]: (min lng, min lat, max lng, max lat) of each cell
+    """
+    min_lng, min_lat, max_lng, max_lat = region
+    cell_lat = cell_size_m / 111320.0
+    cell_lng = cell_lat / math.cos(math.radians((min_lat + max_lat) / 2))
+    cells = []
+    lat = min_lat
+    while lat < max_lat:
+        lng = min_lng
+        while lng < max_lng:
+            cells.append((lng, lat, lng + cell_lng, lat + cell_lat))
+            lng += cell_lng
+        lat += cell_lat
+    return cells
+
+
+def _copy_rows(cur, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join("\\N" if value is None else str(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def seed_database(
+    db_conn,
+    trees_count,
+    limit_days=30,
+    region=BERLIN_REGION,
+    schema=BENCHMARK_SCHEMA,
+    create_indexes=True,
+    seed=42,
+):
+    """(Re)creates a scratch schema containing the harvester tables filled with synthetic data
+    and sets the search path of the connection to it.
+
+    Args:
+        db_conn: the database connection
+        trees_count (int): number of trees to generate
+        limit_days (int): number of days of radolan data and waterings to generate
+        region (tuple): bounding box (min lng, min lat, max lng, max lat)
+        schema (str): name of the scratch schema, it is dropped first
+        create_indexes (bool): whether to create the indexes the harvester relies on
+        seed (int): seed of the random generator
+    """
+    logging.info(f"Seeding schema {schema} with {trees_count} synthetic trees...")
+    rng = numpy.random.RandomState(seed)
+    trees = generate_trees(trees_count, region, seed)
+    cells = generate_radolan_cells(region)
+    with db_conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {schema};")
+        cur.execute(f"SET search_path TO {schema}, public, extensions;")
+        cur.execute(
+            """
+            CREATE TABLE trees (
+                id text PRIMARY KEY,
+                lat text,
+                lng text,
+                geom geometry(Point, 4326),
+                radolan_sum integer,
+                radolan_days integer[],
+                pflanzjahr integer,
+                bezirk text
+            );
+            CREATE TABLE trees_watered (
+                id serial PRIMARY KEY,
+                tree_id text,
+                amount numeric,
+                timestamp timestamptz,
+                uuid text,
+                included_in_map_layer boolean DEFAULT FALSE
+            );
+            CREATE TABLE trees_adopted (
+                id serial PRIMARY KEY,
+                tree_id text,
+                uuid text
+            );
+            CREATE TABLE radolan_geometry (
+                id serial PRIMARY KEY,
+                geometry geometry(Polygon, 4326),
+                centroid geometry(Point, 4326)
+            );
+            CREATE TABLE radolan_data (
+                id serial PRIMARY KEY,
+                measured_at timestamp,
+                value integer,
+                geom_id integer
+            );
+            CREATE TABLE radolan_temp (
+                id serial PRIMARY KEY,
+                geometry geometry(MultiPolygon, 4326),
+                value integer,
+                measured_at timestamp
+            );
+            CREATE TABLE radolan_harvester (
+                id integer PRIMARY KEY,
+                collection_date date,
+                start_date timestamp,
+                end_date timestamp
+            );
+            """
+        )
+
+        _copy_rows(
+            cur,
+            "trees",
+            ["id", "lat", "lng", "geom", "pflanzjahr", "bezirk"],
+            (
+                (tree_id, lng, lat, f"SRID=4326;POINT({lng} {lat})", pflanzjahr, bezirk)
+                for tree_id, lng, lat, pflanzjahr, bezirk in trees
+            ),
+        )
+        _copy_rows(
+            cur,
+            "radolan_geometry",
+            ["id", "geometry"],
+            (
+                (
+                    index + 1,
+                    f"SRID=4326;POLYGON(({x0} {y0},{x1} {y0},{x1} {y1},{x0} {y1},{x0} {y0}))",
+                )
+                for index, (x0, y0, x1, y1) in enumerate(cells)
+            ),
+        )
+        cur.execute("UPDATE radolan_geometry SET centroid = ST_Centroid(geometry);")
+
+        # Hourly radolan values of the last limit_days days for the cells it rained in
+        now = datetime.now().replace(minute=50, second=0, microsecond=0)
+        radolan_rows = []
+        for hour in range(limit_days * 24):
+            if rng.random_sample() < 0.3:
+                measured_at = now - timedelta(hours=hour)
+                rainy_cells = numpy.nonzero(rng.random_sample(len(cells)) < 0.4)[0]
+                values = rng.randint(1, 40, len(rainy_cells))
+                radolan_rows += [
+                    (int(cell) + 1, int(value), measured_at)
+                    for cell, value in zip(rainy_cells, values)
+                ]
+        _copy_rows(cur, "radolan_data", ["geom_id", "value", "measured_at"], radolan_rows)
+
+        # Every 10th tree is watered about 3 times in the window, every 20th tree is adopted
+        watered = rng.choice(trees_count, size=trees_count // 10 * 3) if trees_count >= 10 else []
+        _copy_rows(
+            cur,
+            "trees_watered",
+            ["tree_id", "amount", "timestamp", "uuid"],
+            (
+                (
+                    trees[index][0],
+                    int(rng.randint(5, 100)),
+                    now - timedelta(hours=int(rng.randint(0, limit_days * 24))),
+                    f"user-{index % 997}",
+                )
+                for index in watered
+            ),
+        )
+        _copy_rows(
+            cur,
+            "trees_adopted",
+            ["tree_id", "uuid"],
+            ((tree[0], f"user-{index % 997}") for index, tree in enumerate(trees) if index % 20 == 0),
+        )
+        cur.execute(
+            "INSERT INTO radolan_harvester (id, collection_date, start_date, end_date) VALUES (1, %s, %s, %s);",
+            [now.date() - timedelta(days=1), now - timedelta(days=1), now - timedelta(days=1)],
+        )
+
+        if create_indexes:
+            cur.execute(
+                """
+                CREATE INDEX trees_geom_idx ON trees USING gist (geom);
+                CREATE INDEX radolan_geometry_centroid_idx ON radolan_geometry USING gist (centroid);
+                CREATE INDEX radolan_geometry_geometry_idx ON radolan_geometry USING gist (geometry);
+                CREATE INDEX radolan_data_measured_at_idx ON radolan_data (measured_at);
+                CREATE INDEX radolan_data_geom_id_measured_at_idx ON radolan_data (geom_id, measured_at);
+                CREATE INDEX trees_watered_tree_id_idx ON trees_watered (tree_id);
+                CREATE INDEX trees_adopted_tree_id_idx ON trees_adopted (tree_id);
+                """
+            )
+        cur.execute(
+            "ANALYZE trees; ANALYZE trees_watered; ANALYZE trees_adopted; ANALYZE radolan_geometry; ANALYZE radolan_data;"
+        )
+        db_conn.commit()
+    logging.info(
+        f"Seeded {len(trees)} trees, {len(cells)} grid cells and {len(radolan_rows)} radolan values"
+    )
+
+
+def use_schema(db_conn, schema=BENCHMARK_SCHEMA):
+    """Points the search path of the connection to the given scratch schema
+
+    Args:
+        db_conn: the database connection
+        schema (str): name of the scratch schema
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(f"SET search_path TO {schema}, public, extensions;")
+    db_conn.commit()
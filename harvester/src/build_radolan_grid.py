@@ -1,6 +1,25 @@
 from datetime import datetime
 from datetime import timedelta
 import logging
+import numpy
+from precipitation_cube import get_precipitation_cube, sync_precipitation_cube
+from radolan_grid import RadolanGrid
+
+# Aggregates the radolan values of the last limit_days days for each grid cell
+RADOLAN_GRID_SQL = """
+    SELECT
+        geom_id,
+        ARRAY_AGG(measured_at) AS measured_at,
+        ARRAY_AGG(value) AS value
+    FROM
+        radolan_data
+    WHERE
+        measured_at > NOW() - %s * INTERVAL '1 day'
+    GROUP BY
+        geom_id
+    ORDER BY
+        geom_id;
+"""
 
 
 def build_radolan_grid(limit_days, db_conn):
@@ -10,86 +29,64 @@ def build_radolan_grid(limit_days, db_conn):
         limit_days (number): number of previous days to harvest data for
         db_conn (_type_): the database connection
 
-
     Returns:
-        _type_: grid of radolan data containing hourly radolan data for each hour of every polygon, structure below:
-        [
-            [
-                [radolon_hour_0, radolon_hour_1, ..., radolon_hour_x],
-                25,
-                '{"type":"Polygon","coordinates":[coordinates_for_polygon_0]}']
-            ],
-
-            [
-                [radolon_hour_0, radolon_hour_1, ..., radolon_hour_x],
-                3,
-                '{"type":"Polygon","coordinates":[coordinates_for_polygon_1]}']
-            ],
-
-            ...
-
-            [
-                [radolon_hour_0, radolon_hour_1, ..., radolon_hour_x],
-                40,
-                '{"type":"Polygon","coordinates":[coordinates_for_polygon_x]}']
-            ]
-        ]
+        RadolanGrid: grid of radolan data containing the hourly radolan values of every cell
+        it rained in, one value for each hour from limit_days days ago until yesterday
     """
     logging.info(f"Building radolan grid for last {limit_days} days...")
+    end_date = datetime.now() + timedelta(days=-1)
+    end_date = end_date.replace(hour=23, minute=50, second=0, microsecond=0)
+    start_date = datetime.now() + timedelta(days=-limit_days)
+    start_date = start_date.replace(hour=0, minute=50, second=0, microsecond=0)
+
+    precipitation_cube = get_precipitation_cube(db_conn)
+    if precipitation_cube is not None:
+        return build_radolan_grid_from_cube(
+            precipitation_cube, start_date, end_date, db_conn
+        )
+
     grid = []
     with db_conn.cursor() as cur:
-        cur.execute(
-            """
-            SELECT
-                radolan_geometry.id AS geometry_id,
-                ST_AsGeoJSON(radolan_geometry.geometry) AS geometry_geojson,
-                ARRAY_AGG(radolan_data.measured_at) AS measured_at,
-                ARRAY_AGG(radolan_data.value) AS value
-            FROM
-                radolan_geometry
-                JOIN radolan_data ON radolan_geometry.id = radolan_data.geom_id
-            WHERE
-                radolan_data.measured_at > NOW() - INTERVAL '{} days'
-            GROUP BY
-                radolan_geometry.id,
-                radolan_geometry.geometry;
-            """.format(
-                limit_days
-            )
-        )
+        cur.execute(RADOLAN_GRID_SQL, (limit_days,))
         grid = cur.fetchall()
         db_conn.commit()
 
-    end_date = datetime.now() + timedelta(days=-1)
-    end_date = end_date.replace(hour=23, minute=50, second=0, microsecond=0)
-    start_date = datetime.now() + timedelta(days=-limit_days)
-    start_date = start_date.replace(hour=0, minute=50, second=0, microsecond=0)
+    # Hours without value in radolan_data stay 0
+    hours = int((end_date - start_date).total_seconds() // 3600) + 1
+    values = numpy.zeros((len(grid), hours), dtype=numpy.int32)
+    for cell_index, (_, measured_dates, measured_radolan_values) in enumerate(grid):
+        for date, value in zip(measured_dates, measured_radolan_values):
+            hour_index = (date - start_date).total_seconds() / 3600
+            if hour_index.is_integer() and 0 <= hour_index < hours:
+                values[cell_index, int(hour_index)] = value
 
-    grid_radolan_values = []
-    for cell in grid:
-        measured_dates = cell[2]
-        measured_radolan_values = cell[3]
-        radolan_values_for_cell = []
-        loop_date = start_date
-        while loop_date <= end_date:
-            found = False
-            for date_index, date in enumerate(measured_dates):
-                if loop_date == date:
-                    found = True
-                    radolan_values_for_cell.append(measured_radolan_values[date_index])
-            if found == False:
-                radolan_values_for_cell.append(0)
-            loop_date += timedelta(hours=1)
-        grid_radolan_values.append(radolan_values_for_cell)
+    geom_ids = numpy.array([cell[0] for cell in grid], dtype=numpy.int32)
+    return RadolanGrid(geom_ids, values, start_date=start_date)
 
-    formatted_grid_radolan_values = []
-    for cell_index, cell in enumerate(grid):
-        formatted_grid_radolan_values.append(
-            [
-                grid_radolan_values[cell_index],
-                sum(grid_radolan_values[cell_index]),
-                cell[1],
-            ]
-        )
 
-    return formatted_grid_radolan_values
+def build_radolan_grid_from_cube(precipitation_cube, start_date, end_date, db_conn):
+    """Builds the radolan grid from the precipitation cube instead of aggregating radolan_data
+
+    Args:
+        precipitation_cube (PrecipitationCube): the cube
+        start_date (datetime): first hour of the grid
+        end_date (datetime): last hour of the grid
+        db_conn (_type_): the database connection
+
+    Returns:
+        RadolanGrid: grid of radolan data, same as build_radolan_grid
+    """
+    # A fresh cube or a window reaching before the cube would drop the synced hours
+    precipitation_cube.cover(start_date, end_date)
+    sync_precipitation_cube(precipitation_cube, start_date, end_date, db_conn)
+
+    # (hours x cells) view into the memory map, only the cells it rained in are copied
+    window = precipitation_cube.window(start_date, end_date)
+    cell_sums = window.sum(axis=0, dtype=numpy.int64)
+    columns = numpy.flatnonzero(cell_sums)
+    return RadolanGrid(
+        precipitation_cube.geom_ids[columns],
+        numpy.ascontiguousarray(window[:, columns].T),
+        cell_sums[columns],
+        start_date,
+    )
@@ -0,0 +1,216 @@
+import re
+import os
+import json
+import time
+import logging
+import threading
+import psycopg2
+import psycopg2.extensions
+
+# Statements which can be explained inside a savepoint without side effects
+EXPLAINABLE_STATEMENTS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def fingerprint_statement(query):
+    """Normalizes a SQL statement so that executions differing only in literals share a fingerprint
+
+    Args:
+        query (str|bytes): the SQL statement, with or without bound parameters
+
+    Returns:
+        str: the normalized statement
+    """
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", errors="replace")
+    query = re.sub(r"--[^\n]*", " ", query)
+    query = re.sub(r"/\*.*?\*/", " ", query, flags=re.S)
+    query = re.sub(r"'(?:[^']|'')*'", "?", query)
+    query = re.sub(r"%\(\w+\)s|%s", "?", query)
+    query = re.sub(r"\b\d+(?:\.\d+)?\b", "?", query)
+    query = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", query)
+    query = re.sub(r"\(\?\)(?:\s*,\s*\(\?\))+", "(?), ...", query)
+    query = re.sub(r"ARRAY\[[^\]]*\]", "ARRAY[?]", query)
+    query = re.sub(r"\s+", " ", query).strip().rstrip(";").strip()
+    # psycopg2.extras.execute_batch joins many statements into one execute call
+    statements = []
+    for statement in query.split(";"):
+        statement = statement.strip()
+        if statement and (not statements or statements[-1] != statement):
+            statements.append(statement)
+    return "; ".join(statements)
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    index = int(round((len(sorted_values) - 1) * percentile / 100.0))
+    return sorted_values[index]
+
+
+class StatementProfiler:
+    """Aggregates duration and rowcount of executed SQL statements per fingerprint"""
+
+    def __init__(self, explain_threshold_ms=None):
+        self.explain_threshold_ms = explain_threshold_ms
+        self.statements = {}
+        self.lock = threading.Lock()
+
+    def record(self, query, duration_ms, rowcount, failed=False):
+        fingerprint = fingerprint_statement(query)
+        with self.lock:
+            statement = self.statements.setdefault(
+                fingerprint,
+                {"durations_ms": [], "rows": 0, "failures": 0, "explain": None},
+            )
+            statement["durations_ms"].append(duration_ms)
+            statement["rows"] += max(rowcount or 0, 0)
+            statement["failures"] += 1 if failed else 0
+        return fingerprint
+
+    def wants_explain(self, fingerprint, query, duration_ms):
+        if self.explain_threshold_ms is None or duration_ms < self.explain_threshold_ms:
+            return False
+        if isinstance(query, bytes):
+            query = query.decode("utf-8", errors="replace")
+        if not query.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS):
+            return False
+        # Statements joined by execute_batch can't be explained as a whole
+        if ";" in query.strip().rstrip(";"):
+            return False
+        with self.lock:
+            return self.statements[fingerprint]["explain"] is None
+
+    def set_explain(self, fingerprint, plan):
+        with self.lock:
+            self.statements[fingerprint]["explain"] = plan
+
+    def summary(self):
+        """Builds per fingerprint statistics, slowest total time first
+
+        Returns:
+            list[dict]: statement statistics
+        """
+        with self.lock:
+            statements = list(self.statements.items())
+        summary = []
+        for fingerprint, statement in statements:
+            durations = sorted(statement["durations_ms"])
+            summary.append(
+                {
+                    "fingerprint": fingerprint,
+                    "count": len(durations),
+                    "failures": statement["failures"],
+                    "rows": statement["rows"],
+                    "total_ms": sum(durations),
+                    "p50_ms": _percentile(durations, 50),
+                    "p95_ms": _percentile(durations, 95),
+                    "max_ms": durations[-1] if durations else None,
+                    "explain": statement["explain"],
+                }
+            )
+        summary.sort(key=lambda statement: -statement["total_ms"])
+        return summary
+
+    def log_summary(self, limit=15):
+        """Logs the slowest statement fingerprints and writes the full summary
+        to DB_PROFILE_REPORT_FILE if set
+
+        Args:
+            limit (int): number of fingerprints to log
+        """
+        summary = self.summary()
+        logging.info(f"🗄 SQL profile of {len(summary)} distinct statements:")
+        for statement in summary[:limit]:
+            logging.info(
+                f"  {statement['count']}x total={statement['total_ms']:.0f}ms p50={statement['p50_ms']:.1f}ms "
+                f"p95={statement['p95_ms']:.1f}ms max={statement['max_ms']:.1f}ms rows={statement['rows']}: "
+                f"{statement['fingerprint'][:160]}"
+            )
+            if statement["explain"] is not None:
+                logging.info("\n".join(statement["explain"]))
+        report_file = os.getenv("DB_PROFILE_REPORT_FILE")
+        if report_file:
+            with open(report_file, "w") as out:
+                json.dump(summary, out, indent=2)
+            logging.info(f"Written SQL profile to {report_file}")
+
+
+class ProfilingCursor(psycopg2.extensions.cursor):
+    """Cursor recording every execute with the profiler of its connection"""
+
+    def execute(self, query, vars=None):
+        return self._profile(query, vars, super().execute, (query, vars))
+
+    def executemany(self, query, vars_list):
+        return self._profile(query, None, super().executemany, (query, vars_list))
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._profile(sql, None, super().copy_expert, (sql, file, size))
+
+    def _profile(self, query, vars, method, args):
+        profiler = self.connection.profiler
+        start = time.perf_counter()
+        try:
+            result = method(*args)
+        except Exception:
+            profiler.record(query, (time.perf_counter() - start) * 1000, 0, True)
+            raise
+        duration_ms = (time.perf_counter() - start) * 1000
+        # psycopg2.extras.execute_values and execute_batch pass the composed query as bytes
+        if isinstance(query, bytes):
+            query = query.decode("utf-8", errors="replace")
+        fingerprint = profiler.record(query, duration_ms, self.rowcount)
+        if profiler.wants_explain(fingerprint, query, duration_ms):
+            profiler.set_explain(fingerprint, self._explain(query, vars))
+        return result
+
+    def _explain(self, query, vars):
+        """Runs EXPLAIN (ANALYZE, BUFFERS) for the given statement inside a savepoint
+        which is rolled back, so data modifying statements don't take effect twice.
+        Failures are reported in the plan, the profiler never fails the profiled statement.
+        """
+        connection = self.connection
+        if connection.autocommit and not query.lstrip().upper().startswith("SELECT"):
+            return ["(not explained: data modifying statement in autocommit mode)"]
+        with connection.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+            try:
+                if not connection.autocommit:
+                    cur.execute("SAVEPOINT db_profiler_explain;")
+                try:
+                    cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, vars)
+                    plan = [row[0] for row in cur.fetchall()]
+                except Exception as e:
+                    plan = [f"(not explained: {e})"]
+                finally:
+                    if not connection.autocommit:
+                        cur.execute("ROLLBACK TO SAVEPOINT db_profiler_explain;")
+                        cur.execute("RELEASE SAVEPOINT db_profiler_explain;")
+            except Exception as e:
+                logging.warning(f"SQL profiler could not explain a statement: {e}")
+                plan = [f"(not explained: {e})"]
+        return plan
+
+
+class ProfilingConnection(psycopg2.extensions.connection):
+    """Connection handing out ProfilingCursors by default.
+    Use as psycopg2.connect(dsn, connection_factory=ProfilingConnection)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profiler = statement_profiler
+        self.cursor_factory = ProfilingCursor
+
+
+def explain_threshold_from_env():
+    """Reads the EXPLAIN threshold from DB_PROFILE_EXPLAIN_MS
+
+    Returns:
+        float: threshold in milliseconds or None if EXPLAIN capturing is disabled
+    """
+    threshold = os.getenv("DB_PROFILE_EXPLAIN_MS")
+    return float(threshold) if threshold else None
+
+
+# Shared profiler of all profiling connections of the current run
+statement_profiler = StatementProfiler(explain_threshold_from_env())
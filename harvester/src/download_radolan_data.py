@@ -5,22 +5,41 @@ import os
 import gzip
 import tarfile
 import shutil
+from radolan_binary import convert_radolan_binary_to_ascii
+
+# Format of the downloaded radolan files: "asc" for the ASCII export or "binary" for the
+# about 4x smaller binary RW composite, which is decoded into the ASCII format after download
+RADOLAN_FORMAT = os.getenv("RADOLAN_FORMAT", "asc")
 
 # We are using Radolan data from DWD
 # https://www.dwd.de/DE/leistungen/radolan/radolan.html
 # https://opendata.dwd.de/climate_environment/CDC/grids_germany/hourly/radolan/recent/asc/DESCRIPTION_gridsgermany-hourly-radolan-recent-asc_en.pdf
 url = f"https://opendata.dwd.de/climate_environment/CDC/grids_germany/hourly/radolan/recent/asc"
 
+# The binary composite is published as one gzip compressed file per hour, e.g. raa01-rw_10000-2401010050-dwd---bin.gz
+binary_url = "https://opendata.dwd.de/climate_environment/CDC/grids_germany/hourly/radolan/recent/bin"
+
+# The operational RW product of the last two days, one bzip2 compressed binary file per hour,
+# e.g. raa01-rw_10000-2401011250-dwd---bin.bz2, available shortly after the hour
+latest_url = "https://opendata.dwd.de/weather/radar/radolan/rw"
+
+# Older data is published as monthly archives containing the daily archives, e.g. historical/asc/2019/RW-201901.tar
+historical_url = "https://opendata.dwd.de/climate_environment/CDC/grids_germany/hourly/radolan/historical/asc"
+
 
-def download_radolan_data(start_date, end_date, path):
+def download_radolan_data(start_date, end_date, path, radolan_format=RADOLAN_FORMAT):
     """Download Radolan data from DWD
     Args:
         start_date (str): The first day to download Radolan data for
         end_date (str): The last day to download Radolan data for
         path (str): The full path where the downloaded files should be stored
+        radolan_format (str): "asc" or "binary", defaults to RADOLAN_FORMAT
     Returns:
         list[str]: List of file paths of the downloaded files. Each file contains zipped Radolan data files for each hour of the day.
     """
+    if radolan_format == "binary":
+        return download_radolan_binary_data(start_date, end_date, path)
+
     downloaded_files = []
     while start_date <= end_date:
         date_str = start_date.strftime("%Y%m%d")
@@ -39,10 +58,56 @@ def download_radolan_data(start_date, end_date, path):
     return downloaded_files
 
 
+def download_radolan_binary_data(start_date, end_date, path):
+    """Download the binary Radolan composites from DWD
+    Args:
+        start_date (str): The first day to download Radolan data for
+        end_date (str): The last day to download Radolan data for
+        path (str): The full path where the downloaded files should be stored
+    Returns:
+        list[str]: List of file paths of the downloaded files. Each file contains the binary Radolan data of one hour.
+    """
+    downloaded_files = []
+    while start_date <= end_date:
+        for hour in range(24):
+            file_name = f"raa01-rw_10000-{start_date:%y%m%d}{hour:02d}50-dwd---bin.gz"
+            download_url = f"{binary_url}/{file_name}"
+            dest_file = os.path.join(path, file_name)
+            try:
+                urllib.request.urlretrieve(download_url, dest_file)
+                downloaded_files.append(dest_file)
+                logging.info(f"Downloading {download_url}")
+            except Exception as e:
+                logging.info(f"Skipping download {download_url}: {e}")
+        start_date += timedelta(days=1)
+
+    return downloaded_files
+
+
+def download_latest_radolan_hour(measured_at, path):
+    """Download the operational binary Radolan composite of one hour from DWD
+    Args:
+        measured_at (datetime): The hour (UTC, minute 50) to download
+        path (str): The full path where the downloaded file should be stored
+    Returns:
+        str: File path of the downloaded file or None if DWD didn't publish the hour (yet)
+    """
+    file_name = f"raa01-rw_10000-{measured_at:%y%m%d%H%M}-dwd---bin.bz2"
+    download_url = f"{latest_url}/{file_name}"
+    dest_file = os.path.join(path, file_name)
+    try:
+        urllib.request.urlretrieve(download_url, dest_file)
+        logging.info(f"Downloading {download_url}")
+        return dest_file
+    except Exception as e:
+        logging.info(f"Skipping download {download_url}: {e}")
+        return None
+
+
 def unzip_radolan_data(zipped_radar_files, root_path):
     """Extract the previously downloaded Radolan files to get the hourly Radolan files
     Args:
-        zipped_radar_files (list[str]): List of zipped Radolan files
+        zipped_radar_files (list[str]): List of zipped Radolan files or binary hourly Radolan files
         root_path (str): Path where the extracted files should be stored
     Returns:
         list[str]: List of paths to the extracted Radolan files. Each file contains the hourly Radolan data.
@@ -64,6 +129,11 @@ def unzip_radolan_data(zipped_radar_files, root_path):
 
             os.remove(filename[:-3])
             logging.info(f"Extracting hourly Radolan files from: {filename}...")
+        elif filename.endswith("-dwd---bin.gz"):
+            # Decode binary composites into the ASCII format of the downstream stages
+            convert_radolan_binary_to_ascii(filename, os.path.dirname(filename))
+            os.remove(filename)
+            logging.info(f"Decoding hourly Radolan file: {filename}...")
 
     unzipped_files = [
         os.path.join(root, file)
@@ -72,3 +142,29 @@ def unzip_radolan_data(zipped_radar_files, root_path):
     ]
 
     return unzipped_files
+
+
+def stream_historical_radolan_month(year, month, path):
+    """Streams the monthly historical Radolan archive from DWD without storing it.
+       The daily archives it contains are written to path one at a time.
+    Args:
+        year (int): year of the archive
+        month (int): month of the archive
+        path (str): The full path where the daily archives should be stored
+    Yields:
+        str: file path of the next daily archive, the caller is responsible for deleting it
+    Raises:
+        urllib.error.HTTPError: If DWD doesn't publish a historical archive for the month.
+    """
+    download_url = f"{historical_url}/{year}/RW-{year}{month:02d}.tar"
+    logging.info(f"Streaming {download_url}")
+    with urllib.request.urlopen(download_url) as response:
+        # "r|" reads the archive sequentially, so it is never held in memory or on disk as a whole
+        with tarfile.open(fileobj=response, mode="r|") as tar:
+            for member in tar:
+                if not member.isfile() or not member.name.endswith(".tar.gz"):
+                    continue
+                dest_file = os.path.join(path, os.path.basename(member.name))
+                with open(dest_file, "wb") as f_out:
+                    shutil.copyfileobj(tar.extractfile(member), f_out)
+                yield dest_file
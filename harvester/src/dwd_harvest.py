@@ -1,5 +1,7 @@
 from datetime import datetime
 import tempfile
+import logging
+import os
 from download_radolan_data import download_radolan_data, unzip_radolan_data
 from project_radolan_data import project_radolan_data, polygonize_data
 from extract_radolan_data import extract_radolan_data_from_shapefile
@@ -9,6 +11,102 @@ from radolan_db_utils import (
     update_harvest_dates,
 )
 from build_radolan_grid import build_radolan_grid
+from harvest_metrics import metrics
+from schema_check import analyze_tables
+from radolan_checkpoints import (
+    get_missing_hours,
+    get_retention_days,
+    cleanup_checkpoints,
+    format_hours,
+)
+from precipitation_cube import get_precipitation_cube
+from radolan_window import crop_radolan_ascii
+
+# Crop the Germany-wide grids to the area of interest before projecting them
+RADOLAN_WINDOWED_READ = os.getenv("RADOLAN_WINDOWED_READ", "True") == "True"
+
+
+def get_measured_at_timestamp(hourly_radolan_file):
+    """Parses the hour from the name of an hourly radolan file, e.g. RW_20240101-0050.asc
+
+    Args:
+        hourly_radolan_file (str): path to the hourly radolan file
+
+    Returns:
+        datetime: the hour the values were measured at
+    """
+    filename = hourly_radolan_file.split("/")[-1]
+    return datetime.strptime(filename, "RW_%Y%m%d-%H%M.asc")
+
+
+def extract_hourly_radolan_values(
+    hourly_radolan_file,
+    measured_at_timestamp,
+    surrounding_shape_file,
+    windowed_read=RADOLAN_WINDOWED_READ,
+):
+    """Projects, polygonizes and extracts the radolan values of one hourly file for the area of interest
+
+    Args:
+        hourly_radolan_file (str): path to the hourly radolan file
+        measured_at_timestamp (datetime): the hour the values were measured at
+        surrounding_shape_file (shapefile): shapefile for area of interest
+        windowed_read (bool): crop the file to the area of interest first, False if it is cropped already
+
+    Returns:
+        _type_: list of extracted radolan values
+    """
+    with tempfile.TemporaryDirectory() as hourly_temp_dir:
+
+        # Only read the rows and columns around the area of interest
+        if windowed_read:
+            with metrics.stage("crop") as stage:
+                stage.add_file(hourly_radolan_file)
+                hourly_radolan_file = crop_radolan_ascii(
+                    hourly_radolan_file, surrounding_shape_file, hourly_temp_dir
+                )
+
+        # Generate projected GeoTIFF file containing projected data for given shape file only
+        with metrics.stage("project") as stage:
+            stage.add_file(hourly_radolan_file)
+            projected_radolan_geotiff = project_radolan_data(
+                hourly_radolan_file, surrounding_shape_file, hourly_temp_dir
+            )
+
+        # Polygonize given GeoTIFF file
+        with metrics.stage("polygonize") as stage:
+            stage.add_file(projected_radolan_geotiff)
+            polygonized_radolan = polygonize_data(
+                projected_radolan_geotiff, hourly_temp_dir
+            )
+
+        # Extract Radolan data
+        with metrics.stage("extract") as stage:
+            extracted_radolan_values = extract_radolan_data_from_shapefile(
+                polygonized_radolan, measured_at_timestamp
+            )
+            stage.add_rows(len(extracted_radolan_values))
+
+        return extracted_radolan_values
+
+
+def cleanup_radolan_data(limit_days, database_connection):
+    """Deletes old and duplicated radolan data and checkpoints, trims the precipitation cube
+       and refreshes the planner statistics after the bulk load and cleanup.
+    Args:
+        limit_days (number): number of previous days to harvest data for
+        database_connection (_type_): database connection
+    Returns:
+        int: number of deleted radolan_data rows
+    """
+    retention_days = get_retention_days(limit_days)
+    deleted_rows = cleanup_radolan_entries(retention_days, database_connection)
+    cleanup_checkpoints(retention_days, database_connection)
+    precipitation_cube = get_precipitation_cube(database_connection)
+    if precipitation_cube is not None:
+        precipitation_cube.trim(limit_days)
+    analyze_tables(["radolan_data"], database_connection)
+    return deleted_rows
 
 
 def harvest_dwd(
@@ -23,47 +121,72 @@ def harvest_dwd(
         limit_days (number): number of previous days to harvest data for
         database_connection (_type_): database connection
     Returns:
-        _type_: grid of radolan data
+        RadolanGrid: grid of radolan data
     """
+    # Resume from the first hour which is not fully loaded yet
+    missing_hours = get_missing_hours(start_date, end_date, database_connection)
+    missing_days = sorted(set(hour.date() for hour in missing_hours))
+    missing_hours = set(missing_hours)
+    logging.info(
+        f"{len(missing_hours)} hours in {len(missing_days)} days are not loaded yet"
+    )
+
     with tempfile.TemporaryDirectory() as temp_dir:
 
         # Download daily Radolan files from DWD for whole Germany
-        daily_radolan_files = download_radolan_data(start_date, end_date, temp_dir)
+        with metrics.stage("download") as stage:
+            daily_radolan_files = []
+            for missing_day in missing_days:
+                day = datetime.combine(missing_day, datetime.min.time())
+                daily_radolan_files += download_radolan_data(day, day, temp_dir)
+            for daily_radolan_file in daily_radolan_files:
+                stage.add_file(daily_radolan_file)
 
         # Extract downloaded daily Radolan files into hourly Radolan data files
-        hourly_radolan_files = unzip_radolan_data(daily_radolan_files, temp_dir)
+        with metrics.stage("unzip") as stage:
+            hourly_radolan_files = unzip_radolan_data(daily_radolan_files, temp_dir)
+            stage.add_rows(len(hourly_radolan_files))
+            for hourly_radolan_file in hourly_radolan_files:
+                stage.add_file(hourly_radolan_file)
 
         # Process all hourly Radolan files
         for hourly_radolan_file in hourly_radolan_files:
 
-            filename = hourly_radolan_file.split("/")[-1]
-            measured_at_timestamp = datetime.strptime(filename, "RW_%Y%m%d-%H%M.asc")
+            measured_at_timestamp = get_measured_at_timestamp(hourly_radolan_file)
 
-            with tempfile.TemporaryDirectory() as hourly_temp_dir:
+            # Skip hours which were loaded by a previous run
+            if measured_at_timestamp not in missing_hours:
+                continue
 
-                # Generate projected GeoTIFF file containing projected data for given shape file only
-                projected_radolan_geotiff = project_radolan_data(
-                    hourly_radolan_file, surrounding_shape_file, hourly_temp_dir
-                )
-
-                # Polygonize given GeoTIFF file
-                polygonized_radolan = polygonize_data(
-                    projected_radolan_geotiff, hourly_temp_dir
-                )
+            extracted_radolan_values = extract_hourly_radolan_values(
+                hourly_radolan_file, measured_at_timestamp, surrounding_shape_file
+            )
 
-                # Extract Radolan data
-                extracted_radolan_values = extract_radolan_data_from_shapefile(
-                    polygonized_radolan, measured_at_timestamp
+            # Update Radolan data in DB
+            with metrics.stage("upload") as stage:
+                upload_radolan_data_in_db(
+                    extracted_radolan_values,
+                    measured_at_timestamp,
+                    database_connection,
                 )
+                stage.add_rows(len(extracted_radolan_values))
 
-                # Update Radolan data in DB
-                upload_radolan_data_in_db(extracted_radolan_values, database_connection)
+        # Hours still missing, e.g. because DWD didn't publish them yet
+        still_missing_hours = get_missing_hours(start_date, end_date, database_connection)
+        if still_missing_hours:
+            logging.warning(
+                f"{len(still_missing_hours)} hours could not be loaded: {', '.join(format_hours(still_missing_hours))}"
+            )
 
         # After all database inserts, cleanup db
-        _ = cleanup_radolan_entries(limit_days, database_connection)
+        with metrics.stage("cleanup") as stage:
+            stage.add_rows(cleanup_radolan_data(limit_days, database_connection))
 
         # Build radolan grid based on database values
-        radolan_grid = build_radolan_grid(limit_days, database_connection)
+        with metrics.stage("grid_build") as stage:
+            radolan_grid = build_radolan_grid(limit_days, database_connection)
+            stage.add_rows(len(radolan_grid))
+            stage.add_bytes(radolan_grid.nbytes)
 
         # Update end_date of latest harvest
         _ = update_harvest_dates(start_date, end_date, database_connection)
@@ -1,10 +1,9 @@
 import geopandas
-from shapely.wkt import dumps
 import logging
 
 
 # Resources:
-# https://epsg.io/3857
+# https://epsg.io/4326
 # https://doc.arcgis.com/en/arcgis-online/reference/shapefiles.htm
 def extract_radolan_data_from_shapefile(polygonized_shape_file, measured_at_timestamp):
     """Extract radolon values from given shapefile
@@ -14,24 +13,24 @@ def extract_radolan_data_from_shapefile(polygonized_shape_file, measured_at_time
         measured_at_timestamp (_type_): the timestamp of the extraction
 
     Returns:
-        _type_: list of extracted radolon data for each cell in the shapefile
+        _type_: list of WKB geometry in EPSG:4326, value and timestamp for each cell with precipitation
     """
     logging.info(f"Extracting radolan data for {polygonized_shape_file}...")
     radolan_field_key = "RDLFIELD"
     df = geopandas.read_file(polygonized_shape_file)
-    df = df.to_crs("epsg:3857")
-    values = []
-    if df["geometry"].count() > 0:
-        radolan_data = df[
-            (df[radolan_field_key] > 0) & (df[radolan_field_key].notnull())
-        ]
-        if len(radolan_data) > 0:
-            for _, row in radolan_data.iterrows():
-                values.append(
-                    [
-                        dumps(row.geometry, rounding_precision=5),
-                        row[radolan_field_key],
-                        measured_at_timestamp,
-                    ]
-                )
-    return values
+    if len(df) == 0:
+        return []
+
+    # Filter with array masks first, only the cells with precipitation are reprojected
+    radolan_data = df[df[radolan_field_key].notnull() & (df[radolan_field_key] > 0)]
+    if len(radolan_data) == 0:
+        return []
+
+    # The database stores 4326, so the cells are reprojected once here and sent as WKB
+    radolan_data = radolan_data.to_crs("epsg:4326")
+    return [
+        [geometry.wkb, value, measured_at_timestamp]
+        for geometry, value in zip(
+            radolan_data.geometry.values, radolan_data[radolan_field_key].tolist()
+        )
+    ]
@@ -0,0 +1,325 @@
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+
+# Interval of the resident set size samples taken while stages are running
+METRICS_RSS_SAMPLE_SECONDS = float(os.getenv("METRICS_RSS_SAMPLE_SECONDS", "0.1"))
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _max_rss_bytes(who):
+    """Returns the peak resident set size for the given rusage target in bytes. This is the
+    high-water mark of the whole process (or of the largest child), it never decreases.
+
+    Args:
+        who (int): resource.RUSAGE_SELF or resource.RUSAGE_CHILDREN
+
+    Returns:
+        int: peak resident set size in bytes
+    """
+    max_rss = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _current_rss_bytes():
+    """Returns the current resident set size of the harvester in bytes
+
+    Returns:
+        int: current resident set size, None where /proc is not available (macOS)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _children_cpu_seconds():
+    """Returns the CPU time consumed by terminated child processes (gdalwarp, tippecanoe, ...)
+
+    Returns:
+        float: user + system CPU seconds of all waited-for child processes
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class StageRecord:
+    """Counters of a single stage execution, handed out by HarvestMetrics.stage"""
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.start_rss = None
+        self.peak_rss = None
+
+    def sample_rss(self, rss):
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def add_rows(self, rows):
+        self.rows += rows or 0
+
+    def add_bytes(self, num_bytes):
+        self.bytes += num_bytes or 0
+
+    def add_file(self, path):
+        if path is not None and os.path.exists(path):
+            self.bytes += os.path.getsize(path)
+
+
+class HarvestMetrics:
+    """Collects wall time, CPU time, processed rows/bytes and peak memory per pipeline stage.
+
+    Stages with the same name (e.g. "project" for every hourly file) are aggregated. The
+    memory of a stage is sampled from the current resident set size while it runs, stages
+    running concurrently in other threads share the process and see each other's memory.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.stages = {}
+        self.lock = threading.Lock()
+        self._running = set()
+        self._sampler = None
+
+    def _sample_running_stages(self):
+        while True:
+            time.sleep(METRICS_RSS_SAMPLE_SECONDS)
+            rss = _current_rss_bytes()
+            with self.lock:
+                for record in self._running:
+                    record.sample_rss(rss)
+
+    def _start_sampling(self, record):
+        rss = _current_rss_bytes()
+        record.start_rss = rss
+        record.sample_rss(rss)
+        if rss is None:
+            return
+        with self.lock:
+            self._running.add(record)
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample_running_stages, daemon=True
+                )
+                self._sampler.start()
+
+    def _stop_sampling(self, record):
+        with self.lock:
+            self._running.discard(record)
+        record.sample_rss(_current_rss_bytes())
+
+    @contextmanager
+    def stage(self, name):
+        """Measures the wrapped block as an execution of the given stage
+
+        Args:
+            name (str): the stage name, e.g. "download" or "tree_update"
+
+        Yields:
+            StageRecord: record to add processed rows and bytes to
+        """
+        record = StageRecord()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        children_cpu_start = _children_cpu_seconds()
+        self._start_sampling(record)
+        failed = False
+        try:
+            yield record
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._stop_sampling(record)
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = (time.thread_time() - cpu_start) + (
+                _children_cpu_seconds() - children_cpu_start
+            )
+            self._record(name, record, wall_seconds, cpu_seconds, failed)
+
+    def _record(self, name, record, wall_seconds, cpu_seconds, failed):
+        with self.lock:
+            stage = self.stages.setdefault(
+                name,
+                {
+                    "calls": 0,
+                    "failures": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "rows": 0,
+                    "bytes": 0,
+                    "peak_rss_bytes": None,
+                    "rss_increase_bytes": None,
+                    "process_peak_rss_bytes": 0,
+                    "children_process_peak_rss_bytes": 0,
+                },
+            )
+            stage["calls"] += 1
+            stage["failures"] += 1 if failed else 0
+            stage["wall_seconds"] += wall_seconds
+            stage["cpu_seconds"] += cpu_seconds
+            stage["rows"] += record.rows
+            stage["bytes"] += record.bytes
+            # Highest sampled RSS during the stage and its increase over the RSS at the start
+            if record.peak_rss is not None:
+                stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"] or 0, record.peak_rss)
+                stage["rss_increase_bytes"] = max(
+                    stage["rss_increase_bytes"] or 0, record.peak_rss - record.start_rss
+                )
+            # High-water marks of the whole process so far, not specific to the stage
+            stage["process_peak_rss_bytes"] = _max_rss_bytes(resource.RUSAGE_SELF)
+            stage["children_process_peak_rss_bytes"] = _max_rss_bytes(
+                resource.RUSAGE_CHILDREN
+            )
+        logging.debug(
+            f"⏱ Stage {name} took {wall_seconds:.2f}s wall, {cpu_seconds:.2f}s CPU, rows={record.rows}, bytes={record.bytes}"
+        )
+
+    def report(self, success):
+        """Builds the run report
+
+        Args:
+            success (bool): whether the run finished successfully
+
+        Returns:
+            dict: run report containing all stage metrics
+        """
+        with self.lock:
+            stages = {name: dict(values) for name, values in self.stages.items()}
+        for values in stages.values():
+            wall_seconds = values["wall_seconds"]
+            values["rows_per_second"] = (
+                values["rows"] / wall_seconds if wall_seconds > 0 else None
+            )
+            values["bytes_per_second"] = (
+                values["bytes"] / wall_seconds if wall_seconds > 0 else None
+            )
+        return {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now().isoformat(),
+            "success": success,
+            "wall_seconds": (datetime.now() - self.started_at).total_seconds(),
+            "peak_rss_bytes": _max_rss_bytes(resource.RUSAGE_SELF),
+            "stages": stages,
+        }
+
+    def log_summary(self):
+        """Logs one line per stage, ordered by wall time"""
+        with self.lock:
+            stages = sorted(
+                self.stages.items(), key=lambda item: -item[1]["wall_seconds"]
+            )
+        for name, values in stages:
+            memory = (
+                f"peak RSS {values['peak_rss_bytes'] / 1024 / 1024:.1f} MiB "
+                f"(+{values['rss_increase_bytes'] / 1024 / 1024:.1f} MiB in stage)"
+                if values["peak_rss_bytes"] is not None
+                else f"process peak RSS {values['process_peak_rss_bytes'] / 1024 / 1024:.1f} MiB"
+            )
+            logging.info(
+                f"⏱ {name}: {values['wall_seconds']:.2f}s wall, {values['cpu_seconds']:.2f}s CPU, "
+                f"{values['calls']} calls, {values['rows']} rows, {values['bytes']} bytes, {memory}"
+            )
+
+    def write_json_report(self, path, success):
+        """Writes the run report as JSON
+
+        Args:
+            path (str): full path of the JSON file
+            success (bool): whether the run finished successfully
+        """
+        _write_atomically(path, json.dumps(self.report(success), indent=2))
+        logging.info(f"Written metrics report to {path}")
+
+    def write_prometheus_textfile(self, path, success, job="dwd_harvester"):
+        """Writes the run metrics in the Prometheus textfile collector format
+
+        Args:
+            path (str): full path of the .prom file
+            success (bool): whether the run finished successfully
+            job (str): value of the job label
+        """
+        report = self.report(success)
+        gauges = [
+            ("wall_seconds", "Wall clock seconds spent in stage"),
+            ("cpu_seconds", "CPU seconds spent in stage including child processes"),
+            ("rows", "Rows processed in stage"),
+            ("bytes", "Bytes processed in stage"),
+            ("peak_rss_bytes", "Highest sampled resident set size of the harvester during stage"),
+            (
+                "rss_increase_bytes",
+                "Increase of the resident set size of the harvester during stage",
+            ),
+            (
+                "process_peak_rss_bytes",
+                "Peak resident set size of the whole harvester run until the end of stage",
+            ),
+            (
+                "children_process_peak_rss_bytes",
+                "Peak resident set size of the largest child process until the end of stage",
+            ),
+            ("calls", "Number of executions of stage"),
+            ("failures", "Number of failed executions of stage"),
+        ]
+        lines = []
+        for key, help_text in gauges:
+            metric = f"harvester_stage_{key}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for name, values in report["stages"].items():
+                if values[key] is not None:
+                    lines.append(f'{metric}{{job="{job}",stage="{name}"}} {values[key]}')
+        lines += [
+            "# HELP harvester_run_wall_seconds Wall clock seconds of the whole run",
+            "# TYPE harvester_run_wall_seconds gauge",
+            f'harvester_run_wall_seconds{{job="{job}"}} {report["wall_seconds"]}',
+            "# HELP harvester_run_success 1 if the last run succeeded, 0 otherwise",
+            "# TYPE harvester_run_success gauge",
+            f'harvester_run_success{{job="{job}"}} {1 if success else 0}',
+            "# HELP harvester_run_timestamp_seconds Unix time the last run finished",
+            "# TYPE harvester_run_timestamp_seconds gauge",
+            f'harvester_run_timestamp_seconds{{job="{job}"}} {time.time()}',
+        ]
+        _write_atomically(path, "\n".join(lines) + "\n")
+        logging.info(f"Written Prometheus metrics to {path}")
+
+    def write_reports(self, success):
+        """Logs the stage summary and writes the reports configured via
+        METRICS_REPORT_FILE and METRICS_PROMETHEUS_FILE
+
+        Args:
+            success (bool): whether the run finished successfully
+        """
+        self.log_summary()
+        report_file = os.getenv("METRICS_REPORT_FILE")
+        prometheus_file = os.getenv("METRICS_PROMETHEUS_FILE")
+        try:
+            if report_file:
+                self.write_json_report(report_file, success)
+            if prometheus_file:
+                self.write_prometheus_textfile(prometheus_file, success)
+        except OSError as e:
+            logging.error(f"Could not write metrics: {e}")
+
+
+def _write_atomically(path, content):
+    # Prometheus' textfile collector must never see half-written files
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as out:
+        out.write(content)
+    os.replace(tmp_path, path)
+
+
+# Shared metrics of the current harvester run
+metrics = HarvestMetrics()
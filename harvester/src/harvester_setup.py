@@ -0,0 +1,102 @@
+import os
+import logging
+import psycopg2
+import psycopg2.pool
+from db_profiler import ProfilingConnection
+
+DATABASE_ENV_VARS = ["PG_SERVER", "PG_PORT", "PG_USER", "PG_PASS", "PG_DB"]
+
+
+def find_missing_environment_variables(env_vars):
+    """Checks if all given environmental variables are accessible
+
+    Args:
+        env_vars (list[str]): names of the required environmental variables
+
+    Returns:
+        list[str]: names of the missing environmental variables
+    """
+    missing_env_vars = [env_var for env_var in env_vars if env_var not in os.environ]
+    for env_var in missing_env_vars:
+        logging.error("❌Environmental Variable {} does not exist".format(env_var))
+    return missing_env_vars
+
+
+def get_database_connection_str(settings=None, schema=None):
+    """Builds the database connection string from the PG_* environmental variables
+
+    Args:
+        settings (dict): PG_* settings overriding the environmental variables
+        schema (str): schema to use instead of public, e.g. for one region of several
+
+    Returns:
+        str: the libpq connection string
+    """
+    settings = {**os.environ, **(settings or {})}
+    connection_str = "host='{}' port={} user='{}' password='{}' dbname='{}'".format(
+        settings.get("PG_SERVER"),
+        settings.get("PG_PORT"),
+        settings.get("PG_USER"),
+        settings.get("PG_PASS"),
+        settings.get("PG_DB"),
+    )
+    if schema:
+        connection_str += " options='-c search_path={},public'".format(schema)
+    return connection_str
+
+
+def get_connection_factory():
+    """Returns the profiling connection class if DB_PROFILE is enabled
+
+    Returns:
+        type: connection class for psycopg2.connect or None for the default
+    """
+    return ProfilingConnection if os.getenv("DB_PROFILE") == "True" else None
+
+
+def connect_database(settings=None, schema=None):
+    """Establishes a database connection
+
+    Args:
+        settings (dict): PG_* settings overriding the environmental variables
+        schema (str): schema to use instead of public
+
+    Returns:
+        _type_: the database connection
+    """
+    database_connection = psycopg2.connect(
+        get_database_connection_str(settings, schema),
+        connection_factory=get_connection_factory(),
+    )
+    logging.info("🗄 Database connection established")
+    return database_connection
+
+
+def create_connection_pool(max_connections, db_conn=None):
+    """Creates a pool of database connections which can be shared between threads
+
+    Args:
+        max_connections (int): maximum number of open connections
+        db_conn (_type_): connection whose parameters (e.g. database and schema of a region)
+            the pooled connections use instead of the environmental variables
+
+    Returns:
+        psycopg2.pool.ThreadedConnectionPool: the connection pool
+    """
+    if db_conn is None:
+        connection_pool = psycopg2.pool.ThreadedConnectionPool(
+            1,
+            max_connections,
+            get_database_connection_str(),
+            connection_factory=get_connection_factory(),
+        )
+    else:
+        connection_pool = psycopg2.pool.ThreadedConnectionPool(
+            1,
+            max_connections,
+            password=db_conn.info.password,
+            connection_factory=get_connection_factory(),
+            **db_conn.info.dsn_parameters,
+        )
+    logging.info(f"🗄 Database connection pool with up to {max_connections} connections established")
+    return connection_pool
@@ -10,6 +10,73 @@ from mapbox_utils import (
     wait_for_tileset_creation_complete,
 )
 from supabase_utils import upload_file_to_supabase_storage
+from harvest_metrics import metrics
+from tile_shards import TILE_SHARDS, preprocess_trees_csv_sharded
+from tree_export_formats import TREES_EXPORT_BATCH_SIZE, create_tree_export_writers
+from radolan_cell_storage import RADOLAN_STORAGE_MODE
+from tree_export_snapshot import (
+    TREES_EXPORT_SNAPSHOT,
+    TREES_EXPORT_SNAPSHOT_SQL,
+    refresh_tree_export_snapshot,
+    drop_tree_export_snapshot,
+)
+
+# All trees within the radolan grid with their watering sum of the last 30 days and adoption state
+# WARNING: The coordinates in the database columns lat and lng are mislabeled! They mean the opposite.
+TREES_EXPORT_SQL_TEMPLATE = """
+    SELECT
+        trees.id,
+        ST_Y(geom) AS lat,
+        ST_X(geom) AS lng,
+        {radolan_sum},
+        trees.pflanzjahr,
+        COALESCE(SUM(w.amount), 0) AS watering_sum,
+        CASE WHEN COUNT(ad.uuid) = 0 THEN
+            FALSE
+        ELSE
+            TRUE
+        END AS is_adopted_by_users,
+        trees.bezirk AS district
+    FROM
+        trees
+        {radolan_join}
+        LEFT JOIN trees_watered w ON w.tree_id = trees.id
+            AND w.timestamp >= CURRENT_DATE - INTERVAL '30 days'
+            AND DATE_TRUNC('day', w.timestamp) < CURRENT_DATE
+        LEFT JOIN trees_adopted ad ON ad.tree_id = trees.id
+    WHERE
+        ST_CONTAINS(ST_SetSRID ((
+                SELECT
+                    ST_EXTENT (geometry)
+                    FROM radolan_geometry), 4326), trees.geom)
+    GROUP BY
+        trees.id,
+        trees.lat,
+        trees.lng,
+        {radolan_sum},
+        trees.pflanzjahr,
+        trees.bezirk;
+"""
+
+
+def get_trees_export_sql(storage_mode):
+    """Returns the trees export query reading radolan_sum from the trees or from their cells
+
+    Args:
+        storage_mode (str): RADOLAN_STORAGE_MODE, "trees" or "cells"
+
+    Returns:
+        str: the query
+    """
+    if storage_mode == "cells":
+        return TREES_EXPORT_SQL_TEMPLATE.format(
+            radolan_sum="radolan_cell_series.radolan_sum",
+            radolan_join="LEFT JOIN radolan_cell_series ON radolan_cell_series.geom_id = trees.radolan_geom_id",
+        )
+    return TREES_EXPORT_SQL_TEMPLATE.format(radolan_sum="trees.radolan_sum", radolan_join="")
+
+
+TREES_EXPORT_SQL = get_trees_export_sql(RADOLAN_STORAGE_MODE)
 
 
 def preprocess_trees_csv(trees_csv_full_path, temp_dir):
@@ -23,6 +90,9 @@ def preprocess_trees_csv(trees_csv_full_path, temp_dir):
     Returns:
         str: full path to the preprocessed trees file
     """
+    if TILE_SHARDS:
+        return preprocess_trees_csv_sharded(trees_csv_full_path, temp_dir)
+
     logging.info("Preprocessing trees.csv with tippecanoe...")
     trees_preprocessed_full_path = os.path.join(temp_dir, "trees-preprocessed.mbtiles")
     subprocess.call(
@@ -39,61 +109,28 @@ def preprocess_trees_csv(trees_csv_full_path, temp_dir):
     return trees_preprocessed_full_path
 
 
-def generate_trees_csv(temp_dir, db_conn):
+def generate_trees_csv(temp_dir, db_conn, export_writers=None):
     """Generate a trees.csv file containing all trees currently in the databae
 
     Args:
         temp_dir (str): the full path to the directory to store the preprocessed file
         db_conn: the database connection
+        export_writers (list): writers of further export formats getting the same rows,
+            see create_tree_export_writers
 
     Returns:
         str: full path to the trees.csv file
     """
     logging.info(f"Generating trees.csv...")
+    export_writers = export_writers or []
     current_year = datetime.now().year
-    with db_conn.cursor() as cur:
+    if TREES_EXPORT_SNAPSHOT:
+        with metrics.stage("snapshot_refresh") as stage:
+            stage.add_rows(refresh_tree_export_snapshot(db_conn))
+    else:
+        drop_tree_export_snapshot(db_conn)
 
-        # Set statement timeout to quite long because the following query can take a long time
-        cur.execute("SET LOCAL statement_timeout = '10min';")
-
-        # Fetch all trees from database
-        cur.execute(
-            # WARNING: The coordinates in the database columns lat and lng are mislabeled! They mean the opposite.
-            """
-                SELECT
-                    trees.id,
-                    ST_Y(geom) AS lat,
-                    ST_X(geom) AS lng,
-                    trees.radolan_sum,
-                    trees.pflanzjahr,
-                    COALESCE(SUM(w.amount), 0) AS watering_sum,
-                    CASE WHEN COUNT(ad.uuid) = 0 THEN
-                        FALSE
-                    ELSE
-                        TRUE
-                    END AS is_adopted_by_users,
-                    trees.bezirk AS district
-                FROM
-                    trees
-                    LEFT JOIN trees_watered w ON w.tree_id = trees.id
-                        AND w.timestamp >= CURRENT_DATE - INTERVAL '30 days'
-                        AND DATE_TRUNC('day', w.timestamp) < CURRENT_DATE
-                    LEFT JOIN trees_adopted ad ON ad.tree_id = trees.id
-                WHERE
-                    ST_CONTAINS(ST_SetSRID ((
-                            SELECT
-                                ST_EXTENT (geometry)
-                                FROM radolan_geometry), 4326), trees.geom)
-                GROUP BY
-                    trees.id,
-                    trees.lat,
-                    trees.lng,
-                    trees.radolan_sum,
-                    trees.pflanzjahr,
-                    trees.bezirk;
-            """
-        )
-        trees = cur.fetchall()
+    with db_conn.cursor() as cur:
 
         # Get all waterings that are included in the amount of waterings for the last 30 days
         cur.execute(
@@ -103,44 +140,72 @@ def generate_trees_csv(temp_dir, db_conn):
         )
         trees_watered = cur.fetchall()
 
-        logging.info(f"Creating trees.csv file for {len(trees)} trees...")
-
-        # Build CSV file with all trees in it
-        header = "id,lat,lng,radolan_sum,age,watering_sum,total_water_sum_liters,is_adopted_by_users,district"
-        lines = []
-        for tree in tqdm(trees):
-            id = tree[0]
-            lat = tree[1]
-            lng = tree[2]
-
-            # precipitation height in 0.1 mm per square meter
-            # 1mm on a square meter is 1 liter
-            # e.g. value of 380 = 0.1 * 380 = 38.0 mm * 1 liter = 38 liters
-            radolan_sum = float(tree[3]) if tree[3] != None else 0
-
-            # Age is undefined ("" for Mapbox) if pflanzjahr is None or 0
-            pflanzjahr = tree[4]
-            age = (
-                ""
-                if (pflanzjahr == None or pflanzjahr == 0)
-                else int(current_year) - int(pflanzjahr)
-            )
+        if not TREES_EXPORT_SNAPSHOT:
+            # Set statement timeout to quite long because the following query can take a long time
+            cur.execute("SET LOCAL statement_timeout = '10min';")
 
-            # total_water_sum_liters calculated in liters to be easily usable in the frontend
-            watering_sum = float(tree[5])
-            total_water_sum_liters = (radolan_sum / 10.0) + watering_sum
+    # Stream the trees with a server-side cursor instead of fetching them all at once
+    with db_conn.cursor(name="trees_export") as cur:
+        cur.itersize = TREES_EXPORT_BATCH_SIZE
+        if TREES_EXPORT_SNAPSHOT:
+            # Fetch all trees from the snapshot, a sequential scan
+            cur.execute(TREES_EXPORT_SNAPSHOT_SQL)
+        else:
+            # Fetch all trees from database
+            cur.execute(TREES_EXPORT_SQL)
 
-            is_adopted_by_users = tree[6]
-            district = tree[7]
+        logging.info("Creating trees.csv file...")
 
-            line = f"{id}, {lat}, {lng}, {radolan_sum}, {age}, {watering_sum}, {total_water_sum_liters}, {is_adopted_by_users}, {district}"
-            lines.append(line)
-        trees_csv = "\n".join([header] + lines)
+        # Build CSV file with all trees in it
+        header = "id,lat,lng,radolan_sum,age,watering_sum,total_water_sum_liters,is_adopted_by_users,district"
         trees_csv_full_path = os.path.join(temp_dir, "trees.csv")
+        trees_count = 0
         with open(trees_csv_full_path, "w") as out:
-            out.write(trees_csv)
-
-        return (trees_csv_full_path, trees_watered)
+            out.write(header)
+            for tree in tqdm(cur):
+                id = tree[0]
+                lat = tree[1]
+                lng = tree[2]
+
+                # precipitation height in 0.1 mm per square meter
+                # 1mm on a square meter is 1 liter
+                # e.g. value of 380 = 0.1 * 380 = 38.0 mm * 1 liter = 38 liters
+                radolan_sum = float(tree[3]) if tree[3] != None else 0
+
+                # Age is undefined ("" for Mapbox) if pflanzjahr is None or 0
+                pflanzjahr = tree[4]
+                age = (
+                    None
+                    if (pflanzjahr == None or pflanzjahr == 0)
+                    else int(current_year) - int(pflanzjahr)
+                )
+
+                # total_water_sum_liters calculated in liters to be easily usable in the frontend
+                watering_sum = float(tree[5])
+                total_water_sum_liters = (radolan_sum / 10.0) + watering_sum
+
+                is_adopted_by_users = tree[6]
+                district = tree[7]
+
+                csv_age = "" if age is None else age
+                line = f"{id}, {lat}, {lng}, {radolan_sum}, {csv_age}, {watering_sum}, {total_water_sum_liters}, {is_adopted_by_users}, {district}"
+                out.write("\n" + line)
+                trees_count += 1
+
+                values = (
+                    radolan_sum,
+                    age,
+                    watering_sum,
+                    total_water_sum_liters,
+                    is_adopted_by_users,
+                    district,
+                )
+                for export_writer in export_writers:
+                    export_writer.write(id, lat, lng, values)
+    db_conn.commit()
+
+    logging.info(f"Created trees.csv file for {trees_count} trees")
+    return (trees_csv_full_path, trees_watered)
 
 
 def update_mapbox_tree_layer(
@@ -155,43 +220,73 @@ def update_mapbox_tree_layer(
 ):
 
     with tempfile.TemporaryDirectory() as temp_dir:
-        # Generate trees.csv from trees in database
-        (trees_csv_full_path, trees_watered) = generate_trees_csv(temp_dir, db_conn)
+        # Generate trees.csv and the further export formats from trees in database
+        with metrics.stage("csv_export") as stage:
+            export_writers = create_tree_export_writers(temp_dir)
+            try:
+                (trees_csv_full_path, trees_watered) = generate_trees_csv(
+                    temp_dir, db_conn, export_writers
+                )
+            finally:
+                for export_writer in export_writers:
+                    export_writer.close()
+            stage.add_file(trees_csv_full_path)
+            for export_writer in export_writers:
+                stage.add_file(export_writer.path)
+
+        # Upload the further export formats to Supabase storage
+        with metrics.stage("export_upload") as stage:
+            for export_writer in export_writers:
+                stage.add_file(export_writer.path)
+                upload_file_to_supabase_storage(
+                    supabase_url,
+                    supabase_bucket_name,
+                    supabase_service_role_key,
+                    export_writer.path,
+                    export_writer.file_name,
+                )
 
         # Preprocess trees.csv with tippecanoe
-        trees_preprocessed_full_path = preprocess_trees_csv(
-            trees_csv_full_path, temp_dir
-        )
+        with metrics.stage("tippecanoe") as stage:
+            stage.add_file(trees_csv_full_path)
+            trees_preprocessed_full_path = preprocess_trees_csv(
+                trees_csv_full_path, temp_dir
+            )
 
         # Upload preprocessed trees to Supabase storage
-        upload_file_to_supabase_storage(
-            supabase_url,
-            supabase_bucket_name,
-            supabase_service_role_key,
-            trees_preprocessed_full_path,
-            "trees-preprocessed.mbtiles",
-        )
+        with metrics.stage("supabase_upload") as stage:
+            stage.add_file(trees_preprocessed_full_path)
+            upload_file_to_supabase_storage(
+                supabase_url,
+                supabase_bucket_name,
+                supabase_service_role_key,
+                trees_preprocessed_full_path,
+                "trees-preprocessed.mbtiles",
+            )
 
         # Start the Mapbox tileset creating
-        mapbox_storage_credentials = upload_to_mapbox_storage(
-            trees_preprocessed_full_path,
-            mapbox_username,
-            mapbox_token,
-        )
+        with metrics.stage("mapbox_upload") as stage:
+            stage.add_file(trees_preprocessed_full_path)
+            mapbox_storage_credentials = upload_to_mapbox_storage(
+                trees_preprocessed_full_path,
+                mapbox_username,
+                mapbox_token,
+            )
 
-        tileset_generation_id = start_tileset_creation(
-            mapbox_storage_credentials,
-            mapbox_username,
-            mapbox_tileset,
-            mapbox_layer_name,
-            mapbox_token,
-        )
+        with metrics.stage("tileset_wait"):
+            tileset_generation_id = start_tileset_creation(
+                mapbox_storage_credentials,
+                mapbox_username,
+                mapbox_tileset,
+                mapbox_layer_name,
+                mapbox_token,
+            )
 
-        tileset_creation_error = wait_for_tileset_creation_complete(
-            tileset_generation_id,
-            mapbox_username,
-            mapbox_token,
-        )
+            tileset_creation_error = wait_for_tileset_creation_complete(
+                tileset_generation_id,
+                mapbox_username,
+                mapbox_token,
+            )
 
         if tileset_creation_error is not None:
             logging.error("Could not create Mapbox tileset")
@@ -0,0 +1,177 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from harvester_setup import create_connection_pool
+from harvest_metrics import metrics
+
+# Refreshes the materialized views of a table only if a run changed columns they read.
+# The columns each view reads are looked up in pg_depend, so changed views are handled without
+# touching the harvester. Views without a direct dependency on the table (e.g. reading it
+# through another view) are always refreshed. The needed refreshes run in parallel on the
+# connections of a pool, which is kept per database for the following refreshes of the run.
+
+MV_REFRESH_WORKERS = int(os.getenv("MV_REFRESH_WORKERS", "3"))
+
+# Connection pools of the parallel refreshes by dsn of the database connection
+_connection_pools = {}
+
+# Columns of a table read by the materialized views, whole-row dependencies have no column
+VIEW_COLUMN_DEPENDENCIES_SQL = """
+    SELECT DISTINCT view_class.relname, attribute.attname
+    FROM pg_depend
+    JOIN pg_rewrite ON pg_rewrite.oid = pg_depend.objid
+    JOIN pg_class view_class ON view_class.oid = pg_rewrite.ev_class
+    LEFT JOIN pg_attribute attribute ON attribute.attrelid = pg_depend.refobjid
+        AND attribute.attnum = pg_depend.refobjsubid
+    WHERE pg_depend.classid = 'pg_rewrite'::regclass
+    AND pg_depend.refclassid = 'pg_class'::regclass
+    AND pg_depend.refobjid = %s::regclass
+    AND view_class.relkind = 'm';
+"""
+
+
+def get_view_column_dependencies(table, db_conn):
+    """Looks up the columns of the table read by each materialized view
+
+    Args:
+        table (str): name of the table
+        db_conn (_type_): the database connection
+
+    Returns:
+        dict[str, set[str]]: columns by materialized view name
+    """
+    dependencies = {}
+    with db_conn.cursor() as cur:
+        cur.execute(VIEW_COLUMN_DEPENDENCIES_SQL, (table,))
+        for view, column in cur.fetchall():
+            dependencies.setdefault(view, set())
+            if column is not None:
+                dependencies[view].add(column)
+        db_conn.commit()
+    return dependencies
+
+
+def get_views_to_refresh(views, changed_columns, dependencies):
+    """Selects the views which read any of the changed columns
+
+    Args:
+        views (list[str]): the materialized views
+        changed_columns (list[str]): the changed columns, None if rows were inserted or deleted
+        dependencies (dict[str, set[str]]): columns by view, see get_view_column_dependencies
+
+    Returns:
+        list[str]: the views to refresh
+    """
+    if changed_columns is None:
+        return list(views)
+    return [
+        view
+        for view in views
+        if view not in dependencies or dependencies[view] & set(changed_columns)
+    ]
+
+
+def get_connection_pool(db_conn, workers=MV_REFRESH_WORKERS):
+    """Returns the pool of the parallel refreshes on the database of db_conn, created on first use
+
+    Args:
+        db_conn (_type_): the database connection
+        workers (int): maximum number of views refreshed in parallel
+
+    Returns:
+        psycopg2.pool.ThreadedConnectionPool: the connection pool
+    """
+    if db_conn.dsn not in _connection_pools:
+        _connection_pools[db_conn.dsn] = create_connection_pool(workers, db_conn)
+    return _connection_pools[db_conn.dsn]
+
+
+def refresh_view(view, db_conn):
+    """Refreshes a materialized view concurrently
+
+    Args:
+        view (str): name of the materialized view
+        db_conn (_type_): the database connection
+
+    Returns:
+        float: duration of the refresh in seconds, None if it failed
+    """
+    start = time.perf_counter()
+    try:
+        with metrics.stage(f"refresh_{view}"):
+            with db_conn.cursor() as cur:
+                cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view};")
+            db_conn.commit()
+    except Exception as e:
+        logging.error(f"Error refreshing materialized view {view}: {e}")
+        db_conn.rollback()
+        return None
+    return time.perf_counter() - start
+
+
+def refresh_view_on_pooled_connection(view, connection_pool):
+    """Refreshes a materialized view on a connection of the pool, see refresh_view"""
+    try:
+        view_conn = connection_pool.getconn()
+    except Exception as e:
+        logging.error(f"Error refreshing materialized view {view}: {e}")
+        return None
+    try:
+        return refresh_view(view, view_conn)
+    finally:
+        connection_pool.putconn(view_conn, close=bool(view_conn.closed))
+
+
+def refresh_materialized_views(
+    views,
+    changed_columns,
+    db_conn,
+    table="trees",
+    workers=MV_REFRESH_WORKERS,
+    connection_pool=None,
+):
+    """Refreshes the materialized views depending on the changed columns of the table
+
+    Args:
+        views (list[str]): the materialized views on the table
+        changed_columns (list[str]): the changed columns, None if rows were inserted or deleted
+        db_conn (_type_): the database connection
+        table (str): name of the changed table
+        workers (int): maximum number of views refreshed in parallel
+        connection_pool (psycopg2.pool.ThreadedConnectionPool): pool of the parallel refreshes,
+            by default a pool kept for the database of db_conn
+
+    Returns:
+        dict[str, float]: duration in seconds of each refreshed view, None if its refresh failed
+    """
+    dependencies = get_view_column_dependencies(table, db_conn)
+    views_to_refresh = get_views_to_refresh(views, changed_columns, dependencies)
+    skipped_views = [view for view in views if view not in views_to_refresh]
+    if skipped_views:
+        logging.info(
+            f"Skipping materialized views not reading {', '.join(changed_columns)}: {', '.join(skipped_views)}"
+        )
+    if not views_to_refresh:
+        return {}
+
+    logging.info(f"Refreshing materialized views: {', '.join(views_to_refresh)}")
+    with metrics.stage("mv_refresh") as stage:
+        if len(views_to_refresh) == 1 or workers <= 1:
+            durations = [refresh_view(view, db_conn) for view in views_to_refresh]
+        else:
+            connection_pool = connection_pool or get_connection_pool(db_conn, workers)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                durations = list(
+                    executor.map(
+                        lambda view: refresh_view_on_pooled_connection(view, connection_pool),
+                        views_to_refresh,
+                    )
+                )
+        stage.add_rows(len(views_to_refresh))
+
+    timings = dict(zip(views_to_refresh, durations))
+    for view, duration in timings.items():
+        if duration is not None:
+            logging.info(f"  Refreshed {view} in {duration:.2f}s")
+    return timings
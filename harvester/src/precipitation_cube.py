@@ -0,0 +1,286 @@
+import os
+import json
+import hashlib
+import logging
+import numpy
+from datetime import datetime
+from datetime import timedelta
+from radolan_checkpoints import RADOLAN_MINUTE
+
+# Local store of the hourly radolan values of the retention window as a memory-mapped
+# (hours x cells) int16 array of precipitation in 0.1 mm. Rows are hours, so appending an hour
+# appends to the file, columns are the radolan_geometry cells ordered by id.
+# The database stays the source of truth: hours with checkpoint which are missing in the cube,
+# e.g. after a crash or a backfill, are loaded from radolan_data before the cube is read.
+
+RADOLAN_CUBE_DIR = os.getenv("RADOLAN_CUBE_DIR")
+
+VALUES_DTYPE = numpy.int16
+
+# Open cubes by database, every database (or schema) of a multi-region run has its own cube
+_precipitation_cubes = {}
+
+
+class PrecipitationCube:
+    """Memory-mapped (hours x cells) array of hourly radolan values stored in a directory"""
+
+    def __init__(self, path, geom_ids):
+        self.path = path
+        self.geom_ids = geom_ids
+        self.start = None
+        self.hours = 0
+        self.loaded = set()
+        self._values = None
+        self._columns = {geom_id: column for column, geom_id in enumerate(geom_ids)}
+
+    @property
+    def values_file(self):
+        return os.path.join(self.path, "values.i16")
+
+    @property
+    def meta_file(self):
+        return os.path.join(self.path, "meta.json")
+
+    @property
+    def geom_ids_file(self):
+        return os.path.join(self.path, "geom_ids.npy")
+
+    @property
+    def end(self):
+        return self.start + timedelta(hours=self.hours - 1)
+
+    @classmethod
+    def open(cls, path, geom_ids):
+        """Opens the cube stored in path. The cube is reset if the grid cells changed.
+
+        Args:
+            path (str): directory of the cube
+            geom_ids (numpy.ndarray): ids of all radolan_geometry cells, ascending
+
+        Returns:
+            PrecipitationCube: the cube
+        """
+        os.makedirs(path, exist_ok=True)
+        cube = cls(path, geom_ids)
+        if not os.path.exists(cube.meta_file) or not os.path.exists(cube.geom_ids_file):
+            return cube
+        if not numpy.array_equal(numpy.load(cube.geom_ids_file), geom_ids):
+            logging.info("Grid cells changed, resetting precipitation cube")
+            return cube
+        with open(cube.meta_file) as f:
+            meta = json.load(f)
+        cube.start = datetime.fromisoformat(meta["start"])
+        cube.hours = meta["hours"]
+        cube.loaded = set(meta["loaded"])
+        return cube
+
+    @property
+    def values(self):
+        """(hours x cells) memory map of the values, None for an empty cube"""
+        if self._values is None and self.hours > 0:
+            self._values = numpy.memmap(
+                self.values_file,
+                dtype=VALUES_DTYPE,
+                mode="r+",
+                shape=(self.hours, len(self.geom_ids)),
+            )
+        return self._values
+
+    def _save_meta(self):
+        numpy.save(self.geom_ids_file, self.geom_ids)
+        with open(self.meta_file, "w") as f:
+            json.dump(
+                {
+                    "start": self.start.isoformat(),
+                    "hours": self.hours,
+                    "loaded": sorted(self.loaded),
+                },
+                f,
+            )
+
+    def _hour_index(self, measured_at):
+        return int((measured_at - self.start).total_seconds() // 3600)
+
+    def _resize(self, first_hour, last_hour):
+        """Changes the covered hours. Growing at the end extends the file in place,
+        everything else rewrites the overlapping rows into a new file."""
+        hours = self._hour_offset(first_hour, last_hour) + 1
+        row_bytes = len(self.geom_ids) * numpy.dtype(VALUES_DTYPE).itemsize
+        if self._values is not None:
+            self._values.flush()
+            self._values = None
+
+        if self.start == first_hour and os.path.exists(self.values_file):
+            # Truncating to a larger size fills the new hours with zeros
+            os.truncate(self.values_file, hours * row_bytes)
+        else:
+            resized_file = self.values_file + ".resize"
+            with open(resized_file, "wb") as f:
+                f.truncate(hours * row_bytes)
+            if self.start is not None and self.hours > 0:
+                resized = numpy.memmap(
+                    resized_file,
+                    dtype=VALUES_DTYPE,
+                    mode="r+",
+                    shape=(hours, len(self.geom_ids)),
+                )
+                shift = self._hour_offset(first_hour, self.start)
+                source_first = max(0, -shift)
+                source_last = min(self.hours, hours - shift)
+                if source_first < source_last:
+                    resized[source_first + shift : source_last + shift] = self.values[
+                        source_first:source_last
+                    ]
+                resized.flush()
+                del resized
+                self._values = None
+                self.loaded = set(
+                    index + shift
+                    for index in self.loaded
+                    if 0 <= index + shift < hours
+                )
+            os.replace(resized_file, self.values_file)
+
+        self.start = first_hour
+        self.hours = hours
+        self._save_meta()
+
+    @staticmethod
+    def _hour_offset(first_hour, hour):
+        return int((hour - first_hour).total_seconds() // 3600)
+
+    def has_hour(self, measured_at):
+        return self.start is not None and self._hour_index(measured_at) in self.loaded
+
+    def write_hour(self, measured_at, cell_values):
+        """Stores the values of one hour. An empty cube starts at the hour. Hours before the
+        start of the cube are ignored, they are older than the retention window (see cover
+        for extending the cube to older hours). Later hours extend the cube.
+
+        Args:
+            measured_at (datetime): the hour
+            cell_values (list[tuple[int, int]]): geom_id and value of all cells with precipitation
+        """
+        if self.start is None:
+            self._resize(measured_at, measured_at)
+        if measured_at < self.start:
+            return
+        if measured_at > self.end:
+            self._resize(self.start, measured_at)
+
+        index = self._hour_index(measured_at)
+        row = numpy.zeros(len(self.geom_ids), dtype=VALUES_DTYPE)
+        for geom_id, value in cell_values:
+            column = self._columns.get(geom_id)
+            if column is not None:
+                row[column] = value
+        self.values[index] = row
+        self.values.flush()
+        self.loaded.add(index)
+        self._save_meta()
+
+    def cover(self, start_date, end_date):
+        """Extends the cube to cover all hours between start_date and end_date, so hours of
+           this range written afterwards are stored
+
+        Args:
+            start_date (datetime): first hour
+            end_date (datetime): last hour
+        """
+        if self.start is None or start_date < self.start or end_date > self.end:
+            first_hour = start_date if self.start is None else min(start_date, self.start)
+            last_hour = end_date if self.start is None else max(end_date, self.end)
+            self._resize(first_hour, last_hour)
+
+    def window(self, start_date, end_date):
+        """Returns the values between start_date and end_date without copying them.
+           The cube is extended to cover this range if necessary.
+
+        Args:
+            start_date (datetime): first hour
+            end_date (datetime): last hour
+
+        Returns:
+            numpy.memmap: (hours x cells) view of the values
+        """
+        self.cover(start_date, end_date)
+        return self.values[
+            self._hour_index(start_date) : self._hour_index(end_date) + 1
+        ]
+
+    def trim(self, limit_days):
+        """Drops all hours older than the retention window
+
+        Args:
+            limit_days (number): number of previous days to keep radolan data for
+        """
+        first_hour = (datetime.now() - timedelta(days=limit_days)).replace(
+            hour=0, minute=RADOLAN_MINUTE, second=0, microsecond=0
+        )
+        if self.start is None or first_hour <= self.start:
+            return
+        self._resize(first_hour, max(first_hour, self.end))
+
+
+def get_precipitation_cube(db_conn):
+    """Opens the precipitation cube of the database configured by RADOLAN_CUBE_DIR
+
+    Args:
+        db_conn (_type_): the database connection
+
+    Returns:
+        PrecipitationCube: the cube or None if RADOLAN_CUBE_DIR is not set
+    """
+    if not RADOLAN_CUBE_DIR:
+        return None
+    if db_conn.dsn not in _precipitation_cubes:
+        with db_conn.cursor() as cur:
+            cur.execute("SELECT id FROM radolan_geometry ORDER BY id;")
+            geom_ids = numpy.array([row[0] for row in cur.fetchall()], dtype=numpy.int32)
+            db_conn.commit()
+        # libpq masks the password in dsn, host, database and schema identify the cube
+        cube_dir = hashlib.sha1(db_conn.dsn.encode()).hexdigest()[:12]
+        _precipitation_cubes[db_conn.dsn] = PrecipitationCube.open(
+            os.path.join(RADOLAN_CUBE_DIR, cube_dir), geom_ids
+        )
+    return _precipitation_cubes[db_conn.dsn]
+
+
+def sync_precipitation_cube(cube, start_date, end_date, db_conn):
+    """Loads all hours between start_date and end_date with checkpoint which are missing in the cube
+
+    Args:
+        cube (PrecipitationCube): the cube
+        start_date (datetime): first hour
+        end_date (datetime): last hour
+        db_conn (_type_): the database connection
+
+    Returns:
+        int: number of loaded hours
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(
+            "SELECT measured_at FROM radolan_checkpoints WHERE measured_at BETWEEN %s AND %s;",
+            (start_date, end_date),
+        )
+        missing_hours = [row[0] for row in cur.fetchall() if not cube.has_hour(row[0])]
+        if not missing_hours:
+            db_conn.commit()
+            return 0
+
+        logging.info(f"Loading {len(missing_hours)} hours into the precipitation cube...")
+        cur.execute(
+            """
+            SELECT measured_at, geom_id, value FROM radolan_data
+            WHERE measured_at = ANY(%s) ORDER BY measured_at;
+            """,
+            (missing_hours,),
+        )
+        cell_values = {hour: [] for hour in missing_hours}
+        for measured_at, geom_id, value in cur:
+            cell_values[measured_at].append((geom_id, value))
+        db_conn.commit()
+
+    for measured_at, values in cell_values.items():
+        cube.write_hour(measured_at, values)
+    return len(missing_hours)
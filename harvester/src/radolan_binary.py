@@ -0,0 +1,187 @@
+import os
+import re
+import sys
+import bz2
+import gzip
+import logging
+import numpy
+from datetime import datetime
+
+# Decoder for DWD's binary RADOLAN RW composite, the format the ASCII export is generated from.
+# https://www.dwd.de/DE/leistungen/radolan/radolan_info/radolan_radvor_op_komposit_format_pdf.pdf
+#
+# A file starts with an ASCII header terminated by ETX (0x03), followed by one little-endian
+# 16 bit word per cell, row by row starting at the south-west corner. The lower 12 bits hold
+# the value in units of 10^precision mm (precision is the PR field of the header, E-01 for RW),
+# the upper 4 bits are flags.
+
+HEADER_END = b"\x03"
+
+VALUE_MASK = 0x0FFF
+SECONDARY_FLAG = 0x1000
+MISSING_FLAG = 0x2000
+NEGATIVE_FLAG = 0x4000
+CLUTTER_FLAG = 0x8000
+
+# Missing cells in the ASCII export
+NODATA_VALUE = -1
+
+# Precision of the values of the ASCII export, 0.1 mm
+ASCII_PRECISION = -1
+
+# Grid of the national RW composite, the only grid the ASCII export is georeferenced for
+ASCII_GRID = (900, 900)
+
+# Header of the ASCII export of the national RW composite
+ASCII_HEADER = """ncols {cols}
+nrows {rows}
+xllcorner -523462
+yllcorner -4658645
+cellsize 1000
+NODATA_value -1"""
+
+
+def open_radolan_file(path):
+    """Opens a binary radolan file, gzip and bzip2 compressed files are decompressed on the fly"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def parse_radolan_header(header):
+    """Parses the ASCII header of a binary radolan file
+
+    Args:
+        header (str): the header without the terminating ETX
+
+    Returns:
+        dict: product, measured_at, precision (decimal exponent of the unit in mm, None if the
+        header has no PR field), rows and cols
+
+    Raises:
+        ValueError: If the header is no RADOLAN header.
+    """
+    grid = re.search(r"GP\s*(\d+)x\s*(\d+)", header)
+    precision = re.search(r"PR\s*E([+-]\d+)", header)
+    if len(header) < 17 or not grid:
+        raise ValueError(f"Invalid RADOLAN header: {header!r}")
+    return {
+        "product": header[:2],
+        # DDhhmm after the product, MMYY after the 5 digit radar site id
+        "measured_at": datetime.strptime(header[2:8] + header[13:17], "%d%H%M%m%y"),
+        "precision": int(precision.group(1)) if precision else None,
+        "rows": int(grid.group(1)),
+        "cols": int(grid.group(2)),
+    }
+
+
+def read_radolan_binary(path, clutter_as_missing=False):
+    """Reads a binary radolan file
+
+    Args:
+        path (str): path of the file, may be gzip or bzip2 compressed
+        clutter_as_missing (bool): treat cells flagged as clutter as missing
+
+    Returns:
+        tuple[dict, numpy.ndarray]: the parsed header and the (rows x cols) int16 values in
+        0.1 mm, north-west corner first like the ASCII export, NODATA_VALUE for missing cells
+
+    Raises:
+        ValueError: If the values of the file are not in 0.1 mm like the ASCII export.
+    """
+    with open_radolan_file(path) as f:
+        data = f.read()
+
+    header_end = data.index(HEADER_END)
+    header = parse_radolan_header(data[:header_end].decode("ascii"))
+    if header["precision"] != ASCII_PRECISION:
+        raise ValueError(
+            f"Unsupported precision E{header['precision']} of {header['product']} in {path}, "
+            f"only E{ASCII_PRECISION:+03d} (0.1 mm) is supported"
+        )
+    rows, cols = header["rows"], header["cols"]
+
+    raw = numpy.frombuffer(
+        data, dtype="<u2", count=rows * cols, offset=header_end + len(HEADER_END)
+    ).reshape(rows, cols)
+
+    values = (raw & VALUE_MASK).astype(numpy.int16)
+    values[(raw & NEGATIVE_FLAG) != 0] *= -1
+    missing = (raw & MISSING_FLAG) != 0
+    if clutter_as_missing:
+        missing |= (raw & CLUTTER_FLAG) != 0
+    values[missing] = NODATA_VALUE
+
+    # The binary format starts in the south, the ASCII export in the north
+    return header, numpy.flipud(values)
+
+
+def convert_radolan_binary_to_ascii(path, output_dir):
+    """Converts a binary radolan file into the ASCII export format used by the downstream stages
+
+    Args:
+        path (str): path of the binary file
+        output_dir (str): directory of the ASCII file
+
+    Returns:
+        str: path of the ASCII file, named like the files of DWD's ASCII export
+
+    Raises:
+        ValueError: If the file is not on the 900 x 900 grid of the national composite.
+    """
+    header, values = read_radolan_binary(path)
+    if (header["rows"], header["cols"]) != ASCII_GRID:
+        raise ValueError(
+            f"Unsupported grid {header['rows']}x{header['cols']} of {header['product']} in {path}, "
+            f"only the {ASCII_GRID[0]}x{ASCII_GRID[1]} national composite can be exported"
+        )
+    output_file = os.path.join(
+        output_dir, header["measured_at"].strftime("RW_%Y%m%d-%H%M.asc")
+    )
+    numpy.savetxt(
+        output_file,
+        values,
+        fmt="%d",
+        header=ASCII_HEADER.format(rows=header["rows"], cols=header["cols"]),
+        comments="",
+    )
+    return output_file
+
+
+def read_radolan_ascii(path):
+    """Reads the values of a file of DWD's ASCII export
+
+    Args:
+        path (str): path of the file
+
+    Returns:
+        numpy.ndarray: (rows x cols) values, north-west corner first
+    """
+    return numpy.loadtxt(path, skiprows=6, dtype=numpy.int16)
+
+
+if __name__ == "__main__":
+    # Compares the decoded binary file with the ASCII export of the same hour, e.g.
+    # python radolan_binary.py raa01-rw_10000-2401010050-dwd---bin.gz RW_20240101-0050.asc
+    logging.basicConfig()
+    logging.root.setLevel(logging.INFO)
+    if len(sys.argv) != 3:
+        logging.error("Usage: python radolan_binary.py <binary file> <ASCII file>")
+        sys.exit(2)
+
+    header, binary_values = read_radolan_binary(sys.argv[1])
+    ascii_values = read_radolan_ascii(sys.argv[2])
+    if binary_values.shape != ascii_values.shape:
+        logging.error(f"❌Shapes differ: {binary_values.shape} != {ascii_values.shape}")
+        sys.exit(1)
+    differing_cells = numpy.argwhere(binary_values != ascii_values)
+    if len(differing_cells) > 0:
+        for row, col in differing_cells[:10]:
+            logging.error(
+                f"❌Cell ({row}, {col}): binary {binary_values[row, col]}, ASCII {ascii_values[row, col]}"
+            )
+        logging.error(f"❌{len(differing_cells)} cells differ")
+        sys.exit(1)
+    logging.info(f"✅All cells of {header['measured_at']} are identical")
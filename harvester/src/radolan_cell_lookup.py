@@ -0,0 +1,262 @@
+import io
+import os
+import csv
+import sys
+import json
+import logging
+import argparse
+import numpy
+from pyproj import Transformer
+from radolan_window import RADOLAN_PROJECTION
+
+# Computes the radolan grid cell of the trees arithmetically: the RADOLAN grid is a regular 1 km
+# raster in the polar stereographic RADOLAN projection, so the row and column of a tree follow
+# from one vectorized transform of its coordinates and an integer division, without any polygon
+# test. The cells of radolan_geometry are mapped to row and column the same way by their
+# centroids. Trees outside all cells of radolan_geometry get no cell.
+
+# "arithmetic" or "spatial" (ST_CoveredBy) assignment of the trees to their cells
+RADOLAN_CELL_LOOKUP = os.getenv("RADOLAN_CELL_LOOKUP", "arithmetic")
+
+# Layout of the Germany-wide RADOLAN RW grid, like the header of the ASCII files
+RADOLAN_GRID_HEADER = {
+    "ncols": 900,
+    "nrows": 900,
+    "xllcorner": -523462.0,
+    "yllcorner": -4658645.0,
+    "cellsize": 1000.0,
+}
+
+RADOLAN_CELLS_SQL = """
+    SELECT id, ST_X(COALESCE(centroid, ST_Centroid(geometry))), ST_Y(COALESCE(centroid, ST_Centroid(geometry)))
+    FROM radolan_geometry;
+"""
+
+TREE_COORDINATES_SQL = """
+    SELECT id, ST_X(geom), ST_Y(geom) FROM trees WHERE geom IS NOT NULL;
+"""
+
+UNASSIGNED_TREE_COORDINATES_SQL = """
+    SELECT id, ST_X(geom), ST_Y(geom) FROM trees WHERE geom IS NOT NULL AND radolan_geom_id IS NULL;
+"""
+
+# All cells covering each tree, trees on a cell border are covered by several cells
+COVERED_BY_CELLS_SQL = """
+    SELECT trees.id, ARRAY_AGG(radolan_geometry.id)
+    FROM trees
+    JOIN radolan_geometry ON ST_CoveredBy(trees.geom, radolan_geometry.geometry)
+    GROUP BY trees.id;
+"""
+
+UPDATE_TREE_CELLS_SQL = """
+    UPDATE trees
+    SET radolan_geom_id = tree_cells.geom_id
+    FROM tree_cells
+    WHERE trees.id = tree_cells.tree_id
+    AND trees.radolan_geom_id IS DISTINCT FROM tree_cells.geom_id;
+"""
+
+_transformer = None
+
+
+def get_transformer():
+    """Returns the transformer from WGS84 lon/lat to the RADOLAN projection, created once"""
+    global _transformer
+    if _transformer is None:
+        _transformer = Transformer.from_crs("epsg:4326", RADOLAN_PROJECTION, always_xy=True)
+    return _transformer
+
+
+def compute_cell_keys(lng, lat, header=RADOLAN_GRID_HEADER):
+    """Computes the grid cell of each coordinate
+
+    Args:
+        lng (numpy.ndarray): longitudes in WGS84
+        lat (numpy.ndarray): latitudes in WGS84
+        header (dict): layout of the grid
+
+    Returns:
+        numpy.ndarray: row * ncols + column of each coordinate, -1 outside the grid
+    """
+    x, y = get_transformer().transform(numpy.asarray(lng), numpy.asarray(lat))
+    top = header["yllcorner"] + header["nrows"] * header["cellsize"]
+    rows = numpy.floor((top - y) / header["cellsize"])
+    cols = numpy.floor((x - header["xllcorner"]) / header["cellsize"])
+    inside = (rows >= 0) & (rows < header["nrows"]) & (cols >= 0) & (cols < header["ncols"])
+    return numpy.where(inside, rows * header["ncols"] + cols, -1).astype(numpy.int64)
+
+
+class CellIndex:
+    """radolan_geometry ids by grid cell, built from the cell centroids
+
+    Attributes:
+        keys (numpy.ndarray): sorted row * ncols + column of the cells
+        geom_ids (numpy.ndarray): radolan_geometry id of each key
+    """
+
+    def __init__(self, geom_ids, lng, lat):
+        keys = compute_cell_keys(lng, lat)
+        order = numpy.argsort(keys)
+        self.keys = keys[order]
+        self.geom_ids = numpy.asarray(geom_ids, dtype=numpy.int64)[order]
+
+    @classmethod
+    def load(cls, db_conn):
+        """Builds the index of the cells in radolan_geometry
+
+        Args:
+            db_conn (_type_): the database connection
+
+        Returns:
+            CellIndex: the index
+        """
+        with db_conn.cursor() as cur:
+            cur.execute(RADOLAN_CELLS_SQL)
+            rows = cur.fetchall()
+            db_conn.commit()
+        geom_ids, lng, lat = zip(*rows) if rows else ((), (), ())
+        return cls(geom_ids, numpy.array(lng, dtype=float), numpy.array(lat, dtype=float))
+
+    def lookup(self, lng, lat):
+        """Looks up the cells of the coordinates
+
+        Args:
+            lng (numpy.ndarray): longitudes in WGS84
+            lat (numpy.ndarray): latitudes in WGS84
+
+        Returns:
+            numpy.ndarray: radolan_geometry id of each coordinate, -1 outside all cells
+        """
+        keys = compute_cell_keys(lng, lat)
+        if len(self.keys) == 0:
+            return numpy.full(len(keys), -1, dtype=numpy.int64)
+        positions = numpy.minimum(numpy.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = (self.keys[positions] == keys) & (keys >= 0)
+        return numpy.where(found, self.geom_ids[positions], -1)
+
+
+def lookup_tree_cells(db_conn, unassigned_only=False):
+    """Computes the cell of the trees
+
+    Args:
+        db_conn (_type_): the database connection
+        unassigned_only (bool): only trees without radolan_geom_id
+
+    Returns:
+        tuple[list, numpy.ndarray]: tree ids and the radolan_geometry id of each, -1 outside all cells
+    """
+    cell_index = CellIndex.load(db_conn)
+    with db_conn.cursor() as cur:
+        cur.execute(UNASSIGNED_TREE_COORDINATES_SQL if unassigned_only else TREE_COORDINATES_SQL)
+        rows = cur.fetchall()
+        db_conn.commit()
+    if not rows:
+        return [], numpy.empty(0, dtype=numpy.int64)
+    tree_ids, lng, lat = zip(*rows)
+    return list(tree_ids), cell_index.lookup(
+        numpy.array(lng, dtype=float), numpy.array(lat, dtype=float)
+    )
+
+
+def write_tree_cells(tree_ids, geom_ids, db_conn):
+    """Writes radolan_geom_id of the trees with COPY and one joined update, without commit
+
+    Args:
+        tree_ids (list): the tree ids
+        geom_ids (numpy.ndarray): radolan_geometry id of each tree, -1 is skipped
+        db_conn (_type_): the database connection
+
+    Returns:
+        int: number of updated trees
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for tree_id, geom_id in zip(tree_ids, geom_ids.tolist()):
+        if geom_id >= 0:
+            writer.writerow((tree_id, geom_id))
+    buffer.seek(0)
+    with db_conn.cursor() as cur:
+        cur.execute(
+            "CREATE TEMP TABLE tree_cells (tree_id text, geom_id integer) ON COMMIT DROP;"
+        )
+        cur.copy_expert("COPY tree_cells (tree_id, geom_id) FROM STDIN WITH (FORMAT csv)", buffer)
+        cur.execute(UPDATE_TREE_CELLS_SQL)
+        return cur.rowcount
+
+
+def verify_cell_lookup(db_conn, max_examples=10):
+    """Compares the arithmetic cells of all trees with the cells covering them (ST_CoveredBy)
+
+    Args:
+        db_conn (_type_): the database connection
+        max_examples (int): maximum number of listed mismatching trees
+
+    Returns:
+        dict: counts of matching and mismatching trees and mismatching examples
+    """
+    tree_ids, geom_ids = lookup_tree_cells(db_conn)
+    with db_conn.cursor() as cur:
+        cur.execute(COVERED_BY_CELLS_SQL)
+        covering_cells = dict(cur.fetchall())
+        db_conn.commit()
+
+    report = {
+        "trees": len(tree_ids),
+        "matches": 0,
+        "border_matches": 0,
+        "mismatches": 0,
+        "arithmetic_only": 0,
+        "spatial_only": 0,
+        "no_cell": 0,
+        "examples": [],
+    }
+    for tree_id, geom_id in zip(tree_ids, geom_ids.tolist()):
+        cells = covering_cells.get(tree_id, [])
+        if geom_id < 0 and not cells:
+            report["no_cell"] += 1
+        elif geom_id < 0:
+            report["spatial_only"] += 1
+        elif not cells:
+            report["arithmetic_only"] += 1
+        elif geom_id in cells:
+            report["border_matches" if len(cells) > 1 else "matches"] += 1
+        else:
+            report["mismatches"] += 1
+            if len(report["examples"]) < max_examples:
+                report["examples"].append(
+                    {"tree_id": tree_id, "arithmetic": geom_id, "covered_by": cells}
+                )
+    return report
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from harvester_setup import connect_database
+
+    logging.basicConfig()
+    logging.root.setLevel(logging.INFO)
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        description="Compares the arithmetic tree cells with ST_CoveredBy"
+    )
+    parser.add_argument(
+        "--max-mismatch-ratio",
+        type=float,
+        default=0.0,
+        help="fail if more trees than this share get a different cell",
+    )
+    args = parser.parse_args()
+
+    database_connection = connect_database()
+    report = verify_cell_lookup(database_connection)
+    database_connection.close()
+    print(json.dumps(report, indent=2, default=str))
+
+    compared = report["matches"] + report["border_matches"] + report["mismatches"]
+    mismatch_ratio = report["mismatches"] / compared if compared else 0.0
+    differing = report["mismatches"] + report["arithmetic_only"] + report["spatial_only"]
+    if mismatch_ratio > args.max_mismatch_ratio:
+        logging.error(f"❌{differing} trees get a different cell ({mismatch_ratio:.4%} mismatches)")
+        sys.exit(1)
+    logging.info(f"✅Arithmetic lookup matches ST_CoveredBy ({differing} trees differ)")
@@ -0,0 +1,297 @@
+import os
+import logging
+import psycopg2.extras
+from radolan_db_utils import (
+    update_trees_in_database,
+    store_radolan_tree_window,
+    get_hourly_sum_changes_params,
+    HOURLY_SUM_CHANGES_SQL,
+    TREES_REFRESH_TRIGGERS,
+    TREES_MATERIALIZED_VIEWS,
+    TREES_RADOLAN_COLUMNS,
+)
+from mv_refresh import refresh_materialized_views
+from staged_tree_update import TREES_UPDATE_MODE, update_trees_staged
+from radolan_cell_lookup import RADOLAN_CELL_LOOKUP, lookup_tree_cells, write_tree_cells
+from radolan_grid import RADOLAN_RESOLUTION
+
+# Storage of the hourly radolan values of the trees:
+# "trees": radolan_days and radolan_sum are copied into every tree row of a grid cell
+# "cells": radolan_days and radolan_sum are stored once per grid cell in radolan_cell_series,
+#          trees reference their cell with radolan_geom_id and the trees_with_radolan view
+#          provides the trees with the hourly values of their cell. radolan_sum is still copied
+#          into the trees whose sum changed, so readers of trees.radolan_sum keep working,
+#          trees.radolan_days and trees.radolan_days_daily are NULL
+# Both modes store radolan_days and/or radolan_days_daily depending on RADOLAN_RESOLUTION
+RADOLAN_STORAGE_MODE = os.getenv("RADOLAN_STORAGE_MODE", "trees")
+
+# Trees without radolan_geom_id are assigned to the cell covering them,
+# trees close to a cell like in the buffered tree update
+ASSIGN_TREES_TO_CELLS_SQL = """
+    UPDATE trees
+    SET radolan_geom_id = radolan_geometry.id
+    FROM radolan_geometry
+    WHERE trees.radolan_geom_id IS NULL
+    AND ST_CoveredBy(trees.geom, radolan_geometry.geometry);
+"""
+
+ASSIGN_TREES_TO_CELLS_BUFFERED_SQL = """
+    UPDATE trees
+    SET radolan_geom_id = radolan_geometry.id
+    FROM radolan_geometry
+    WHERE trees.radolan_geom_id IS NULL
+    AND ST_CoveredBy(trees.geom, ST_Buffer(radolan_geometry.geometry, 0.0002));
+"""
+
+UPSERT_CELL_SERIES_SQL = """
+    INSERT INTO radolan_cell_series (geom_id, radolan_days, radolan_days_daily, radolan_sum)
+    VALUES %s
+    ON CONFLICT (geom_id) DO UPDATE
+    SET radolan_days = EXCLUDED.radolan_days, radolan_days_daily = EXCLUDED.radolan_days_daily,
+    radolan_sum = EXCLUDED.radolan_sum, updated_at = NOW()
+    WHERE (radolan_cell_series.radolan_days, radolan_cell_series.radolan_days_daily, radolan_cell_series.radolan_sum)
+    IS DISTINCT FROM (EXCLUDED.radolan_days, EXCLUDED.radolan_days_daily, EXCLUDED.radolan_sum);
+"""
+
+# Cells without precipitation in the window get zeros, NULL for a resolution not stored
+RESET_DRY_CELL_SERIES_SQL = """
+    INSERT INTO radolan_cell_series (geom_id, radolan_days, radolan_days_daily, radolan_sum)
+    SELECT id, %s::integer[], %s::smallint[], 0
+    FROM radolan_geometry WHERE id <> ALL(%s)
+    ON CONFLICT (geom_id) DO UPDATE
+    SET radolan_days = EXCLUDED.radolan_days, radolan_days_daily = EXCLUDED.radolan_days_daily,
+    radolan_sum = 0, updated_at = NOW()
+    WHERE (radolan_cell_series.radolan_days, radolan_cell_series.radolan_days_daily, radolan_cell_series.radolan_sum)
+    IS DISTINCT FROM (EXCLUDED.radolan_days, EXCLUDED.radolan_days_daily, 0);
+"""
+
+ADD_HOURLY_VALUES_TO_CELLS_SQL = f"""
+    UPDATE radolan_cell_series
+    SET radolan_sum = GREATEST(radolan_cell_series.radolan_sum + cells.value, 0), updated_at = NOW()
+    FROM ({HOURLY_SUM_CHANGES_SQL}) AS cells
+    WHERE radolan_cell_series.geom_id = cells.geom_id
+    RETURNING radolan_cell_series.geom_id;
+"""
+
+# Copies the sums of the cells into the trees whose sum differs, {cells_filter} restricts the cells
+SYNC_TREE_RADOLAN_SUMS_SQL_TEMPLATE = """
+    UPDATE trees
+    SET radolan_sum = radolan_cell_series.radolan_sum
+    FROM radolan_cell_series
+    WHERE trees.radolan_geom_id = radolan_cell_series.geom_id {cells_filter}
+    AND trees.radolan_sum IS DISTINCT FROM radolan_cell_series.radolan_sum;
+"""
+
+# The hourly values of the trees are not updated in this mode, so they must not be read
+CLEAR_TREE_RADOLAN_DAYS_SQL = """
+    UPDATE trees
+    SET radolan_days = NULL, radolan_days_daily = NULL
+    WHERE radolan_days IS NOT NULL OR radolan_days_daily IS NOT NULL;
+"""
+
+
+def ensure_cell_storage(db_conn):
+    """Creates radolan_cell_series, trees.radolan_geom_id and the trees_with_radolan view
+
+    Args:
+        db_conn (_type_): the database connection
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS radolan_cell_series (
+                geom_id integer PRIMARY KEY REFERENCES radolan_geometry (id) ON DELETE CASCADE,
+                radolan_days integer[],
+                radolan_days_daily smallint[],
+                radolan_sum integer NOT NULL,
+                updated_at timestamptz NOT NULL DEFAULT NOW()
+            );
+            ALTER TABLE radolan_cell_series ALTER COLUMN radolan_days DROP NOT NULL;
+            ALTER TABLE radolan_cell_series ADD COLUMN IF NOT EXISTS radolan_days_daily smallint[];
+            ALTER TABLE trees ADD COLUMN IF NOT EXISTS radolan_geom_id integer;
+            ALTER TABLE trees ADD COLUMN IF NOT EXISTS radolan_days_daily smallint[];
+            CREATE INDEX IF NOT EXISTS trees_radolan_geom_id_idx ON trees (radolan_geom_id);
+            """
+        )
+
+        # All columns of trees, with the radolan values of the cell instead of the tree's own
+        cur.execute(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'trees'
+            AND column_name NOT IN ('radolan_days', 'radolan_days_daily', 'radolan_sum')
+            ORDER BY ordinal_position;
+            """
+        )
+        tree_columns = ", ".join(f'trees."{row[0]}"' for row in cur.fetchall())
+        cur.execute(
+            f"""
+            DROP VIEW IF EXISTS trees_with_radolan;
+            CREATE VIEW trees_with_radolan AS
+            SELECT {tree_columns}, radolan_cell_series.radolan_days,
+            radolan_cell_series.radolan_days_daily, radolan_cell_series.radolan_sum
+            FROM trees
+            LEFT JOIN radolan_cell_series ON radolan_cell_series.geom_id = trees.radolan_geom_id;
+            """
+        )
+        db_conn.commit()
+
+
+def assign_trees_to_cells(db_conn, lookup=RADOLAN_CELL_LOOKUP):
+    """Assigns all trees without cell to their radolan grid cell
+
+    Args:
+        db_conn (_type_): the database connection
+        lookup (str): "arithmetic" or "spatial", see RADOLAN_CELL_LOOKUP
+
+    Returns:
+        int: number of assigned trees
+    """
+    if lookup not in ["arithmetic", "spatial"]:
+        raise ValueError(f"Unknown RADOLAN_CELL_LOOKUP {lookup}")
+    if lookup == "arithmetic":
+        tree_ids, geom_ids = lookup_tree_cells(db_conn, unassigned_only=True)
+
+    assigned_rows = 0
+    with db_conn.cursor() as cur:
+        for trigger in TREES_REFRESH_TRIGGERS:
+            cur.execute(f"ALTER TABLE trees DISABLE TRIGGER {trigger};")
+        if lookup == "arithmetic":
+            assigned_rows += write_tree_cells(tree_ids, geom_ids, db_conn)
+        else:
+            cur.execute(ASSIGN_TREES_TO_CELLS_SQL)
+            assigned_rows += cur.rowcount
+        # Trees outside all cells
+        cur.execute(ASSIGN_TREES_TO_CELLS_BUFFERED_SQL)
+        assigned_rows += cur.rowcount
+        for trigger in TREES_REFRESH_TRIGGERS:
+            cur.execute(f"ALTER TABLE trees ENABLE TRIGGER {trigger};")
+        db_conn.commit()
+    refresh_materialized_views(TREES_MATERIALIZED_VIEWS, ["radolan_geom_id"], db_conn)
+    logging.info(f"Assigned {assigned_rows} trees to radolan grid cells")
+    return assigned_rows
+
+
+def update_cell_series(radolan_grid, db_conn, resolution=RADOLAN_RESOLUTION):
+    """Stores the hourly and/or daily values and sums of the radolan grid once per cell
+
+    Args:
+        radolan_grid (RadolanGrid): the radolan grid
+        db_conn (_type_): the database connection
+        resolution (str): "hourly", "daily" or "both", see RADOLAN_RESOLUTION
+
+    Returns:
+        int: number of written cells
+    """
+    logging.info(f"Updating radolan series of {len(radolan_grid)} cells...")
+    written_rows = 0
+    with db_conn.cursor() as cur:
+        if len(radolan_grid) > 0:
+            psycopg2.extras.execute_values(
+                cur,
+                UPSERT_CELL_SERIES_SQL,
+                list(radolan_grid.iter_series(resolution)),
+                page_size=len(radolan_grid),
+            )
+            written_rows += cur.rowcount
+        hours = radolan_grid.values.shape[1]
+        days = radolan_grid.daily_values.shape[1] if resolution != "hourly" else 0
+        cur.execute(
+            RESET_DRY_CELL_SERIES_SQL,
+            (
+                [0] * hours if resolution != "daily" else None,
+                [0] * days if resolution != "hourly" else None,
+                radolan_grid.geom_ids.tolist(),
+            ),
+        )
+        written_rows += cur.rowcount
+        db_conn.commit()
+    logging.info(f"Wrote radolan series of {written_rows} cells, unchanged cells were skipped")
+    return written_rows
+
+
+def sync_tree_radolan_sums(db_conn, geom_ids=None):
+    """Copies radolan_sum of the cells into their trees. Without geom_ids all cells are synced
+       and the hourly values left in the trees are cleared.
+
+    Args:
+        db_conn (_type_): the database connection
+        geom_ids (list[int]): only sync the trees of these cells
+
+    Returns:
+        int: number of updated tree rows
+    """
+    updated_rows = 0
+    with db_conn.cursor() as cur:
+        # All in one transaction, the views are refreshed afterwards if they read the radolan columns
+        for trigger in TREES_REFRESH_TRIGGERS:
+            cur.execute(f"ALTER TABLE trees DISABLE TRIGGER {trigger};")
+        if geom_ids is None:
+            cur.execute(CLEAR_TREE_RADOLAN_DAYS_SQL)
+            if cur.rowcount > 0:
+                logging.info(f"Cleared the hourly radolan values of {cur.rowcount} trees")
+            cur.execute(SYNC_TREE_RADOLAN_SUMS_SQL_TEMPLATE.format(cells_filter=""))
+        else:
+            cur.execute(
+                SYNC_TREE_RADOLAN_SUMS_SQL_TEMPLATE.format(
+                    cells_filter="AND radolan_cell_series.geom_id = ANY(%s)"
+                ),
+                (geom_ids,),
+            )
+        updated_rows += cur.rowcount
+        for trigger in TREES_REFRESH_TRIGGERS:
+            cur.execute(f"ALTER TABLE trees ENABLE TRIGGER {trigger};")
+        db_conn.commit()
+    refresh_materialized_views(TREES_MATERIALIZED_VIEWS, TREES_RADOLAN_COLUMNS, db_conn)
+    logging.info(f"Copied radolan_sum into {updated_rows} trees")
+    return updated_rows
+
+
+def update_tree_radolan_values(radolan_grid, db_conn):
+    """Updates the radolan values of the trees in the configured RADOLAN_STORAGE_MODE
+
+    Args:
+        radolan_grid (RadolanGrid): the radolan grid
+        db_conn (_type_): the database connection
+
+    Returns:
+        int: number of written rows
+    """
+    if RADOLAN_STORAGE_MODE == "trees":
+        if TREES_UPDATE_MODE == "staged":
+            written_rows = update_trees_staged(radolan_grid, db_conn)
+        else:
+            written_rows = update_trees_in_database(radolan_grid, db_conn)
+    elif RADOLAN_STORAGE_MODE == "cells":
+        ensure_cell_storage(db_conn)
+        assign_trees_to_cells(db_conn)
+        written_rows = update_cell_series(radolan_grid, db_conn)
+        written_rows += sync_tree_radolan_sums(db_conn)
+    else:
+        raise ValueError(f"Unknown RADOLAN_STORAGE_MODE {RADOLAN_STORAGE_MODE}")
+    # The hourly mode moves the sums on from this window
+    store_radolan_tree_window(radolan_grid, db_conn)
+    return written_rows
+
+
+def add_hourly_values_to_cells(cell_values, measured_at_timestamp, db_conn):
+    """Adds the radolan values of one hour to radolan_sum of the affected cells and subtracts
+       the values of the hour dropping out of the window
+
+    Args:
+        cell_values (list[tuple[int, int]]): geom_id and value of the cells it rained in
+        measured_at_timestamp (datetime): the added hour
+        db_conn (_type_): the database connection
+
+    Returns:
+        int: number of updated cells
+    """
+    params = get_hourly_sum_changes_params(cell_values, measured_at_timestamp, db_conn)
+    if params is None:
+        return 0
+    with db_conn.cursor() as cur:
+        cur.execute(ADD_HOURLY_VALUES_TO_CELLS_SQL, params)
+        geom_ids = [row[0] for row in cur.fetchall()]
+        db_conn.commit()
+    sync_tree_radolan_sums(db_conn, geom_ids)
+    return len(geom_ids)
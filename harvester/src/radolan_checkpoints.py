@@ -0,0 +1,183 @@
+import os
+import sys
+import logging
+from datetime import datetime
+from datetime import timedelta
+
+# DWD publishes one RADOLAN RW file per hour, measured at minute 50
+RADOLAN_MINUTE = 50
+
+
+def ensure_checkpoint_table(db_conn):
+    """Creates the table recording which radolan hours are fully loaded
+
+    Args:
+        db_conn (_type_): the database connection
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS radolan_checkpoints (
+                measured_at timestamp PRIMARY KEY,
+                cells integer NOT NULL,
+                ingested_at timestamptz NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        db_conn.commit()
+
+
+def get_radolan_hours(start_date, end_date):
+    """Lists all hours DWD publishes radolan data for between start_date and end_date
+
+    Args:
+        start_date (datetime): first day
+        end_date (datetime): last day
+
+    Returns:
+        list[datetime]: measured_at timestamps of all hours
+    """
+    hours = []
+    day = datetime.combine(start_date.date(), datetime.min.time())
+    while day.date() <= end_date.date():
+        for hour in range(24):
+            measured_at = day.replace(hour=hour, minute=RADOLAN_MINUTE)
+            if start_date <= measured_at <= end_date:
+                hours.append(measured_at)
+        day += timedelta(days=1)
+    return hours
+
+
+def get_missing_hours(start_date, end_date, db_conn):
+    """Gets all hours between start_date and end_date which are not fully loaded yet
+
+    Args:
+        start_date (datetime): first day
+        end_date (datetime): last day
+        db_conn (_type_): the database connection
+
+    Returns:
+        list[datetime]: measured_at timestamps of the missing hours, ascending
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(
+            "SELECT measured_at FROM radolan_checkpoints WHERE measured_at BETWEEN %s AND %s;",
+            (start_date, end_date),
+        )
+        ingested_hours = set(row[0] for row in cur.fetchall())
+        db_conn.commit()
+    return [
+        hour for hour in get_radolan_hours(start_date, end_date) if hour not in ingested_hours
+    ]
+
+
+def mark_hour_ingested(cur, measured_at, cells):
+    """Records an hour as fully loaded. Must run in the transaction that loads the hour.
+
+    Args:
+        cur (_type_): cursor of the loading transaction
+        measured_at (datetime): the hour
+        cells (int): number of loaded radolan values
+    """
+    cur.execute(
+        """
+        INSERT INTO radolan_checkpoints (measured_at, cells) VALUES (%s, %s)
+        ON CONFLICT (measured_at) DO UPDATE SET cells = EXCLUDED.cells, ingested_at = NOW();
+        """,
+        (measured_at, cells),
+    )
+
+
+def get_retention_days(limit_days):
+    """Returns the number of previous days radolan data and checkpoints are kept for,
+    RADOLAN_RETENTION_DAYS or limit_days. It is never shorter than limit_days, the radolan grid
+    is built from these days.
+
+    Args:
+        limit_days (number): number of previous days to harvest data for
+
+    Returns:
+        int: number of previous days to keep radolan data for
+    """
+    retention_days = int(os.getenv("RADOLAN_RETENTION_DAYS") or limit_days)
+    if retention_days < limit_days:
+        logging.warning(
+            f"RADOLAN_RETENTION_DAYS={retention_days} is shorter than LIMIT_DAYS, keeping {limit_days} days"
+        )
+        return limit_days
+    return retention_days
+
+
+def get_first_retained_day(retention_days):
+    """Returns the first day which is still complete after the cleanup of the next daily run
+
+    Args:
+        retention_days (int): number of previous days to keep radolan data for
+
+    Returns:
+        datetime: midnight of the first retained day
+    """
+    next_cleanup_limit = datetime.now() + timedelta(days=1 - retention_days)
+    return datetime.combine(next_cleanup_limit.date() + timedelta(days=1), datetime.min.time())
+
+
+def cleanup_checkpoints(retention_days, db_conn):
+    """Deletes checkpoints of hours whose radolan data is deleted by the retention
+
+    Args:
+        retention_days (number): number of previous days to keep radolan data for
+        db_conn (_type_): the database connection
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM radolan_checkpoints WHERE measured_at < NOW() - %s * INTERVAL '1 day';",
+            (retention_days,),
+        )
+        db_conn.commit()
+
+
+def format_hours(hours):
+    """Formats hours as compact ranges, e.g. "2024-01-01 00:50 - 2024-01-01 05:50 (6h)"
+
+    Args:
+        hours (list[datetime]): ascending hours
+
+    Returns:
+        list[str]: one entry per consecutive range
+    """
+    ranges = []
+    for hour in hours:
+        if ranges and hour - ranges[-1][1] == timedelta(hours=1):
+            ranges[-1][1] = hour
+        else:
+            ranges.append([hour, hour])
+    return [
+        f"{first:%Y-%m-%d %H:%M} - {last:%Y-%m-%d %H:%M} ({int((last - first).total_seconds() // 3600) + 1}h)"
+        for first, last in ranges
+    ]
+
+
+if __name__ == "__main__":
+    # Lists the hours of the last LIMIT_DAYS days which are not loaded, e.g. for targeted refetching
+    from dotenv import load_dotenv
+    from harvester_setup import (
+        DATABASE_ENV_VARS,
+        find_missing_environment_variables,
+        connect_database,
+    )
+
+    logging.basicConfig()
+    logging.root.setLevel(logging.INFO)
+    load_dotenv()
+    if find_missing_environment_variables(DATABASE_ENV_VARS + ["LIMIT_DAYS"]):
+        sys.exit(1)
+
+    database_connection = connect_database()
+    end_date = datetime.combine(datetime.now() - timedelta(days=1), datetime.max.time())
+    start_date = datetime.combine(
+        datetime.now() - timedelta(days=int(os.getenv("LIMIT_DAYS"))), datetime.min.time()
+    )
+    missing_hours = get_missing_hours(start_date, end_date, database_connection)
+    logging.info(f"{len(missing_hours)} hours are missing between {start_date} and {end_date}")
+    for hour_range in format_hours(missing_hours):
+        print(hour_range)
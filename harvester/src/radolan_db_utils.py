@@ -1,8 +1,114 @@
 import psycopg2
+import psycopg2.extras
 from datetime import datetime
 from datetime import timedelta
 import logging
 import pytz
+from radolan_checkpoints import mark_hour_ingested
+from precipitation_cube import get_precipitation_cube
+from radolan_grid import RADOLAN_RESOLUTION
+from mv_refresh import refresh_materialized_views
+
+# Assigns the uploaded radolan polygons of radolan_temp to the grid cells of radolan_geometry
+INSERT_RADOLAN_DATA_SQL = """
+    INSERT INTO radolan_data (geom_id, value, measured_at)
+    SELECT radolan_geometry.id, radolan_temp.value, radolan_temp.measured_at
+    FROM radolan_geometry
+    JOIN radolan_temp ON ST_WithIn(radolan_geometry.centroid, radolan_temp.geometry)
+    RETURNING geom_id, value;
+"""
+
+# Columns of the radolan values per RADOLAN_RESOLUTION, the hourly values are cleared
+# in daily resolution so they don't go stale
+RADOLAN_DAYS_COLUMNS_SQL = {
+    "hourly": "radolan_days = %s",
+    "daily": "radolan_days = NULL, radolan_days_daily = %s",
+    "both": "radolan_days = %s, radolan_days_daily = %s",
+}
+
+# Guards against rewriting trees which already have the values, parameters like the SET clause
+RADOLAN_VALUES_DISTINCT_SQL = {
+    "hourly": "(trees.radolan_days, trees.radolan_sum) IS DISTINCT FROM (%s::integer[], %s::integer)",
+    "daily": "(trees.radolan_days, trees.radolan_days_daily, trees.radolan_sum) IS DISTINCT FROM (NULL::integer[], %s::smallint[], %s::integer)",
+    "both": "(trees.radolan_days, trees.radolan_days_daily, trees.radolan_sum) IS DISTINCT FROM (%s::integer[], %s::smallint[], %s::integer)",
+}
+
+# Updates all trees within a grid cell which don't have its values yet
+UPDATE_TREES_SQL_TEMPLATE = """
+    UPDATE trees
+    SET {radolan_days_columns}, radolan_sum = %s
+    FROM radolan_geometry
+    WHERE radolan_geometry.id = %s AND ST_CoveredBy(trees.geom, radolan_geometry.geometry)
+    AND {radolan_values_distinct};
+"""
+
+# Updates trees without radolan data close to a grid cell
+UPDATE_TREES_BUFFERED_SQL_TEMPLATE = """
+    UPDATE trees
+    SET {radolan_days_columns}, radolan_sum = %s
+    FROM radolan_geometry
+    WHERE radolan_geometry.id = %s AND trees.radolan_sum IS NULL
+    AND ST_CoveredBy(trees.geom, ST_Buffer(radolan_geometry.geometry, 0.0002))
+    AND {radolan_values_distinct};
+"""
+
+UPDATE_TREES_SQL = UPDATE_TREES_SQL_TEMPLATE.format(
+    radolan_days_columns=RADOLAN_DAYS_COLUMNS_SQL["hourly"],
+    radolan_values_distinct=RADOLAN_VALUES_DISTINCT_SQL["hourly"],
+)
+UPDATE_TREES_BUFFERED_SQL = UPDATE_TREES_BUFFERED_SQL_TEMPLATE.format(
+    radolan_days_columns=RADOLAN_DAYS_COLUMNS_SQL["hourly"],
+    radolan_values_distinct=RADOLAN_VALUES_DISTINCT_SQL["hourly"],
+)
+
+# Hours of the radolan values written into the trees by the last tree update of the daily run
+RADOLAN_TREE_WINDOW_SQL = """
+    CREATE TABLE IF NOT EXISTS radolan_tree_window (
+        id boolean PRIMARY KEY DEFAULT TRUE CHECK (id),
+        start_date timestamp NOT NULL,
+        end_date timestamp NOT NULL,
+        updated_at timestamptz NOT NULL DEFAULT NOW()
+    );
+"""
+
+# Change of the sum of each cell when one hour is added and the expired hour at the start of
+# the window is dropped, cells whose sum doesn't change are left out
+HOURLY_SUM_CHANGES_SQL = """
+    SELECT geom_id, SUM(value) AS value FROM (
+        SELECT UNNEST(%(geom_ids)s::integer[]) AS geom_id, UNNEST(%(values)s::integer[]) AS value
+        UNION ALL
+        SELECT geom_id, -value FROM radolan_data WHERE measured_at = %(expired_at)s
+    ) AS changes
+    GROUP BY geom_id
+    HAVING SUM(value) <> 0
+"""
+
+# Adds the values of one hour to the sums of the trees within the grid cells it rained in
+# and subtracts the expired hour
+ADD_HOURLY_VALUES_TO_TREES_SQL = f"""
+    UPDATE trees
+    SET radolan_sum = GREATEST(COALESCE(trees.radolan_sum, 0) + cells.value, 0)
+    FROM ({HOURLY_SUM_CHANGES_SQL}) AS cells
+    JOIN radolan_geometry ON radolan_geometry.id = cells.geom_id
+    WHERE ST_CoveredBy(trees.geom, radolan_geometry.geometry);
+"""
+
+# Triggers refreshing materialized views on every change of trees
+TREES_REFRESH_TRIGGERS = [
+    "tg_refresh_trees_count_mv",
+    "tg_refresh_most_frequent_tree_species_mv",
+    "tg_refresh_total_tree_species_count_mv",
+]
+
+# Materialized views on trees refreshed by these triggers
+TREES_MATERIALIZED_VIEWS = [
+    "trees_count",
+    "most_frequent_tree_species",
+    "total_tree_species_count",
+]
+
+# Columns of trees written by the tree update
+TREES_RADOLAN_COLUMNS = ["radolan_days", "radolan_days_daily", "radolan_sum"]
 
 
 def get_start_end_harvest_dates(db_conn):
@@ -29,53 +135,77 @@ def get_start_end_harvest_dates(db_conn):
         return [start_date, end_date]
 
 
-def upload_radolan_data_in_db(extracted_radolan_values, db_conn):
-    """Uploads extracted radolon data into database
+def upload_radolan_data_in_db(extracted_radolan_values, measured_at_timestamp, db_conn):
+    """Uploads extracted radolon data of one hour into database, marks the hour as loaded
+       and stores it in the precipitation cube if RADOLAN_CUBE_DIR is set
 
     Args:
         extracted_radolan_values (_type_): the radolon values to upload
+        measured_at_timestamp (datetime): the hour the values were measured at
         db_conn (_type_): the database connection
+
+    Returns:
+        list[tuple[int, int]]: geom_id and value of the loaded grid cells
     """
     logging.info(f"Uploading radolan data to database...")
     with db_conn.cursor() as cur:
+        # Loading an hour again replaces its previous values
+        cur.execute(
+            "DELETE FROM radolan_data WHERE measured_at = %s;", (measured_at_timestamp,)
+        )
         cur.execute("DELETE FROM radolan_temp;")
-        psycopg2.extras.execute_batch(
+        # All cells of the hour in one statement, geometries are WKB in 4326 already
+        psycopg2.extras.execute_values(
             cur,
-            """
-            INSERT INTO radolan_temp (geometry, value, measured_at)
-            VALUES (ST_Multi(ST_Transform(ST_GeomFromText(%s, 3857), 4326)), %s, %s);
-            """,
+            "INSERT INTO radolan_temp (geometry, value, measured_at) VALUES %s;",
             extracted_radolan_values,
+            template="(ST_Multi(ST_GeomFromWKB(%s, 4326)), %s, %s)",
+            page_size=len(extracted_radolan_values) or 1,
         )
-        cur.execute(
-            """
-            INSERT INTO radolan_data (geom_id, value, measured_at)
-            SELECT radolan_geometry.id, radolan_temp.value, radolan_temp.measured_at
-            FROM radolan_geometry
-            JOIN radolan_temp ON ST_WithIn(radolan_geometry.centroid, radolan_temp.geometry);
-            """
-        )
+        # radolan_temp is replaced completely every hour, so its statistics are always stale
+        cur.execute("ANALYZE radolan_temp;")
+        cur.execute(INSERT_RADOLAN_DATA_SQL)
+        cell_values = cur.fetchall()
+        mark_hour_ingested(cur, measured_at_timestamp, len(cell_values))
         db_conn.commit()
 
+    # The database is committed first, hours missing in the cube are loaded from it later
+    precipitation_cube = get_precipitation_cube(db_conn)
+    if precipitation_cube is not None:
+        precipitation_cube.write_hour(measured_at_timestamp, cell_values)
+
+    return cell_values
+
 
-def update_trees_in_database(radolan_grid, db_conn):
+def update_trees_in_database(radolan_grid, db_conn, resolution=RADOLAN_RESOLUTION):
     """Updates tree radolon data in database
 
     Args:
-        radolan_grid (_type_): the radolon value grid to use for updating the trees
+        radolan_grid (RadolanGrid): the radolon value grid to use for updating the trees
         db_conn (_type_): the database connection
+        resolution (str): "hourly", "daily" or "both", see RADOLAN_RESOLUTION
+
+    Returns:
+        int: number of updated tree rows
     """
-    triggers_to_manage = [
-        "tg_refresh_trees_count_mv",
-        "tg_refresh_most_frequent_tree_species_mv",
-        "tg_refresh_total_tree_species_count_mv",
-    ]
-    views_to_refresh = [
-        "trees_count",
-        "most_frequent_tree_species",
-        "total_tree_species_count",
-    ]
+    update_trees_sql = UPDATE_TREES_SQL_TEMPLATE.format(
+        radolan_days_columns=RADOLAN_DAYS_COLUMNS_SQL[resolution],
+        radolan_values_distinct=RADOLAN_VALUES_DISTINCT_SQL[resolution],
+    )
+    update_trees_buffered_sql = UPDATE_TREES_BUFFERED_SQL_TEMPLATE.format(
+        radolan_days_columns=RADOLAN_DAYS_COLUMNS_SQL[resolution],
+        radolan_values_distinct=RADOLAN_VALUES_DISTINCT_SQL[resolution],
+    )
+    if resolution != "hourly":
+        with db_conn.cursor() as cur:
+            cur.execute(
+                "ALTER TABLE trees ADD COLUMN IF NOT EXISTS radolan_days_daily smallint[];"
+            )
+            db_conn.commit()
 
+    triggers_to_manage = TREES_REFRESH_TRIGGERS
+
+    updated_rows = 0
     with db_conn.cursor() as cur:
         try:
             # Disable triggers
@@ -87,16 +217,14 @@ def update_trees_in_database(radolan_grid, db_conn):
             # --- Start Pass 1 --- #
             logging.info(f"Updating trees in database (Pass 1/2)...")
             processed_count = 0
-            total_count = len(radolan_grid)  # Assuming radolan_grid is a list or has len()
-            for days, total_sum, geojson_str in radolan_grid:
+            total_count = len(radolan_grid)
+            for geom_id, hourly, daily, total_sum in radolan_grid.iter_series(resolution):
+                radolan_days = [values for values in (hourly, daily) if values is not None]
                 cur.execute(
-                    """
-                    UPDATE trees
-                    SET radolan_days = %s, radolan_sum = %s
-                    WHERE ST_CoveredBy(geom, ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326));
-                    """,
-                    (days, total_sum, geojson_str),
+                    update_trees_sql,
+                    (*radolan_days, total_sum, geom_id, *radolan_days, total_sum),
                 )
+                updated_rows += cur.rowcount
                 processed_count += 1
                 if processed_count % 10 == 0:
                     logging.info(f"  Processed {processed_count}/{total_count} grid cells (Pass 1/2)...")
@@ -108,17 +236,13 @@ def update_trees_in_database(radolan_grid, db_conn):
             # --- Start Pass 2 --- #
             logging.info(f"Updating trees with NULL radolan_sum within buffer (Pass 2/2)...")
             processed_count = 0
-            # Also replace the second execute_batch
-            for days, total_sum, geojson_str in radolan_grid:
+            for geom_id, hourly, daily, total_sum in radolan_grid.iter_series(resolution):
+                radolan_days = [values for values in (hourly, daily) if values is not None]
                 cur.execute(
-                    """
-                    UPDATE trees
-                    SET radolan_days = %s, radolan_sum = %s
-                    WHERE trees.radolan_sum IS NULL
-                    AND ST_CoveredBy(geom, ST_Buffer(ST_SetSRID(ST_GeomFromGeoJSON(%s), 4326), 0.0002));
-                    """,
-                    (days, total_sum, geojson_str),
+                    update_trees_buffered_sql,
+                    (*radolan_days, total_sum, geom_id, *radolan_days, total_sum),
                 )
+                updated_rows += cur.rowcount
                 processed_count += 1
                 if processed_count % 10 == 0:
                     logging.info(f"  Processed {processed_count}/{total_count} grid cells (Pass 2/2)...")
@@ -134,25 +258,121 @@ def update_trees_in_database(radolan_grid, db_conn):
                 cur.execute(f"ALTER TABLE trees ENABLE TRIGGER {trigger};")
             db_conn.commit()
 
-        # Refresh materialized views
-        logging.info(f"Refreshing materialized views: {', '.join(views_to_refresh)}")
-        for view in views_to_refresh:
-            try:
-                cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view};")
-                db_conn.commit()
-            except Exception as e:
-                logging.error(f"Error refreshing materialized view {view}: {e}")
-                db_conn.rollback() # Rollback the failed refresh transaction
+    logging.info(f"Updated {updated_rows} tree rows in {len(radolan_grid)} grid cells, unchanged trees were skipped")
+
+    # Refresh the materialized views reading the radolan columns
+    refresh_materialized_views(TREES_MATERIALIZED_VIEWS, TREES_RADOLAN_COLUMNS, db_conn)
+
+    return updated_rows
 
 
-def cleanup_radolan_entries(limit_days, db_conn):
+def store_radolan_tree_window(radolan_grid, db_conn):
+    """Stores the hours of the radolan grid written into the trees by the tree update
+
+    Args:
+        radolan_grid (RadolanGrid): the radolan grid
+        db_conn (_type_): the database connection
+    """
+    if radolan_grid.start_date is None:
+        return
+    end_date = radolan_grid.start_date + timedelta(hours=radolan_grid.values.shape[1] - 1)
+    with db_conn.cursor() as cur:
+        cur.execute(RADOLAN_TREE_WINDOW_SQL)
+        cur.execute(
+            """
+            INSERT INTO radolan_tree_window (id, start_date, end_date) VALUES (TRUE, %s, %s)
+            ON CONFLICT (id) DO UPDATE
+            SET start_date = EXCLUDED.start_date, end_date = EXCLUDED.end_date, updated_at = NOW();
+            """,
+            (radolan_grid.start_date, end_date),
+        )
+        db_conn.commit()
+
+
+def get_expired_hour(measured_at_timestamp, db_conn):
+    """Returns the hour dropping out of the window of the tree values when an hour is added.
+       Every hour after the window of the last tree update replaces the hour one window length
+       earlier, so the sums keep covering LIMIT_DAYS days until the next daily run.
+
+    Args:
+        measured_at_timestamp (datetime): the added hour
+        db_conn (_type_): the database connection
+
+    Returns:
+        datetime: the expired hour, None if the added hour lies within the window
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(RADOLAN_TREE_WINDOW_SQL)
+        cur.execute("SELECT start_date, end_date FROM radolan_tree_window;")
+        window = cur.fetchone()
+        db_conn.commit()
+    if window is None or measured_at_timestamp <= window[1]:
+        return None
+    start_date, end_date = window
+    return measured_at_timestamp - (end_date - start_date + timedelta(hours=1))
+
+
+def get_hourly_sum_changes_params(cell_values, measured_at_timestamp, db_conn):
+    """Returns the parameters of HOURLY_SUM_CHANGES_SQL
+
+    Args:
+        cell_values (list[tuple[int, int]]): geom_id and value of the cells it rained in
+        measured_at_timestamp (datetime): the added hour
+        db_conn (_type_): the database connection
+
+    Returns:
+        dict: the parameters, None if the sums don't change
+    """
+    expired_at = get_expired_hour(measured_at_timestamp, db_conn)
+    if not cell_values and expired_at is None:
+        return None
+    return {
+        "geom_ids": [geom_id for geom_id, _ in cell_values],
+        "values": [value for _, value in cell_values],
+        "expired_at": expired_at,
+    }
+
+
+def add_hourly_values_to_trees(cell_values, measured_at_timestamp, db_conn):
+    """Adds the radolan values of one hour to radolan_sum of the trees in the affected cells only
+       and subtracts the values of the hour dropping out of the window
+
+    Args:
+        cell_values (list[tuple[int, int]]): geom_id and value of the cells it rained in
+        measured_at_timestamp (datetime): the added hour
+        db_conn (_type_): the database connection
+
+    Returns:
+        int: number of updated tree rows
+    """
+    params = get_hourly_sum_changes_params(cell_values, measured_at_timestamp, db_conn)
+    if params is None:
+        return 0
+    with db_conn.cursor() as cur:
+        # All in one transaction, the views are refreshed afterwards if they read radolan_sum
+        for trigger in TREES_REFRESH_TRIGGERS:
+            cur.execute(f"ALTER TABLE trees DISABLE TRIGGER {trigger};")
+        cur.execute(ADD_HOURLY_VALUES_TO_TREES_SQL, params)
+        updated_rows = cur.rowcount
+        for trigger in TREES_REFRESH_TRIGGERS:
+            cur.execute(f"ALTER TABLE trees ENABLE TRIGGER {trigger};")
+        db_conn.commit()
+    refresh_materialized_views(TREES_MATERIALIZED_VIEWS, ["radolan_sum"], db_conn)
+    return updated_rows
+
+
+def cleanup_radolan_entries(retention_days, db_conn):
     """Cleanup radolon data in database (old and duplicated data)
 
     Args:
-        limit_days (number): number of previous days to keep radolan data for
+        retention_days (number): number of previous days to keep radolan data for
         db_conn (_type_): the database connection
+
+    Returns:
+        int: number of deleted radolan_data rows
     """
     logging.info(f"Cleanup old and duplicated datat in database...")
+    deleted_rows = 0
     with db_conn.cursor() as cur:
         # Delete duplicated data
         cur.execute(
@@ -162,6 +382,7 @@ def cleanup_radolan_entries(limit_days, db_conn):
             AND a.measured_at = b.measured_at
             """
         )
+        deleted_rows += cur.rowcount
         # Delete old data
         cur.execute(
             """
@@ -169,10 +390,12 @@ def cleanup_radolan_entries(limit_days, db_conn):
             FROM radolan_data
             WHERE measured_at < NOW() - INTERVAL '{} days'
             """.format(
-                limit_days
+                retention_days
             )
         )
+        deleted_rows += cur.rowcount
         db_conn.commit()
+        return deleted_rows
 
 
 def update_harvest_dates(start_date, end_date, db_conn):
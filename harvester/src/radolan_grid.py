@@ -0,0 +1,161 @@
+import os
+import io
+import numpy
+import pytz
+from datetime import datetime
+from datetime import timedelta
+
+# Resolution of the radolan values stored for the trees: "hourly" (radolan_days), "daily"
+# (radolan_days_daily, sums per Europe/Berlin day) or "both"
+RADOLAN_RESOLUTION = os.getenv("RADOLAN_RESOLUTION", "hourly")
+
+DAILY_TIMEZONE = "Europe/Berlin"
+
+# Daily sums are stored as smallint, 3276.7 mm per day
+DAILY_VALUES_MAX = numpy.iinfo(numpy.int16).max
+
+
+class RadolanGrid:
+    """Hourly radolan values of the grid cells it rained in
+
+    Cells are identified by their radolan_geometry id, the geometry is looked up by id in the
+    database only where it is needed, e.g. in the tree update.
+
+    Attributes:
+        geom_ids (numpy.ndarray): radolan_geometry ids of the cells
+        values (numpy.ndarray): (cells x hours) hourly radolan values in 0.1 mm
+        sums (numpy.ndarray): sum of the hourly values of each cell
+        start_date (datetime): hour (UTC) of the first value
+    """
+
+    def __init__(self, geom_ids, values, sums=None, start_date=None):
+        self.geom_ids = geom_ids
+        self.values = values
+        self.sums = values.sum(axis=1, dtype=numpy.int64) if sums is None else sums
+        self.start_date = start_date
+        self._daily_values = None
+        self._daily_start_date = None
+
+    def __len__(self):
+        return len(self.geom_ids)
+
+    def __iter__(self):
+        """Yields geom_id, list of hourly values and sum of every cell"""
+        for index, geom_id in enumerate(self.geom_ids):
+            yield int(geom_id), self.values[index].tolist(), int(self.sums[index])
+
+    @property
+    def nbytes(self):
+        return self.geom_ids.nbytes + self.values.nbytes + self.sums.nbytes
+
+    @property
+    def daily_values(self):
+        """(cells x days) sums of the hourly values per Europe/Berlin day as int16. Only days
+        whose hours are all within the window are included, see daily_start_date."""
+        if self._daily_values is None:
+            timezone = pytz.timezone(DAILY_TIMEZONE)
+            hours = self.values.shape[1]
+            # Days of the hours of the window and of the hours right before and after it
+            days = [
+                pytz.utc.localize(self.start_date + timedelta(hours=hour))
+                .astimezone(timezone)
+                .date()
+                for hour in range(-1, hours + 1)
+            ]
+            # Index i of days is hour i - 1 of the window, a day before the first start is partial
+            day_starts = [index for index in range(1, hours + 1) if days[index] != days[index - 1]]
+            days_end = hours + 1
+            if day_starts and days[hours + 1] == days[hours]:
+                # The last day continues after the window
+                days_end = day_starts.pop()
+            if not day_starts:
+                daily_values = numpy.zeros((len(self), 0), dtype=numpy.int32)
+                self._daily_start_date = None
+            else:
+                daily_values = numpy.add.reduceat(
+                    self.values[:, day_starts[0] - 1 : days_end - 1],
+                    [start - day_starts[0] for start in day_starts],
+                    axis=1,
+                    dtype=numpy.int32,
+                )
+                self._daily_start_date = days[day_starts[0]]
+            self._daily_values = numpy.minimum(daily_values, DAILY_VALUES_MAX).astype(
+                numpy.int16
+            )
+        return self._daily_values
+
+    @property
+    def daily_start_date(self):
+        """Europe/Berlin day of the first value of daily_values, None without complete days"""
+        self.daily_values
+        return self._daily_start_date
+
+    def iter_series(self, resolution=RADOLAN_RESOLUTION):
+        """Yields geom_id, hourly values, daily values and sum of every cell.
+           Values not included in the resolution are None.
+
+        Args:
+            resolution (str): "hourly", "daily" or "both"
+        """
+        if resolution not in ["hourly", "daily", "both"]:
+            raise ValueError(f"Unknown RADOLAN_RESOLUTION {resolution}")
+        for index, geom_id in enumerate(self.geom_ids):
+            yield (
+                int(geom_id),
+                self.values[index].tolist() if resolution != "daily" else None,
+                self.daily_values[index].tolist() if resolution != "hourly" else None,
+                int(self.sums[index]),
+            )
+
+    def to_bytes(self):
+        """Serializes the grid, e.g. to hand it over to another process
+
+        Returns:
+            bytes: the arrays in numpy's npz format
+        """
+        buffer = io.BytesIO()
+        numpy.savez(
+            buffer,
+            geom_ids=self.geom_ids,
+            values=self.values,
+            sums=self.sums,
+            start_date=numpy.array(self.start_date.isoformat() if self.start_date else ""),
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserializes a grid serialized with to_bytes
+
+        Args:
+            data (bytes): the serialized grid
+
+        Returns:
+            RadolanGrid: the grid
+        """
+        arrays = numpy.load(io.BytesIO(data))
+        start_date = str(arrays["start_date"])
+        return cls(
+            arrays["geom_ids"],
+            arrays["values"],
+            arrays["sums"],
+            datetime.fromisoformat(start_date) if start_date else None,
+        )
+
+    def get_geometries(self, db_conn):
+        """Looks up the GeoJSON geometries of the cells
+
+        Args:
+            db_conn (_type_): the database connection
+
+        Returns:
+            dict[int, str]: GeoJSON geometry by geom_id
+        """
+        with db_conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, ST_AsGeoJSON(geometry) FROM radolan_geometry WHERE id = ANY(%s);",
+                (self.geom_ids.tolist(),),
+            )
+            geometries = dict(cur.fetchall())
+            db_conn.commit()
+        return geometries
@@ -0,0 +1,161 @@
+import os
+import math
+import logging
+import numpy
+import geopandas
+
+# Reads only the cells around the area of interest from the Germany-wide ESRI ASCII grids.
+# The window is computed once from the bounding box of the shape file in the RADOLAN projection,
+# rows above the window are skipped without parsing and only the columns inside the window are
+# converted. The window is written as a small ASCII grid with the same cell size and alignment,
+# so gdalwarp and gdal_polygonize only process a few dozen rows and columns. Several areas of
+# interest are cut from a single read of the grid.
+
+RADOLAN_PROJECTION = (
+    "+proj=stere +lon_0=10.0 +lat_0=90.0 +lat_ts=60.0 +a=6370040 +b=6370040 +units=m"
+)
+
+ASCII_HEADER_LINES = 6
+
+_windows = {}
+
+
+def read_ascii_header(f):
+    """Reads the six line header of an ESRI ASCII grid
+
+    Args:
+        f (file): the opened grid file, positioned at the start
+
+    Returns:
+        dict: ncols, nrows, xllcorner, yllcorner, cellsize and nodata_value
+    """
+    header = {}
+    for _ in range(ASCII_HEADER_LINES):
+        key, value = f.readline().split()
+        header[key.lower()] = float(value)
+    for key in ["ncols", "nrows"]:
+        header[key] = int(header[key])
+    return header
+
+
+def compute_window(shape_file, header, margin=1):
+    """Computes the rows and columns of the grid covering the shape file
+
+    Args:
+        shape_file (str): path of the shape file defining the area of interest
+        header (dict): header of the grid
+        margin (int): number of additional cells on every side
+
+    Returns:
+        tuple[int, int, int, int]: first row, last row + 1, first column, last column + 1
+    """
+    min_x, min_y, max_x, max_y = (
+        geopandas.read_file(shape_file).to_crs(RADOLAN_PROJECTION).total_bounds
+    )
+    cellsize = header["cellsize"]
+    top = header["yllcorner"] + header["nrows"] * cellsize
+    first_row = max(0, math.floor((top - max_y) / cellsize) - margin)
+    last_row = min(header["nrows"], math.ceil((top - min_y) / cellsize) + margin)
+    first_col = max(0, math.floor((min_x - header["xllcorner"]) / cellsize) - margin)
+    last_col = min(header["ncols"], math.ceil((max_x - header["xllcorner"]) / cellsize) + margin)
+    return first_row, last_row, first_col, last_col
+
+
+def get_window(shape_file, header):
+    """Returns the window of the shape file, computed once per shape file and grid layout"""
+    key = (shape_file, tuple(sorted(header.items())))
+    if key not in _windows:
+        _windows[key] = compute_window(shape_file, header)
+        logging.info(f"Reading radolan window rows/cols {_windows[key]} for {shape_file}")
+    return _windows[key]
+
+
+def read_ascii_window(hourly_radolan_file, shape_files):
+    """Reads the values of the smallest window covering all shape files in one pass
+
+    Args:
+        hourly_radolan_file (str): path of the hourly radolan file
+        shape_files (list[str]): paths of the shape files defining the areas of interest
+
+    Returns:
+        tuple[dict, tuple, numpy.ndarray]: header of the grid, the window and its values
+    """
+    with open(hourly_radolan_file) as f:
+        header = read_ascii_header(f)
+        windows = [get_window(shape_file, header) for shape_file in shape_files]
+        first_row = min(window[0] for window in windows)
+        last_row = max(window[1] for window in windows)
+        first_col = min(window[2] for window in windows)
+        last_col = max(window[3] for window in windows)
+        for _ in range(first_row):
+            f.readline()
+        values = numpy.empty((last_row - first_row, last_col - first_col), dtype=numpy.int16)
+        for row in range(last_row - first_row):
+            # maxsplit stops splitting after the last column of the window
+            values[row] = f.readline().split(None, last_col)[first_col:last_col]
+    return header, (first_row, last_row, first_col, last_col), values
+
+
+def write_ascii_window(output_file, header, window, values):
+    """Writes the values of a window as a small ESRI ASCII grid aligned with the original grid
+
+    Args:
+        output_file (str): path of the written file
+        header (dict): header of the original grid
+        window (tuple): first row, last row + 1, first column, last column + 1
+        values (numpy.ndarray): values of the window
+    """
+    first_row, last_row, first_col, last_col = window
+    cellsize = header["cellsize"]
+    with open(output_file, "w") as f:
+        f.write(f"ncols {last_col - first_col}\n")
+        f.write(f"nrows {last_row - first_row}\n")
+        f.write(f"xllcorner {header['xllcorner'] + first_col * cellsize:.10g}\n")
+        f.write(f"yllcorner {header['yllcorner'] + (header['nrows'] - last_row) * cellsize:.10g}\n")
+        f.write(f"cellsize {cellsize:.10g}\n")
+        f.write(f"NODATA_value {header['nodata_value']:.10g}\n")
+        numpy.savetxt(f, values, fmt="%d")
+
+
+def crop_radolan_ascii(hourly_radolan_file, shape_file, tmp_dir):
+    """Writes the window covering the shape file as a small ESRI ASCII grid
+
+    Args:
+        hourly_radolan_file (str): path of the hourly radolan file
+        shape_file (str): path of the shape file defining the area of interest
+        tmp_dir (str): path of the directory holding the temp files
+
+    Returns:
+        str: path of the cropped file, it has the same name as the hourly radolan file
+    """
+    return crop_radolan_ascii_regions(hourly_radolan_file, {tmp_dir: shape_file})[tmp_dir]
+
+
+def crop_radolan_ascii_regions(hourly_radolan_file, shape_files_by_dir):
+    """Reads the hourly radolan file once and writes the window of every shape file
+
+    Args:
+        hourly_radolan_file (str): path of the hourly radolan file
+        shape_files_by_dir (dict[str, str]): shape file of each output directory
+
+    Returns:
+        dict[str, str]: path of the cropped file in each output directory, named like the hourly radolan file
+    """
+    header, (first_row, _, first_col, _), values = read_ascii_window(
+        hourly_radolan_file, list(shape_files_by_dir.values())
+    )
+    cropped_files = {}
+    for tmp_dir, shape_file in shape_files_by_dir.items():
+        window = get_window(shape_file, header)
+        output_file = os.path.join(tmp_dir, os.path.basename(hourly_radolan_file))
+        write_ascii_window(
+            output_file,
+            header,
+            window,
+            values[
+                window[0] - first_row : window[1] - first_row,
+                window[2] - first_col : window[3] - first_col,
+            ],
+        )
+        cropped_files[tmp_dir] = output_file
+    return cropped_files
@@ -0,0 +1,343 @@
+import sys
+import os
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import urllib.error
+from datetime import datetime
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from download_radolan_data import (
+    download_radolan_data,
+    unzip_radolan_data,
+    stream_historical_radolan_month,
+)
+from dwd_harvest import get_measured_at_timestamp, extract_hourly_radolan_values
+from radolan_db_utils import upload_radolan_data_in_db
+from radolan_checkpoints import (
+    ensure_checkpoint_table,
+    get_missing_hours,
+    get_retention_days,
+    get_first_retained_day,
+    format_hours,
+)
+from build_radolan_grid import build_radolan_grid
+from schema_check import analyze_tables
+from harvest_metrics import metrics
+from harvester_setup import (
+    DATABASE_ENV_VARS,
+    find_missing_environment_variables,
+    connect_database,
+)
+
+# Backfills RADOLAN data for an arbitrary date range, e.g. several months or years.
+# Months are streamed from the historical DWD archive, months which are not archived yet
+# are downloaded day by day from the recent directory. Hours are processed by parallel workers,
+# the number of hours in flight is limited by the memory budget. Uploads go through the regular
+# bulk loader and write checkpoints, so an interrupted backfill resumes with the missing hours.
+# The tree update and the Mapbox layer are only updated once at the end with --finalize.
+# The daily runs delete radolan data older than RADOLAN_RETENTION_DAYS (default LIMIT_DAYS),
+# ranges which the next daily run would delete again are refused.
+
+# Set up logging
+logging.basicConfig()
+logging.root.setLevel(logging.INFO)
+
+# Load the environmental variables
+load_dotenv()
+
+REQUIRED_ENV_VARS = DATABASE_ENV_VARS + ["SURROUNDING_SHAPE_FILE", "LIMIT_DAYS"]
+
+SURROUNDING_SHAPE_FILE = os.getenv("SURROUNDING_SHAPE_FILE")
+LIMIT_DAYS = os.getenv("LIMIT_DAYS")
+
+# Estimated peak memory of one hour in flight, not a measured number: the gdalwarp or
+# gdal_polygonize child process of the hour plus the polygons and extracted values of the
+# cropped area in the harvester. Override it with --hourly-memory-mb, every backfill logs the
+# measured values (largest child process, largest increase of an hourly stage) at the end.
+HOURLY_MEMORY_MB = 16
+
+# Stages of one hour in flight, see extract_hourly_radolan_values
+HOURLY_STAGES = ["crop", "project", "polygonize", "extract"]
+
+
+def get_months(start_date, end_date):
+    """Lists all months between start_date and end_date
+
+    Args:
+        start_date (datetime): first day
+        end_date (datetime): last day
+
+    Returns:
+        list[tuple[int, int]]: year and month of each month, ascending
+    """
+    months = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def get_daily_archive_date(daily_radolan_file):
+    """Parses the day from the name of a daily radolan archive, e.g. RW-20240101.tar.gz
+
+    Args:
+        daily_radolan_file (str): path to the daily radolan archive
+
+    Returns:
+        date: the day of the archive
+    """
+    filename = os.path.basename(daily_radolan_file)
+    return datetime.strptime(filename, "RW-%Y%m%d.tar.gz").date()
+
+
+def iterate_daily_radolan_files(start_date, end_date, path):
+    """Downloads the daily radolan archives between start_date and end_date one at a time
+
+    Args:
+        start_date (datetime): first day
+        end_date (datetime): last day
+        path (str): path where the daily archives are stored
+
+    Yields:
+        str: file path of the next daily archive
+    """
+    for year, month in get_months(start_date, end_date):
+        try:
+            yield from stream_historical_radolan_month(year, month, path)
+        except urllib.error.HTTPError as e:
+            # The current and the previous month are only published in the recent directory
+            logging.info(f"No historical archive for {year}-{month:02d} ({e}), using recent data")
+            first_day = max(start_date, datetime(year, month, 1))
+            next_month = datetime(year + month // 12, month % 12 + 1, 1)
+            last_day = min(end_date, next_month - timedelta(days=1))
+            day = first_day
+            while day <= last_day:
+                # Daily ASCII archives like the historical archive, independent of RADOLAN_FORMAT
+                yield from download_radolan_data(day, day, path, radolan_format="asc")
+                day += timedelta(days=1)
+
+
+def get_hours_in_flight(workers, memory_budget_mb, hourly_memory_mb=HOURLY_MEMORY_MB):
+    """Returns the number of hours processed at once within the memory budget
+
+    Args:
+        workers (int): requested number of hours processed in parallel
+        memory_budget_mb (int): memory budget for the hours in flight
+        hourly_memory_mb (int): estimated memory of one hour in flight
+
+    Returns:
+        int: number of hours in flight, at least 1
+    """
+    hours_in_flight = min(workers, memory_budget_mb // hourly_memory_mb)
+    if hours_in_flight < 1:
+        logging.warning(
+            f"Memory budget of {memory_budget_mb} MB is below {hourly_memory_mb} MB per hour, processing one hour at a time"
+        )
+        return 1
+    if hours_in_flight < workers:
+        logging.info(
+            f"Memory budget of {memory_budget_mb} MB allows {hours_in_flight} of {workers} workers"
+        )
+    return hours_in_flight
+
+
+def log_hourly_memory(hourly_memory_mb=HOURLY_MEMORY_MB):
+    """Logs the measured memory of the hourly stages against the estimate of one hour in flight
+
+    Args:
+        hourly_memory_mb (int): estimated memory of one hour in flight
+    """
+    stages = metrics.report(True)["stages"]
+    hourly_stages = [stages[name] for name in HOURLY_STAGES if name in stages]
+    if not hourly_stages:
+        return
+    children_mb = max(stage["children_process_peak_rss_bytes"] for stage in hourly_stages) / 1024**2
+    increase_mb = max(stage["rss_increase_bytes"] or 0 for stage in hourly_stages) / 1024**2
+    message = (
+        f"Measured memory of one hour: largest child process {children_mb:.1f} MB, "
+        f"largest stage increase in the harvester {increase_mb:.1f} MB, estimate {hourly_memory_mb} MB"
+    )
+    if children_mb + increase_mb > hourly_memory_mb:
+        logging.warning(f"{message}, raise --hourly-memory-mb to stay within the budget")
+    else:
+        logging.info(message)
+
+
+def backfill_radolan_data(
+    surrounding_shape_file,
+    start_date,
+    end_date,
+    workers,
+    memory_budget_mb,
+    database_connection,
+    hourly_memory_mb=HOURLY_MEMORY_MB,
+):
+    """Loads the radolan data of all hours between start_date and end_date which are not loaded yet
+
+    Args:
+        surrounding_shape_file (shapefile): shapefile for area of interest
+        start_date (datetime): first day to backfill
+        end_date (datetime): last day to backfill
+        workers (int): maximum number of hours processed in parallel
+        memory_budget_mb (int): memory budget for the hours in flight, reduces the workers
+        database_connection (_type_): database connection
+        hourly_memory_mb (int): estimated memory of one hour in flight
+
+    Returns:
+        list[datetime]: hours which could not be loaded
+    """
+    missing_hours = set(get_missing_hours(start_date, end_date, database_connection))
+    logging.info(f"{len(missing_hours)} hours between {start_date} and {end_date} are not loaded yet")
+    if not missing_hours:
+        return []
+    missing_days = set(hour.date() for hour in missing_hours)
+
+    # Each hour holds a slot until it is uploaded, so the producer pauses when the budget is used
+    # up. There are no more workers than slots, so the budget also bounds the parallel hours.
+    hours_in_flight = get_hours_in_flight(workers, memory_budget_mb, hourly_memory_mb)
+    hour_slots = threading.BoundedSemaphore(hours_in_flight)
+
+    # radolan_temp is shared, so only one hour is uploaded at a time
+    upload_lock = threading.Lock()
+
+    def process_hour(hourly_radolan_file, measured_at_timestamp):
+        try:
+            extracted_radolan_values = extract_hourly_radolan_values(
+                hourly_radolan_file, measured_at_timestamp, surrounding_shape_file
+            )
+            with upload_lock, metrics.stage("upload") as stage:
+                upload_radolan_data_in_db(
+                    extracted_radolan_values,
+                    measured_at_timestamp,
+                    database_connection,
+                )
+                stage.add_rows(len(extracted_radolan_values))
+        except Exception:
+            logging.exception(f"❌Could not load {measured_at_timestamp}")
+            with upload_lock:
+                database_connection.rollback()
+        finally:
+            os.remove(hourly_radolan_file)
+            hour_slots.release()
+
+    with tempfile.TemporaryDirectory() as temp_dir, ThreadPoolExecutor(
+        max_workers=hours_in_flight
+    ) as executor:
+        daily_radolan_files = iterate_daily_radolan_files(start_date, end_date, temp_dir)
+        for daily_radolan_file in daily_radolan_files:
+            day = get_daily_archive_date(daily_radolan_file)
+            if day not in missing_days:
+                os.remove(daily_radolan_file)
+                continue
+
+            # Every day is extracted into its own directory, unzip_radolan_data lists the whole directory
+            day_dir = os.path.join(temp_dir, day.strftime("%Y%m%d"))
+            os.makedirs(day_dir, exist_ok=True)
+            daily_archive = shutil.move(daily_radolan_file, day_dir)
+            with metrics.stage("unzip") as stage:
+                hourly_radolan_files = unzip_radolan_data([daily_archive], day_dir)
+                stage.add_rows(len(hourly_radolan_files))
+
+            for hourly_radolan_file in sorted(hourly_radolan_files):
+                measured_at_timestamp = get_measured_at_timestamp(hourly_radolan_file)
+                if measured_at_timestamp not in missing_hours:
+                    os.remove(hourly_radolan_file)
+                    continue
+                hour_slots.acquire()
+                executor.submit(process_hour, hourly_radolan_file, measured_at_timestamp)
+
+    log_hourly_memory(hourly_memory_mb)
+    return get_missing_hours(start_date, end_date, database_connection)
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backfill RADOLAN data for a date range from the DWD archives"
+    )
+    parser.add_argument("--start", type=parse_date, required=True, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", type=parse_date, required=True, help="last day, YYYY-MM-DD")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="hours processed in parallel"
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=512,
+        help="memory budget for the hours in flight, limits the workers",
+    )
+    parser.add_argument(
+        "--hourly-memory-mb",
+        type=int,
+        default=HOURLY_MEMORY_MB,
+        help="estimated memory of one hour in flight",
+    )
+    parser.add_argument(
+        "--finalize",
+        action="store_true",
+        help="update the trees and the Mapbox layer after the backfill",
+    )
+    args = parser.parse_args()
+
+    required_env_vars = REQUIRED_ENV_VARS
+    if args.finalize:
+        import run_harvester
+
+        required_env_vars = run_harvester.REQUIRED_ENV_VARS
+    if find_missing_environment_variables(required_env_vars):
+        sys.exit(1)
+
+    first_retained_day = get_first_retained_day(get_retention_days(int(LIMIT_DAYS)))
+    if args.start < first_retained_day:
+        logging.error(
+            f"❌The daily runs keep the radolan data from {first_retained_day:%Y-%m-%d} on, the hours before "
+            f"would be deleted again. Raise RADOLAN_RETENTION_DAYS to keep the backfilled history."
+        )
+        sys.exit(1)
+
+    try:
+        database_connection = connect_database()
+    except:
+        logging.error("❌Could not establish database connection")
+        sys.exit(1)
+
+    backfill_succeeded = False
+    try:
+        ensure_checkpoint_table(database_connection)
+        still_missing_hours = backfill_radolan_data(
+            surrounding_shape_file=SURROUNDING_SHAPE_FILE,
+            start_date=args.start,
+            end_date=datetime.combine(args.end, datetime.max.time()),
+            workers=args.workers,
+            memory_budget_mb=args.memory_budget_mb,
+            database_connection=database_connection,
+            hourly_memory_mb=args.hourly_memory_mb,
+        )
+        if still_missing_hours:
+            logging.warning(
+                f"{len(still_missing_hours)} hours could not be loaded: {', '.join(format_hours(still_missing_hours))}"
+            )
+
+        # Refresh planner statistics after the bulk load
+        analyze_tables(["radolan_data"], database_connection)
+
+        if args.finalize:
+            with metrics.stage("grid_build") as stage:
+                radolan_grid = build_radolan_grid(int(LIMIT_DAYS), database_connection)
+                stage.add_rows(len(radolan_grid))
+            run_harvester.update_trees_and_mapbox_layer(radolan_grid, database_connection)
+
+        backfill_succeeded = not still_missing_hours
+    finally:
+        metrics.write_reports(backfill_succeeded)
+
+    if not backfill_succeeded:
+        sys.exit(1)
@@ -1,15 +1,24 @@
 import sys
-import psycopg2.extras
-import psycopg2
 from dotenv import load_dotenv
 import logging
 import os
-from radolan_db_utils import update_trees_in_database
+from datetime import datetime
+from datetime import timedelta
+from radolan_cell_storage import update_tree_radolan_values
 from dwd_harvest import harvest_dwd
 from radolan_db_utils import (
     get_start_end_harvest_dates,
 )
 from mapbox_tree_update import update_mapbox_tree_layer, update_tree_waterings
+from harvest_metrics import metrics
+from db_profiler import statement_profiler
+from schema_check import check_schema
+from radolan_checkpoints import ensure_checkpoint_table
+from harvester_setup import (
+    DATABASE_ENV_VARS,
+    find_missing_environment_variables,
+    connect_database,
+)
 
 # Set up logging
 logging.basicConfig()
@@ -18,12 +27,7 @@ logging.root.setLevel(logging.INFO)
 # Load the environmental variables
 load_dotenv()
 
-# Check if all required environmental variables are accessible
-for env_var in [
-    "PG_DB",
-    "PG_PORT",
-    "PG_USER",
-    "PG_PASS",
+REQUIRED_ENV_VARS = DATABASE_ENV_VARS + [
     "SUPABASE_URL",
     "SUPABASE_BUCKET_NAME",
     "SUPABASE_SERVICE_ROLE_KEY",
@@ -33,62 +37,106 @@ for env_var in [
     "MAPBOXTILESET",
     "MAPBOXLAYERNAME",
     "SURROUNDING_SHAPE_FILE",
-]:
-    if env_var not in os.environ:
-        logging.error("❌Environmental Variable {} does not exist".format(env_var))
-        sys.exit(1)
+]
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_BUCKET_NAME = os.getenv("SUPABASE_BUCKET_NAME")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-LIMIT_DAYS = int(os.getenv("LIMIT_DAYS"))
+LIMIT_DAYS = os.getenv("LIMIT_DAYS")
 SKIP_MAPBOX = os.getenv("SKIP_MAPBOX") == "True"
 MAPBOX_USERNAME = os.getenv("MAPBOXUSERNAME")
 MAPBOX_TOKEN = os.getenv("MAPBOXTOKEN")
 MAPBOX_TILESET = os.getenv("MAPBOXTILESET")
 MAPBOX_LAYERNAME = os.getenv("MAPBOXLAYERNAME")
-PG_SERVER = os.getenv("PG_SERVER")
-PG_PORT = os.getenv("PG_PORT")
-PG_USER = os.getenv("PG_USER")
-PG_PASS = os.getenv("PG_PASS")
-PG_DB = os.getenv("PG_DB")
 SURROUNDING_SHAPE_FILE = os.getenv("SURROUNDING_SHAPE_FILE")
+DB_PROFILE = os.getenv("DB_PROFILE") == "True"
+SCHEMA_CHECK_MODE = os.getenv("SCHEMA_CHECK_MODE", "warn")
+RADOLAN_REFETCH_MISSING = os.getenv("RADOLAN_REFETCH_MISSING") == "True"
 
-# Establish database connection
-try:
-    database_connection_str = f"host='{PG_SERVER}' port={PG_PORT} user='{PG_USER}' password='{PG_PASS}' dbname='{PG_DB}'"
-    database_connection = psycopg2.connect(database_connection_str)
-    logging.info("🗄 Database connection established")
-except:
-    logging.error("❌Could not establish database connection")
-    database_connection = None
-    sys.exit(1)
-
-# Start harvesting DWD data
-start_date, end_date = get_start_end_harvest_dates(database_connection)
-radolan_grid = harvest_dwd(
-    surrounding_shape_file=SURROUNDING_SHAPE_FILE,
-    start_date=start_date,
-    end_date=end_date,
-    limit_days=LIMIT_DAYS,
-    database_connection=database_connection,
-)
 
-# Update trees in database
-update_trees_in_database(radolan_grid, database_connection)
-
-# Update Mapbox layer
-if not SKIP_MAPBOX:
-    trees_watered = update_mapbox_tree_layer(
-        MAPBOX_USERNAME,
-        MAPBOX_TOKEN,
-        MAPBOX_TILESET,
-        MAPBOX_LAYERNAME,
-        SUPABASE_URL,
-        SUPABASE_BUCKET_NAME,
-        SUPABASE_SERVICE_ROLE_KEY,
-        database_connection,
+def run_harvester(database_connection):
+    """Harvests the DWD radolan data, updates the trees and the Mapbox layer
+
+    Args:
+        database_connection (_type_): the database connection
+
+    Raises:
+        RuntimeError: If the schema check fails in strict mode.
+    """
+    # Check the indexes and table statistics the harvester relies on
+    with metrics.stage("schema_check"):
+        check_schema(SCHEMA_CHECK_MODE, database_connection)
+
+    # Start harvesting DWD data
+    ensure_checkpoint_table(database_connection)
+    start_date, end_date = get_start_end_harvest_dates(database_connection)
+    if RADOLAN_REFETCH_MISSING:
+        # Only hours without checkpoint are downloaded, so the whole retention window can be searched
+        start_date = min(
+            start_date,
+            datetime.combine(
+                end_date - timedelta(days=int(LIMIT_DAYS) - 1), datetime.min.time()
+            ),
+        )
+    radolan_grid = harvest_dwd(
+        surrounding_shape_file=SURROUNDING_SHAPE_FILE,
+        start_date=start_date,
+        end_date=end_date,
+        limit_days=int(LIMIT_DAYS),
+        database_connection=database_connection,
     )
 
-    # Update the tree waterings and flag the waterings which are now included in the mapbox layer with included_in_map_layer = TRUE
-    update_tree_waterings(trees_watered, database_connection)
+    update_trees_and_mapbox_layer(radolan_grid, database_connection)
+
+
+def update_trees_and_mapbox_layer(radolan_grid, database_connection):
+    """Updates the radolan values of the trees and the Mapbox layer
+
+    Args:
+        radolan_grid (RadolanGrid): grid of radolan data
+        database_connection (_type_): the database connection
+    """
+    # Update trees in database
+    with metrics.stage("tree_update") as stage:
+        stage.add_rows(update_tree_radolan_values(radolan_grid, database_connection))
+
+    # Update Mapbox layer
+    if not SKIP_MAPBOX:
+        trees_watered = update_mapbox_tree_layer(
+            MAPBOX_USERNAME,
+            MAPBOX_TOKEN,
+            MAPBOX_TILESET,
+            MAPBOX_LAYERNAME,
+            SUPABASE_URL,
+            SUPABASE_BUCKET_NAME,
+            SUPABASE_SERVICE_ROLE_KEY,
+            database_connection,
+        )
+
+        # Update the tree waterings and flag the waterings which are now included in the mapbox layer with included_in_map_layer = TRUE
+        with metrics.stage("tree_waterings") as stage:
+            update_tree_waterings(trees_watered, database_connection)
+            stage.add_rows(len(trees_watered))
+
+
+if __name__ == "__main__":
+    # Check if all required environmental variables are accessible
+    if find_missing_environment_variables(REQUIRED_ENV_VARS):
+        sys.exit(1)
+
+    # Establish database connection
+    try:
+        database_connection = connect_database()
+    except:
+        logging.error("❌Could not establish database connection")
+        sys.exit(1)
+
+    harvest_succeeded = False
+    try:
+        run_harvester(database_connection)
+        harvest_succeeded = True
+    finally:
+        # Write per-stage timings, throughput and memory usage of this run
+        metrics.write_reports(harvest_succeeded)
+        if DB_PROFILE:
+            statement_profiler.log_summary()
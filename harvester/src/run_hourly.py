@@ -0,0 +1,138 @@
+import os
+import sys
+import logging
+import tempfile
+from datetime import datetime
+from datetime import timedelta
+from dotenv import load_dotenv
+from download_radolan_data import download_latest_radolan_hour
+from radolan_binary import convert_radolan_binary_to_ascii
+from dwd_harvest import extract_hourly_radolan_values
+from radolan_db_utils import upload_radolan_data_in_db, add_hourly_values_to_trees
+from radolan_cell_storage import RADOLAN_STORAGE_MODE, add_hourly_values_to_cells
+from radolan_checkpoints import RADOLAN_MINUTE, ensure_checkpoint_table, get_missing_hours
+from harvest_metrics import metrics
+from harvester_setup import (
+    DATABASE_ENV_VARS,
+    find_missing_environment_variables,
+    connect_database,
+)
+
+# Near-real-time mode, meant to be scheduled every hour in addition to the daily run.
+# Polls DWD's operational RW product for the hours of the last HOURLY_LOOKBACK_HOURS hours
+# which are not loaded yet, loads them with checkpoints and adds their values to radolan_sum
+# of the trees in the cells it rained in. Every hour after the window of the last daily tree
+# update replaces the hour one window length earlier, whose values are subtracted, so the sums
+# keep covering LIMIT_DAYS days. Nothing else of the window is recomputed: radolan_days and
+# radolan_days_daily are indexed by the hours of the daily window and shifting them would
+# rewrite every tree, so they, the buffered trees and the retention are left to the daily run,
+# which skips the hours loaded here and rebuilds all tree values from the whole window.
+
+# Set up logging
+logging.basicConfig()
+logging.root.setLevel(logging.INFO)
+
+# Load the environmental variables
+load_dotenv()
+
+REQUIRED_ENV_VARS = DATABASE_ENV_VARS + ["SURROUNDING_SHAPE_FILE"]
+
+SURROUNDING_SHAPE_FILE = os.getenv("SURROUNDING_SHAPE_FILE")
+HOURLY_LOOKBACK_HOURS = int(os.getenv("HOURLY_LOOKBACK_HOURS", "6"))
+
+
+def get_latest_radolan_hour(now):
+    """Returns the last hour DWD measured radolan data for
+
+    Args:
+        now (datetime): current time in UTC
+
+    Returns:
+        datetime: the last hour at minute RADOLAN_MINUTE before now
+    """
+    hour = now.replace(minute=RADOLAN_MINUTE, second=0, microsecond=0)
+    return hour if hour <= now else hour - timedelta(hours=1)
+
+
+def harvest_latest_hours(surrounding_shape_file, lookback_hours, database_connection):
+    """Loads the missing hours of the last lookback_hours hours and updates the affected trees
+
+    Args:
+        surrounding_shape_file (shapefile): shapefile for area of interest
+        lookback_hours (int): number of previous hours to check
+        database_connection (_type_): database connection
+
+    Returns:
+        list[datetime]: the loaded hours
+    """
+    # DWD names the files by their UTC measurement time
+    end_date = get_latest_radolan_hour(datetime.utcnow())
+    start_date = end_date - timedelta(hours=lookback_hours - 1)
+    missing_hours = get_missing_hours(start_date, end_date, database_connection)
+    logging.info(f"{len(missing_hours)} of the last {lookback_hours} hours are not loaded yet")
+
+    loaded_hours = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for measured_at_timestamp in missing_hours:
+            with metrics.stage("download") as stage:
+                binary_file = download_latest_radolan_hour(measured_at_timestamp, temp_dir)
+                stage.add_file(binary_file)
+            if binary_file is None:
+                continue
+
+            with metrics.stage("unzip"):
+                hourly_radolan_file = convert_radolan_binary_to_ascii(binary_file, temp_dir)
+                os.remove(binary_file)
+
+            extracted_radolan_values = extract_hourly_radolan_values(
+                hourly_radolan_file, measured_at_timestamp, surrounding_shape_file
+            )
+            os.remove(hourly_radolan_file)
+
+            with metrics.stage("upload") as stage:
+                cell_values = upload_radolan_data_in_db(
+                    extracted_radolan_values,
+                    measured_at_timestamp,
+                    database_connection,
+                )
+                stage.add_rows(len(cell_values))
+
+            # Only the trees (or cell series) of the cells it rained in are touched
+            with metrics.stage("tree_update") as stage:
+                if RADOLAN_STORAGE_MODE == "cells":
+                    stage.add_rows(
+                        add_hourly_values_to_cells(
+                            cell_values, measured_at_timestamp, database_connection
+                        )
+                    )
+                else:
+                    stage.add_rows(
+                        add_hourly_values_to_trees(
+                            cell_values, measured_at_timestamp, database_connection
+                        )
+                    )
+            loaded_hours.append(measured_at_timestamp)
+
+    return loaded_hours
+
+
+if __name__ == "__main__":
+    if find_missing_environment_variables(REQUIRED_ENV_VARS):
+        sys.exit(1)
+
+    try:
+        database_connection = connect_database()
+    except:
+        logging.error("❌Could not establish database connection")
+        sys.exit(1)
+
+    harvest_succeeded = False
+    try:
+        ensure_checkpoint_table(database_connection)
+        loaded_hours = harvest_latest_hours(
+            SURROUNDING_SHAPE_FILE, HOURLY_LOOKBACK_HOURS, database_connection
+        )
+        logging.info(f"✅Loaded {len(loaded_hours)} hours")
+        harvest_succeeded = True
+    finally:
+        metrics.write_reports(harvest_succeeded)
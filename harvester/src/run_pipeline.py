@@ -0,0 +1,83 @@
+import sys
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from harvester_setup import (
+    find_missing_environment_variables,
+    create_connection_pool,
+)
+from harvest_metrics import metrics
+from db_profiler import statement_profiler
+import run_daily_weather
+import run_harvester
+
+# Runs the daily weather sync and the DWD harvester in one process. The weather sync runs
+# concurrently to the RADOLAN harvest, the Mapbox stage starts as soon as the trees are updated.
+# A failing job doesn't stop the other one, the process exits with 1 if any job failed.
+
+POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "4"))
+
+
+def run_job(name, required_env_vars, job, connection_pool):
+    """Runs a job with its own pooled database connection
+
+    Args:
+        name (str): name of the job used for logging and metrics
+        required_env_vars (list[str]): environmental variables the job needs
+        job (callable): the job, called with the database connection
+        connection_pool (_type_): the database connection pool
+
+    Returns:
+        bool: True if the job succeeded
+    """
+    if find_missing_environment_variables(required_env_vars):
+        logging.error(f"❌{name} failed: missing environmental variables")
+        return False
+
+    database_connection = connection_pool.getconn()
+    try:
+        with metrics.stage(name):
+            job(database_connection)
+        logging.info(f"✅{name} finished")
+        return True
+    except Exception:
+        logging.exception(f"❌{name} failed")
+        database_connection.rollback()
+        return False
+    finally:
+        connection_pool.putconn(database_connection)
+
+
+if __name__ == "__main__":
+    try:
+        connection_pool = create_connection_pool(POOL_SIZE)
+    except:
+        logging.error("❌Could not establish database connection")
+        sys.exit(1)
+
+    jobs_succeeded = False
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            weather_job = executor.submit(
+                run_job,
+                "daily_weather",
+                run_daily_weather.REQUIRED_ENV_VARS,
+                run_daily_weather.harvest_daily_weather,
+                connection_pool,
+            )
+            harvester_job = executor.submit(
+                run_job,
+                "dwd_harvester",
+                run_harvester.REQUIRED_ENV_VARS,
+                run_harvester.run_harvester,
+                connection_pool,
+            )
+            jobs_succeeded = weather_job.result() and harvester_job.result()
+    finally:
+        metrics.write_reports(jobs_succeeded)
+        if run_harvester.DB_PROFILE:
+            statement_profiler.log_summary()
+        connection_pool.closeall()
+
+    if not jobs_succeeded:
+        sys.exit(1)
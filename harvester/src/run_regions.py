@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import logging
+import tempfile
+from datetime import datetime
+from dotenv import load_dotenv
+from download_radolan_data import download_radolan_data, unzip_radolan_data
+from dwd_harvest import (
+    get_measured_at_timestamp,
+    extract_hourly_radolan_values,
+    cleanup_radolan_data,
+)
+from radolan_window import crop_radolan_ascii_regions
+from radolan_db_utils import (
+    get_start_end_harvest_dates,
+    upload_radolan_data_in_db,
+    update_harvest_dates,
+)
+from radolan_cell_storage import update_tree_radolan_values
+from radolan_checkpoints import (
+    ensure_checkpoint_table,
+    get_missing_hours,
+    format_hours,
+)
+from build_radolan_grid import build_radolan_grid
+from mapbox_tree_update import update_mapbox_tree_layer, update_tree_waterings
+from schema_check import check_schema
+from harvest_metrics import metrics
+from harvester_setup import find_missing_environment_variables, connect_database
+
+# Harvests the radolan data for several regions, e.g. cities, from one national download.
+# Every hourly file is downloaded, extracted and read once, the windows of all regions are cut
+# from the same read and processed per region, so the cost grows with the clipped area.
+#
+# REGIONS_FILE is a JSON list of regions:
+# [
+#     {
+#         "name": "berlin",
+#         "shape_file": "/app/assets/buffer.shp",
+#         "schema": "public",
+#         "settings": {"PG_DB": "berlin", "MAPBOXTILESET": "berlin-trees"}
+#     }
+# ]
+# "settings" override the environment variables of the single-region harvester (PG_*, SUPABASE_*,
+# MAPBOX*, SKIP_MAPBOX, SCHEMA_CHECK_MODE) for this region, "schema" selects the schema of the harvester tables.
+
+# Set up logging
+logging.basicConfig()
+logging.root.setLevel(logging.INFO)
+
+# Load the environmental variables
+load_dotenv()
+
+REQUIRED_ENV_VARS = ["REGIONS_FILE", "LIMIT_DAYS"]
+
+REGIONS_FILE = os.getenv("REGIONS_FILE")
+LIMIT_DAYS = os.getenv("LIMIT_DAYS")
+
+
+def load_regions(regions_file):
+    """Loads the regions and connects to their databases
+
+    Args:
+        regions_file (str): path of the JSON regions file
+
+    Returns:
+        list[dict]: the regions, each with its "connection"
+    """
+    with open(regions_file) as f:
+        regions = json.load(f)
+    for region in regions:
+        region.setdefault("settings", {})
+        region["connection"] = connect_database(region["settings"], region.get("schema"))
+        logging.info(f"Loaded region {region['name']} ({region['shape_file']})")
+    return regions
+
+
+def get_region_setting(region, name):
+    """Returns a setting of the region, falling back to the environment variable"""
+    return region["settings"].get(name, os.getenv(name))
+
+
+def harvest_regions(regions, limit_days):
+    """Loads the missing radolan hours of all regions from one download
+
+    Args:
+        regions (list[dict]): the regions
+        limit_days (number): number of previous days to keep radolan data for
+    """
+    # Every region resumes from its own checkpoints
+    all_missing_hours = set()
+    for region in regions:
+        connection = region["connection"]
+        # Check the indexes and table statistics the harvester relies on
+        with metrics.stage("schema_check"):
+            check_schema(get_region_setting(region, "SCHEMA_CHECK_MODE") or "warn", connection)
+        ensure_checkpoint_table(connection)
+        region["start_date"], region["end_date"] = get_start_end_harvest_dates(connection)
+        region["missing_hours"] = set(
+            get_missing_hours(region["start_date"], region["end_date"], connection)
+        )
+        all_missing_hours |= region["missing_hours"]
+        logging.info(f"{region['name']}: {len(region['missing_hours'])} hours are not loaded yet")
+
+    missing_days = sorted(set(hour.date() for hour in all_missing_hours))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with metrics.stage("download") as stage:
+            daily_radolan_files = []
+            for missing_day in missing_days:
+                day = datetime.combine(missing_day, datetime.min.time())
+                daily_radolan_files += download_radolan_data(day, day, temp_dir)
+            for daily_radolan_file in daily_radolan_files:
+                stage.add_file(daily_radolan_file)
+
+        with metrics.stage("unzip") as stage:
+            hourly_radolan_files = unzip_radolan_data(daily_radolan_files, temp_dir)
+            stage.add_rows(len(hourly_radolan_files))
+
+        for hourly_radolan_file in hourly_radolan_files:
+            measured_at_timestamp = get_measured_at_timestamp(hourly_radolan_file)
+            hour_regions = [
+                region for region in regions if measured_at_timestamp in region["missing_hours"]
+            ]
+            if not hour_regions:
+                continue
+
+            with tempfile.TemporaryDirectory() as hourly_temp_dir:
+                # One read of the national grid, one cropped file per region
+                region_dirs = {}
+                for region in hour_regions:
+                    region_dirs[region["name"]] = os.path.join(hourly_temp_dir, region["name"])
+                    os.makedirs(region_dirs[region["name"]])
+                with metrics.stage("crop") as stage:
+                    stage.add_file(hourly_radolan_file)
+                    cropped_files = crop_radolan_ascii_regions(
+                        hourly_radolan_file,
+                        {region_dirs[region["name"]]: region["shape_file"] for region in hour_regions},
+                    )
+
+                for region in hour_regions:
+                    extracted_radolan_values = extract_hourly_radolan_values(
+                        cropped_files[region_dirs[region["name"]]],
+                        measured_at_timestamp,
+                        region["shape_file"],
+                        windowed_read=False,
+                    )
+                    with metrics.stage("upload") as stage:
+                        upload_radolan_data_in_db(
+                            extracted_radolan_values,
+                            measured_at_timestamp,
+                            region["connection"],
+                        )
+                        stage.add_rows(len(extracted_radolan_values))
+
+    for region in regions:
+        connection = region["connection"]
+        still_missing_hours = get_missing_hours(
+            region["start_date"], region["end_date"], connection
+        )
+        if still_missing_hours:
+            logging.warning(
+                f"{region['name']}: {len(still_missing_hours)} hours could not be loaded: {', '.join(format_hours(still_missing_hours))}"
+            )
+        with metrics.stage("cleanup") as stage:
+            stage.add_rows(cleanup_radolan_data(limit_days, connection))
+
+
+def update_region(region, limit_days):
+    """Builds the radolan grid of a region and updates its trees and Mapbox layer
+
+    Args:
+        region (dict): the region
+        limit_days (number): number of previous days to keep radolan data for
+    """
+    connection = region["connection"]
+    with metrics.stage("grid_build") as stage:
+        radolan_grid = build_radolan_grid(limit_days, connection)
+        stage.add_rows(len(radolan_grid))
+    update_harvest_dates(region["start_date"], region["end_date"], connection)
+
+    with metrics.stage("tree_update") as stage:
+        stage.add_rows(update_tree_radolan_values(radolan_grid, connection))
+
+    if get_region_setting(region, "SKIP_MAPBOX") != "True":
+        trees_watered = update_mapbox_tree_layer(
+            get_region_setting(region, "MAPBOXUSERNAME"),
+            get_region_setting(region, "MAPBOXTOKEN"),
+            get_region_setting(region, "MAPBOXTILESET"),
+            get_region_setting(region, "MAPBOXLAYERNAME"),
+            get_region_setting(region, "SUPABASE_URL"),
+            get_region_setting(region, "SUPABASE_BUCKET_NAME"),
+            get_region_setting(region, "SUPABASE_SERVICE_ROLE_KEY"),
+            connection,
+        )
+        with metrics.stage("tree_waterings") as stage:
+            update_tree_waterings(trees_watered, connection)
+            stage.add_rows(len(trees_watered))
+
+
+if __name__ == "__main__":
+    if find_missing_environment_variables(REQUIRED_ENV_VARS):
+        sys.exit(1)
+
+    try:
+        regions = load_regions(REGIONS_FILE)
+    except:
+        logging.exception("❌Could not load regions")
+        sys.exit(1)
+
+    regions_succeeded = False
+    try:
+        harvest_regions(regions, int(LIMIT_DAYS))
+
+        # A failing region doesn't stop the others
+        failed_regions = []
+        for region in regions:
+            try:
+                with metrics.stage(region["name"]):
+                    update_region(region, int(LIMIT_DAYS))
+                logging.info(f"✅{region['name']} finished")
+            except Exception:
+                logging.exception(f"❌{region['name']} failed")
+                region["connection"].rollback()
+                failed_regions.append(region["name"])
+        regions_succeeded = not failed_regions
+    finally:
+        metrics.write_reports(regions_succeeded)
+        for region in regions:
+            region["connection"].close()
+
+    if not regions_succeeded:
+        sys.exit(1)
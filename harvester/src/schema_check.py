@@ -0,0 +1,207 @@
+import logging
+
+# Indexes the harvester relies on, without them the nightly run falls back to full scans
+REQUIRED_INDEXES = [
+    {
+        "name": "trees_geom_idx",
+        "table": "trees",
+        "columns": ["geom"],
+        "method": "gist",
+    },
+    {
+        "name": "radolan_geometry_centroid_idx",
+        "table": "radolan_geometry",
+        "columns": ["centroid"],
+        "method": "gist",
+    },
+    {
+        "name": "radolan_data_measured_at_idx",
+        "table": "radolan_data",
+        "columns": ["measured_at"],
+        "method": "btree",
+    },
+    {
+        "name": "radolan_data_geom_id_measured_at_idx",
+        "table": "radolan_data",
+        "columns": ["geom_id", "measured_at"],
+        "method": "btree",
+    },
+]
+
+# Tables whose planner statistics must exist for the harvester queries
+ANALYZED_TABLES = ["trees", "radolan_geometry", "radolan_data"]
+
+# Share of rows modified since the last ANALYZE from which statistics are considered stale
+STALE_STATISTICS_RATIO = 0.2
+
+SCHEMA_CHECK_MODES = ["off", "warn", "create", "strict"]
+
+
+def get_existing_indexes(table, db_conn):
+    """Gets all indexes of the given table
+
+    Args:
+        table (str): the table name
+        db_conn (_type_): the database connection
+
+    Returns:
+        list[tuple]: (index name, access method, indexed columns, is valid) for each index
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT
+                index_class.relname,
+                access_method.amname,
+                ARRAY(
+                    SELECT attribute.attname
+                    FROM unnest(pg_index.indkey::int2[]) WITH ORDINALITY AS key(attnum, ord)
+                    JOIN pg_attribute attribute
+                        ON attribute.attrelid = pg_index.indrelid AND attribute.attnum = key.attnum
+                    ORDER BY key.ord
+                ),
+                pg_index.indisvalid
+            FROM pg_index
+            JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+            JOIN pg_am access_method ON access_method.oid = index_class.relam
+            WHERE pg_index.indrelid = to_regclass(%s);
+            """,
+            (table,),
+        )
+        indexes = cur.fetchall()
+    db_conn.commit()
+    return indexes
+
+
+def find_missing_indexes(db_conn):
+    """Finds required indexes without a valid index with the same method and leading columns
+
+    Args:
+        db_conn (_type_): the database connection
+
+    Returns:
+        list[dict]: the missing entries of REQUIRED_INDEXES
+    """
+    missing = []
+    for required in REQUIRED_INDEXES:
+        existing_indexes = get_existing_indexes(required["table"], db_conn)
+        covered = any(
+            method == required["method"]
+            and is_valid
+            and list(columns[: len(required["columns"])]) == required["columns"]
+            for _, method, columns, is_valid in existing_indexes
+        )
+        if not covered:
+            missing.append(required)
+    return missing
+
+
+def create_missing_indexes(missing_indexes, db_conn):
+    """Creates the given indexes concurrently, so the tables stay writable meanwhile
+
+    Args:
+        missing_indexes (list[dict]): entries of REQUIRED_INDEXES
+        db_conn (_type_): the database connection
+    """
+    db_conn.commit()
+    autocommit = db_conn.autocommit
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    db_conn.autocommit = True
+    try:
+        with db_conn.cursor() as cur:
+            for index in missing_indexes:
+                logging.info(
+                    f"Creating index {index['name']} on {index['table']} ({', '.join(index['columns'])})..."
+                )
+                # A failed concurrent build leaves an invalid index behind
+                invalid_index_names = [
+                    name
+                    for name, _, _, is_valid in get_existing_indexes(index["table"], db_conn)
+                    if not is_valid
+                ]
+                if index["name"] in invalid_index_names:
+                    cur.execute(f"DROP INDEX CONCURRENTLY {index['name']};")
+                cur.execute(
+                    f"CREATE INDEX CONCURRENTLY {index['name']} ON {index['table']} USING {index['method']} ({', '.join(index['columns'])});"
+                )
+    finally:
+        db_conn.autocommit = autocommit
+
+
+def analyze_tables(tables, db_conn):
+    """Updates the planner statistics of the given tables, e.g. after bulk loads
+
+    Args:
+        tables (list[str]): the table names
+        db_conn (_type_): the database connection
+    """
+    with db_conn.cursor() as cur:
+        for table in tables:
+            cur.execute(f"ANALYZE {table};")
+    db_conn.commit()
+
+
+def find_tables_with_stale_statistics(db_conn):
+    """Finds tables of ANALYZED_TABLES which were never analyzed or changed a lot since
+
+    Args:
+        db_conn (_type_): the database connection
+
+    Returns:
+        list[str]: the table names
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT relname, last_analyze, last_autoanalyze, n_live_tup, n_mod_since_analyze
+            FROM pg_stat_user_tables
+            WHERE relid = ANY (ARRAY(SELECT to_regclass(name) FROM unnest(%s::text[]) AS name));
+            """,
+            (ANALYZED_TABLES,),
+        )
+        statistics = cur.fetchall()
+    db_conn.commit()
+    stale_tables = []
+    for table, last_analyze, last_autoanalyze, live_rows, modified_rows in statistics:
+        never_analyzed = last_analyze is None and last_autoanalyze is None
+        if never_analyzed or modified_rows > STALE_STATISTICS_RATIO * max(live_rows, 1):
+            stale_tables.append(table)
+    return stale_tables
+
+
+def check_schema(mode, db_conn):
+    """Checks the indexes and table statistics the harvester relies on
+
+    Args:
+        mode (str): "off" skips the check, "warn" only logs missing indexes,
+            "create" creates missing indexes concurrently, "strict" refuses to run
+        db_conn (_type_): the database connection
+
+    Raises:
+        RuntimeError: If indexes are missing in strict mode.
+        ValueError: If the mode is unknown.
+    """
+    if mode not in SCHEMA_CHECK_MODES:
+        raise ValueError(
+            f"Unknown schema check mode {mode}, use one of {', '.join(SCHEMA_CHECK_MODES)}"
+        )
+    if mode == "off":
+        return
+
+    logging.info("Checking indexes and table statistics...")
+    missing_indexes = find_missing_indexes(db_conn)
+    for index in missing_indexes:
+        logging.warning(
+            f"Missing {index['method']} index on {index['table']} ({', '.join(index['columns'])})"
+        )
+    if missing_indexes and mode == "strict":
+        raise RuntimeError(
+            f"{len(missing_indexes)} required indexes are missing, refusing to run"
+        )
+    if missing_indexes and mode == "create":
+        create_missing_indexes(missing_indexes, db_conn)
+
+    stale_tables = find_tables_with_stale_statistics(db_conn)
+    if stale_tables:
+        logging.info(f"Analyzing tables with stale statistics: {', '.join(stale_tables)}")
+        analyze_tables(stale_tables, db_conn)
@@ -0,0 +1,221 @@
+import io
+import os
+import logging
+from radolan_grid import RADOLAN_RESOLUTION
+from radolan_db_utils import (
+    TREES_REFRESH_TRIGGERS,
+    TREES_MATERIALIZED_VIEWS,
+    TREES_RADOLAN_COLUMNS,
+)
+from mv_refresh import refresh_materialized_views
+from harvest_metrics import metrics
+
+# Staged update of the tree radolan values: the values of all cells are written into a side
+# table with COPY and swapped into trees by two joined bulk updates (covered trees, then trees
+# close to a cell) in one transaction, instead of two updates per cell with periodic commits.
+# The triggers are disabled inside the same transaction, so a failing update can't leave them
+# disabled. Dead tuples and index entries written by the update are reported and trees is
+# vacuumed afterwards.
+
+# "cells" (updates per grid cell) or "staged" update of the trees in RADOLAN_STORAGE_MODE=trees
+TREES_UPDATE_MODE = os.getenv("TREES_UPDATE_MODE", "cells")
+
+CREATE_STAGING_TABLE_SQL = """
+    CREATE TEMP TABLE radolan_tree_values (
+        geom_id integer PRIMARY KEY,
+        radolan_days integer[],
+        radolan_days_daily smallint[],
+        radolan_sum integer NOT NULL
+    ) ON COMMIT DROP;
+"""
+
+STAGED_UPDATE_TREES_SQL_TEMPLATE = """
+    UPDATE trees
+    SET {radolan_days_columns}, radolan_sum = radolan_tree_values.radolan_sum
+    FROM radolan_tree_values
+    JOIN radolan_geometry ON radolan_geometry.id = radolan_tree_values.geom_id
+    WHERE ST_CoveredBy(trees.geom, radolan_geometry.geometry)
+    AND {radolan_values_distinct};
+"""
+
+STAGED_UPDATE_TREES_BUFFERED_SQL_TEMPLATE = """
+    UPDATE trees
+    SET {radolan_days_columns}, radolan_sum = radolan_tree_values.radolan_sum
+    FROM radolan_tree_values
+    JOIN radolan_geometry ON radolan_geometry.id = radolan_tree_values.geom_id
+    WHERE trees.radolan_sum IS NULL
+    AND ST_CoveredBy(trees.geom, ST_Buffer(radolan_geometry.geometry, 0.0002))
+    AND {radolan_values_distinct};
+"""
+
+STAGED_RADOLAN_DAYS_COLUMNS_SQL = {
+    "hourly": "radolan_days = radolan_tree_values.radolan_days",
+    "daily": "radolan_days = NULL, radolan_days_daily = radolan_tree_values.radolan_days_daily",
+    "both": "radolan_days = radolan_tree_values.radolan_days, radolan_days_daily = radolan_tree_values.radolan_days_daily",
+}
+
+# Guards against rewriting trees which already have the values
+STAGED_RADOLAN_VALUES_DISTINCT_SQL = {
+    "hourly": "(trees.radolan_days, trees.radolan_sum) IS DISTINCT FROM (radolan_tree_values.radolan_days, radolan_tree_values.radolan_sum)",
+    "daily": "(trees.radolan_days, trees.radolan_days_daily, trees.radolan_sum) IS DISTINCT FROM (radolan_tree_values.radolan_days, radolan_tree_values.radolan_days_daily, radolan_tree_values.radolan_sum)",
+}
+STAGED_RADOLAN_VALUES_DISTINCT_SQL["both"] = STAGED_RADOLAN_VALUES_DISTINCT_SQL["daily"]
+
+# Size and dead tuples of trees, updates of the current transaction (HOT updates write no
+# index entries)
+TREES_STATS_SQL = """
+    SELECT
+        pg_relation_size('trees'),
+        pg_indexes_size('trees'),
+        (SELECT COUNT(*) FROM pg_index WHERE indrelid = 'trees'::regclass),
+        COALESCE((SELECT n_dead_tup FROM pg_stat_user_tables WHERE relid = 'trees'::regclass), 0),
+        pg_stat_get_xact_tuples_updated('trees'::regclass),
+        pg_stat_get_xact_tuples_hot_updated('trees'::regclass);
+"""
+
+
+def format_array(values):
+    """Formats a list as PostgreSQL array literal for COPY, None as NULL"""
+    if values is None:
+        return "\\N"
+    return "{" + ",".join(str(value) for value in values) + "}"
+
+
+def copy_radolan_tree_values(radolan_grid, resolution, db_conn):
+    """Writes the values of all cells into the side table radolan_tree_values with COPY
+
+    Args:
+        radolan_grid (RadolanGrid): the radolan grid
+        resolution (str): "hourly", "daily" or "both", see RADOLAN_RESOLUTION
+        db_conn (_type_): the database connection
+    """
+    buffer = io.StringIO()
+    for geom_id, hourly, daily, total_sum in radolan_grid.iter_series(resolution):
+        buffer.write(f"{geom_id}\t{format_array(hourly)}\t{format_array(daily)}\t{total_sum}\n")
+    buffer.seek(0)
+    with db_conn.cursor() as cur:
+        cur.execute(CREATE_STAGING_TABLE_SQL)
+        cur.copy_expert(
+            "COPY radolan_tree_values (geom_id, radolan_days, radolan_days_daily, radolan_sum) FROM STDIN",
+            buffer,
+        )
+
+
+def get_trees_stats(db_conn):
+    """Reads size, indexes and dead tuples of trees and the updates of the current transaction
+
+    Args:
+        db_conn (_type_): the database connection
+
+    Returns:
+        dict: the statistics
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(TREES_STATS_SQL)
+        table_bytes, index_bytes, indexes, dead_tuples, updated, hot_updated = cur.fetchone()
+    return {
+        "table_bytes": table_bytes,
+        "index_bytes": index_bytes,
+        "indexes": indexes,
+        "dead_tuples": dead_tuples,
+        "updated": updated,
+        "hot_updated": hot_updated,
+    }
+
+
+def log_bloat_report(before, after):
+    """Logs the growth of trees and the index entries written by the update
+
+    Args:
+        before (dict): statistics before the update, see get_trees_stats
+        after (dict): statistics after the update
+    """
+    updated = after["updated"] - before["updated"]
+    hot_updated = after["hot_updated"] - before["hot_updated"]
+    logging.info(
+        f"Staged tree update: {updated} rows updated, {hot_updated} HOT, "
+        f"{(updated - hot_updated) * after['indexes']} index entries written ({after['indexes']} indexes), "
+        f"table +{(after['table_bytes'] - before['table_bytes']) / 1024 ** 2:.1f} MB, "
+        f"indexes +{(after['index_bytes'] - before['index_bytes']) / 1024 ** 2:.1f} MB, "
+        f"{updated} dead tuples left for vacuum, {before['dead_tuples']} before"
+    )
+
+
+def vacuum_trees(db_conn):
+    """Vacuums and analyzes trees, VACUUM can't run inside a transaction
+
+    Args:
+        db_conn (_type_): the database connection
+    """
+    autocommit = db_conn.autocommit
+    db_conn.autocommit = True
+    try:
+        with db_conn.cursor() as cur:
+            cur.execute("VACUUM (ANALYZE) trees;")
+            cur.execute(
+                "SELECT n_dead_tup FROM pg_stat_user_tables WHERE relid = 'trees'::regclass;"
+            )
+            row = cur.fetchone()
+    finally:
+        db_conn.autocommit = autocommit
+    logging.info(f"Vacuumed trees, {row[0] if row else 0} dead tuples reported")
+
+
+def update_trees_staged(radolan_grid, db_conn, resolution=RADOLAN_RESOLUTION):
+    """Updates the radolan values of all trees from a side table in one transaction
+
+    Args:
+        radolan_grid (RadolanGrid): the radolan grid
+        db_conn (_type_): the database connection
+        resolution (str): "hourly", "daily" or "both", see RADOLAN_RESOLUTION
+
+    Returns:
+        int: number of updated tree rows
+    """
+    radolan_days_columns = STAGED_RADOLAN_DAYS_COLUMNS_SQL[resolution]
+
+    updated_rows = 0
+    try:
+        with db_conn.cursor() as cur:
+            if resolution != "hourly":
+                cur.execute(
+                    "ALTER TABLE trees ADD COLUMN IF NOT EXISTS radolan_days_daily smallint[];"
+                )
+            before = get_trees_stats(db_conn)
+
+            with metrics.stage("tree_staging") as stage:
+                copy_radolan_tree_values(radolan_grid, resolution, db_conn)
+                stage.add_rows(len(radolan_grid))
+
+            for trigger in TREES_REFRESH_TRIGGERS:
+                cur.execute(f"ALTER TABLE trees DISABLE TRIGGER {trigger};")
+            logging.info(f"Updating trees from {len(radolan_grid)} staged grid cells...")
+            cur.execute(
+                STAGED_UPDATE_TREES_SQL_TEMPLATE.format(
+                    radolan_days_columns=radolan_days_columns,
+                    radolan_values_distinct=STAGED_RADOLAN_VALUES_DISTINCT_SQL[resolution],
+                )
+            )
+            updated_rows += cur.rowcount
+            cur.execute(
+                STAGED_UPDATE_TREES_BUFFERED_SQL_TEMPLATE.format(
+                    radolan_days_columns=radolan_days_columns,
+                    radolan_values_distinct=STAGED_RADOLAN_VALUES_DISTINCT_SQL[resolution],
+                )
+            )
+            updated_rows += cur.rowcount
+            for trigger in TREES_REFRESH_TRIGGERS:
+                cur.execute(f"ALTER TABLE trees ENABLE TRIGGER {trigger};")
+
+            after = get_trees_stats(db_conn)
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+
+    logging.info(f"Updated {updated_rows} tree rows in {len(radolan_grid)} grid cells, unchanged trees were skipped")
+    log_bloat_report(before, after)
+    with metrics.stage("vacuum"):
+        vacuum_trees(db_conn)
+    refresh_materialized_views(TREES_MATERIALIZED_VIEWS, TREES_RADOLAN_COLUMNS, db_conn)
+    return updated_rows
@@ -1,40 +1,94 @@
+import os
+import gzip
+import shutil
 import requests
 import logging
 
+# Compression of compressible artifacts before the upload: "gzip" or "none". Off by default
+# until it is confirmed that Supabase storage serves gzip uploads decoded or with their
+# Content-Encoding, otherwise the objects would be stored gzipped under their .csv/.json names.
+SUPABASE_UPLOAD_COMPRESSION = os.getenv("SUPABASE_UPLOAD_COMPRESSION", "none")
 
-# Function to check if a file exists in Supabase storage
-def check_file_exists_in_supabase_storage(supabaseUrl, supabaseBucketName, file_name):
-    url = (
-        f"{supabaseUrl}/storage/v1/object/info/public/{supabaseBucketName}/{file_name}"
-    )
-    response = requests.get(url)
-    return response.status_code == 200
+CONTENT_TYPES = {
+    ".csv": "text/csv",
+    ".geojson": "application/geo+json",
+    ".json": "application/json",
+    ".mbtiles": "application/vnd.sqlite3",
+    ".parquet": "application/vnd.apache.parquet",
+    ".fgb": "application/flatgeobuf",
+}
+
+# Text artifacts, mbtiles, GeoParquet and FlatGeobuf are compressed already or binary
+COMPRESSIBLE_EXTENSIONS = [".csv", ".geojson", ".json"]
+
+
+def get_content_type(file_name):
+    """Returns the content type of a file by its extension"""
+    return CONTENT_TYPES.get(os.path.splitext(file_name)[1].lower(), "application/octet-stream")
+
+
+def compress_file(file_path):
+    """Compresses a file with gzip, streamed from disk
+
+    Args:
+        file_path (str): path of the file
+
+    Returns:
+        str: path of the compressed file
+    """
+    compressed_file_path = file_path + ".gz"
+    with open(file_path, "rb") as file, gzip.open(compressed_file_path, "wb") as compressed:
+        shutil.copyfileobj(file, compressed, 1024 * 1024)
+    return compressed_file_path
 
 
 # Function to upload a file to Supabase storage
 def upload_file_to_supabase_storage(
-    supabaseUrl, supabaseBucketName, supabaseServiceRoleKey, file_path, file_name
+    supabaseUrl,
+    supabaseBucketName,
+    supabaseServiceRoleKey,
+    file_path,
+    file_name,
+    compression=SUPABASE_UPLOAD_COMPRESSION,
 ):
-    with open(file_path, "rb") as file:
-        file_url = f"{supabaseUrl}/storage/v1/object/{supabaseBucketName}/{file_name}"
-        http_method = (
-            requests.put
-            if check_file_exists_in_supabase_storage(
-                supabaseUrl, supabaseBucketName, file_name
+    """Uploads a file to Supabase storage with a single upsert request, the file is streamed
+       from disk. Compressible files are gzip compressed and sent with Content-Encoding.
+
+    Args:
+        supabaseUrl (str): the Supabase URL
+        supabaseBucketName (str): the storage bucket
+        supabaseServiceRoleKey (str): the service role key
+        file_path (str): path of the file
+        file_name (str): name of the object in the bucket
+        compression (str): "gzip" or "none", see SUPABASE_UPLOAD_COMPRESSION
+
+    Returns:
+        bool: True if the upload succeeded
+    """
+    headers = {
+        "Authorization": f"Bearer {supabaseServiceRoleKey}",
+        "Content-Type": get_content_type(file_name),
+        "x-upsert": "true",
+    }
+    upload_path = file_path
+    if compression == "gzip" and os.path.splitext(file_name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+        upload_path = compress_file(file_path)
+        headers["Content-Encoding"] = "gzip"
+
+    try:
+        # requests streams file objects in chunks and sends their Content-Length
+        with open(upload_path, "rb") as file:
+            response = requests.post(
+                f"{supabaseUrl}/storage/v1/object/{supabaseBucketName}/{file_name}",
+                data=file,
+                headers=headers,
             )
-            else requests.post
-        )
-        response = http_method(
-            file_url,
-            files={"file": file},
-            headers={
-                "Authorization": f"Bearer {supabaseServiceRoleKey}",
-                "ContentType": "application/geo+json",
-                "AcceptEncoding": "gzip, deflate, br",
-            },
-        )
-
-        if response.status_code == 200:
-            logging.info(f"Uploaded {file_name} to Supabase storage...")
-        else:
-            logging.error(response)
+    finally:
+        if upload_path != file_path:
+            os.remove(upload_path)
+
+    if response.status_code == 200:
+        logging.info(f"Uploaded {file_name} to Supabase storage...")
+        return True
+    logging.error(f"Could not upload {file_name} to Supabase storage: {response.status_code} {response.text}")
+    return False
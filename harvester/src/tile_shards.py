@@ -0,0 +1,161 @@
+import os
+import re
+import hashlib
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Tiles the trees per district: trees.csv is split into one shard per district, the shards are
+# tiled in parallel tippecanoe processes and merged with tile-join. Shard tiles are cached in
+# TILE_CACHE_DIR by the hash of the shard and the tippecanoe arguments, so districts whose
+# trees didn't change are not tiled again. All shards use the same layer name and maximum zoom
+# level, a zoom level guessed per shard (-zg) would differ between the districts.
+
+TILE_SHARDS = os.getenv("TILE_SHARDS", "False") == "True"
+TILE_SHARD_WORKERS = int(os.getenv("TILE_SHARD_WORKERS", str(os.cpu_count())))
+TILE_SHARD_MAX_ZOOM = os.getenv("TILE_SHARD_MAX_ZOOM", "14")
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR")
+
+# Layer name of the single tippecanoe run, which names the layer after trees.csv
+TREES_LAYER_NAME = "trees"
+
+
+def split_trees_csv(trees_csv_full_path, shard_dir):
+    """Splits trees.csv into one CSV file per district, the district is the last column
+
+    Args:
+        trees_csv_full_path (str): the full path to the trees.csv
+        shard_dir (str): the directory to store the shards in
+
+    Returns:
+        dict[str, str]: full path of the shard of each district
+    """
+    with open(trees_csv_full_path) as f:
+        header = f.readline().rstrip("\n")
+        lines_by_district = {}
+        for line in f:
+            line = line.rstrip("\n")
+            district = line.rsplit(",", 1)[-1].strip()
+            lines_by_district.setdefault(district, []).append(line)
+
+    shards = {}
+    for district, lines in lines_by_district.items():
+        file_name = re.sub(r"[^0-9A-Za-z_-]+", "_", district) or "none"
+        shards[district] = os.path.join(shard_dir, f"trees-{file_name}.csv")
+        with open(shards[district], "w") as out:
+            out.write("\n".join([header] + lines))
+    return shards
+
+
+def get_tippecanoe_shard_args(max_zoom=TILE_SHARD_MAX_ZOOM):
+    """Returns the tippecanoe arguments of a shard, without input and output file"""
+    return [
+        "-z",
+        str(max_zoom),
+        "-l",
+        TREES_LAYER_NAME,
+        "--force",
+        "--drop-fraction-as-needed",
+    ]
+
+
+def get_shard_hash(shard_file, tippecanoe_args):
+    """Hashes the content of the shard together with the tippecanoe arguments
+
+    Args:
+        shard_file (str): full path to the shard
+        tippecanoe_args (list[str]): the tippecanoe arguments
+
+    Returns:
+        str: the hex digest
+    """
+    sha1 = hashlib.sha1(" ".join(tippecanoe_args).encode())
+    with open(shard_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def tile_shard(shard_file, output_dir, cache_dir=TILE_CACHE_DIR):
+    """Tiles a shard with tippecanoe or reuses its cached tiles
+
+    Args:
+        shard_file (str): full path to the shard
+        output_dir (str): the directory to store the tiles in if there is no cache
+        cache_dir (str): the directory of the cached shard tiles, None for no caching
+
+    Returns:
+        tuple[str, bool]: full path to the shard tiles and whether they were cached
+
+    Raises:
+        RuntimeError: If tippecanoe fails.
+    """
+    tippecanoe_args = get_tippecanoe_shard_args()
+    shard_name = os.path.splitext(os.path.basename(shard_file))[0]
+    if cache_dir:
+        shard_hash = get_shard_hash(shard_file, tippecanoe_args)
+        tiles_file = os.path.join(cache_dir, f"{shard_name}-{shard_hash}.mbtiles")
+        if os.path.exists(tiles_file):
+            return tiles_file, True
+    else:
+        tiles_file = os.path.join(output_dir, f"{shard_name}.mbtiles")
+
+    # Tiles are written next to the final file and moved, so the cache never holds partial files
+    partial_file = tiles_file + ".partial"
+    returncode = subprocess.call(
+        ["tippecanoe", "-o", partial_file] + tippecanoe_args + [shard_file]
+    )
+    if returncode != 0:
+        raise RuntimeError(f"tippecanoe failed for {shard_file} with exit code {returncode}")
+    os.replace(partial_file, tiles_file)
+
+    if cache_dir:
+        # Tiles of former versions of the shard aren't needed anymore
+        for file_name in os.listdir(cache_dir):
+            if (
+                re.fullmatch(re.escape(shard_name) + r"-[0-9a-f]{40}\.mbtiles", file_name)
+                and os.path.join(cache_dir, file_name) != tiles_file
+            ):
+                os.remove(os.path.join(cache_dir, file_name))
+    return tiles_file, False
+
+
+def preprocess_trees_csv_sharded(trees_csv_full_path, temp_dir, workers=TILE_SHARD_WORKERS):
+    """Tiles trees.csv per district in parallel and merges the shards with tile-join
+
+    Args:
+        trees_csv_full_path (str): the full path to the trees.csv
+        temp_dir (str): the full path to the directory to store the preprocessed file
+        workers (int): maximum number of parallel tippecanoe processes
+
+    Returns:
+        str: full path to the preprocessed trees file
+
+    Raises:
+        RuntimeError: If tippecanoe or tile-join fails.
+    """
+    shard_dir = os.path.join(temp_dir, "shards")
+    os.makedirs(shard_dir, exist_ok=True)
+    if TILE_CACHE_DIR:
+        os.makedirs(TILE_CACHE_DIR, exist_ok=True)
+    shards = split_trees_csv(trees_csv_full_path, shard_dir)
+    logging.info(f"Preprocessing trees.csv with tippecanoe in {len(shards)} district shards...")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(lambda shard_file: tile_shard(shard_file, shard_dir), shards.values())
+        )
+    cached_shards = [district for district, (_, cached) in zip(shards, results) if cached]
+    logging.info(
+        f"Tiled {len(shards) - len(cached_shards)} shards, reused {len(cached_shards)} cached shards"
+    )
+
+    # -pk: merged tiles of several districts may exceed the tile size limit
+    trees_preprocessed_full_path = os.path.join(temp_dir, "trees-preprocessed.mbtiles")
+    returncode = subprocess.call(
+        ["tile-join", "-pk", "--force", "-o", trees_preprocessed_full_path]
+        + [tiles_file for tiles_file, _ in results]
+    )
+    if returncode != 0:
+        raise RuntimeError(f"tile-join failed with exit code {returncode}")
+    return trees_preprocessed_full_path
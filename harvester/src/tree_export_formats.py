@@ -0,0 +1,165 @@
+import os
+import json
+import struct
+import logging
+
+# Writes the tree export as GeoParquet (columnar, compressed, typed) and FlatGeobuf (with
+# spatial index, readable with HTTP range requests) in addition to trees.csv. The writers get
+# the rows of the CSV export while it is streamed from the database, GeoParquet is written in
+# row groups of TREES_EXPORT_BATCH_SIZE rows. FlatGeobuf is written with fiona and needs
+# GDAL >= 3.1 and is off by default (the pinned GDAL 2.4 has no driver), it is skipped with a
+# warning if the driver is not available.
+
+# Comma separated formats: "geoparquet", "flatgeobuf" (needs GDAL >= 3.1)
+TREES_EXPORT_FORMATS = [
+    export_format.strip()
+    for export_format in os.getenv("TREES_EXPORT_FORMATS", "geoparquet").split(",")
+    if export_format.strip()
+]
+TREES_EXPORT_BATCH_SIZE = int(os.getenv("TREES_EXPORT_BATCH_SIZE", "50000"))
+
+# Columns of the exported rows after id, lat and lng, like the columns of trees.csv
+TREE_EXPORT_COLUMNS = [
+    ("radolan_sum", "float"),
+    ("age", "int"),
+    ("watering_sum", "float"),
+    ("total_water_sum_liters", "float"),
+    ("is_adopted_by_users", "bool"),
+    ("district", "str"),
+]
+
+
+def point_wkb(lng, lat):
+    """Encodes a point as little endian WKB
+
+    Args:
+        lng (float): longitude
+        lat (float): latitude
+
+    Returns:
+        bytes: the WKB point
+    """
+    return struct.pack("<BIdd", 1, 1, lng, lat)
+
+
+class GeoParquetWriter:
+    """Writes the tree rows as GeoParquet 1.0.0 with WKB point geometries in OGC:CRS84"""
+
+    file_name = "trees.parquet"
+
+    def __init__(self, path, batch_size=TREES_EXPORT_BATCH_SIZE):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.path = path
+        self.batch_size = batch_size
+        arrow_types = {
+            "float": pyarrow.float64(),
+            "int": pyarrow.int32(),
+            "bool": pyarrow.bool_(),
+            "str": pyarrow.string(),
+        }
+        geo_metadata = {
+            "version": "1.0.0",
+            "primary_column": "geometry",
+            "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Point"]}},
+        }
+        self.schema = pyarrow.schema(
+            [("id", pyarrow.string())]
+            + [(name, arrow_types[column_type]) for name, column_type in TREE_EXPORT_COLUMNS]
+            + [("geometry", pyarrow.binary())],
+            metadata={"geo": json.dumps(geo_metadata)},
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+        self.rows = []
+
+    def write(self, tree_id, lat, lng, values):
+        self.rows.append((tree_id, *values, point_wkb(lng, lat)))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = list(zip(*self.rows))
+        self.writer.write_table(
+            self.pyarrow.Table.from_arrays(
+                [
+                    self.pyarrow.array(column, type=field.type)
+                    for column, field in zip(columns, self.schema)
+                ],
+                schema=self.schema,
+            )
+        )
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class FlatGeobufWriter:
+    """Writes the tree rows as FlatGeobuf with spatial index in EPSG:4326"""
+
+    file_name = "trees.fgb"
+
+    def __init__(self, path):
+        import fiona
+
+        if "FlatGeobuf" not in fiona.supported_drivers:
+            raise RuntimeError("the FlatGeobuf driver needs GDAL >= 3.1")
+        self.path = path
+        self.collection = fiona.open(
+            path,
+            "w",
+            driver="FlatGeobuf",
+            crs="EPSG:4326",
+            schema={
+                "geometry": "Point",
+                "properties": dict(
+                    [("id", "str")] + [(name, column_type) for name, column_type in TREE_EXPORT_COLUMNS]
+                ),
+            },
+        )
+        self.column_names = [name for name, _ in TREE_EXPORT_COLUMNS]
+
+    def write(self, tree_id, lat, lng, values):
+        self.collection.write(
+            {
+                "geometry": {"type": "Point", "coordinates": (lng, lat)},
+                "properties": dict([("id", tree_id)] + list(zip(self.column_names, values))),
+            }
+        )
+
+    def close(self):
+        self.collection.close()
+
+
+EXPORT_WRITERS = {
+    "geoparquet": GeoParquetWriter,
+    "flatgeobuf": FlatGeobufWriter,
+}
+
+
+def create_tree_export_writers(temp_dir, export_formats=TREES_EXPORT_FORMATS):
+    """Creates a writer for every export format, unavailable formats are skipped
+
+    Args:
+        temp_dir (str): the full path to the directory to store the files in
+        export_formats (list[str]): the formats, see TREES_EXPORT_FORMATS
+
+    Returns:
+        list: the writers, each with path, file_name, write(tree_id, lat, lng, values) and close()
+    """
+    writers = []
+    for export_format in export_formats:
+        writer_class = EXPORT_WRITERS.get(export_format)
+        if writer_class is None:
+            logging.warning(f"Unknown tree export format {export_format}")
+            continue
+        try:
+            writers.append(writer_class(os.path.join(temp_dir, writer_class.file_name)))
+        except Exception as e:
+            logging.warning(f"Skipping {export_format} export: {e}")
+    return writers
@@ -0,0 +1,274 @@
+import os
+import logging
+from datetime import timedelta
+from radolan_cell_storage import RADOLAN_STORAGE_MODE
+
+# Denormalized copy of the tree export in tree_export_snapshot: one row per tree with its
+# watering sum of the last 30 days, adoption state, radolan_sum and whether it lies within
+# the extent of the radolan grid, so the export is a sequential scan of one table.
+# Triggers on trees, trees_watered and trees_adopted record the changed trees in
+# tree_export_dirty, only these trees and the trees with waterings which entered or left
+# the 30 day window since the last refresh are recomputed. radolan_sum is copied over in one
+# update of the changed values. The snapshot is rebuilt if the grid extent changed.
+# With TREES_EXPORT_SNAPSHOT disabled the tables and triggers are dropped again, so they
+# don't keep recording changed trees nobody refreshes.
+
+TREES_EXPORT_SNAPSHOT = os.getenv("TREES_EXPORT_SNAPSHOT", "False") == "True"
+
+CREATE_SNAPSHOT_SQL = """
+    CREATE TABLE IF NOT EXISTS tree_export_snapshot (
+        tree_id text PRIMARY KEY,
+        lat double precision,
+        lng double precision,
+        radolan_sum integer,
+        pflanzjahr integer,
+        watering_sum double precision NOT NULL,
+        is_adopted_by_users boolean NOT NULL,
+        district text,
+        in_region boolean NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS tree_export_dirty (
+        tree_id text PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS tree_export_snapshot_state (
+        id boolean PRIMARY KEY DEFAULT TRUE CHECK (id),
+        window_end date NOT NULL,
+        grid_extent text,
+        refreshed_at timestamptz NOT NULL DEFAULT NOW()
+    );
+
+    -- Records the tree of the changed row, the column holding the tree id is the trigger argument
+    CREATE OR REPLACE FUNCTION tree_export_mark_dirty() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO tree_export_dirty (tree_id)
+            SELECT to_jsonb(OLD) ->> TG_ARGV[0] WHERE to_jsonb(OLD) ->> TG_ARGV[0] IS NOT NULL
+            ON CONFLICT DO NOTHING;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO tree_export_dirty (tree_id)
+            SELECT to_jsonb(NEW) ->> TG_ARGV[0] WHERE to_jsonb(NEW) ->> TG_ARGV[0] IS NOT NULL
+            ON CONFLICT DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- Only columns of the export, the radolan update doesn't fire the trigger
+    DROP TRIGGER IF EXISTS tg_tree_export_dirty ON trees;
+    CREATE TRIGGER tg_tree_export_dirty
+    AFTER INSERT OR DELETE OR UPDATE OF geom, pflanzjahr, bezirk ON trees
+    FOR EACH ROW EXECUTE PROCEDURE tree_export_mark_dirty('id');
+
+    DROP TRIGGER IF EXISTS tg_tree_export_dirty ON trees_watered;
+    CREATE TRIGGER tg_tree_export_dirty
+    AFTER INSERT OR DELETE OR UPDATE OF tree_id, amount, timestamp ON trees_watered
+    FOR EACH ROW EXECUTE PROCEDURE tree_export_mark_dirty('tree_id');
+
+    DROP TRIGGER IF EXISTS tg_tree_export_dirty ON trees_adopted;
+    CREATE TRIGGER tg_tree_export_dirty
+    AFTER INSERT OR DELETE OR UPDATE OF tree_id, uuid ON trees_adopted
+    FOR EACH ROW EXECUTE PROCEDURE tree_export_mark_dirty('tree_id');
+"""
+
+DROP_SNAPSHOT_SQL = """
+    DROP TRIGGER IF EXISTS tg_tree_export_dirty ON trees;
+    DROP TRIGGER IF EXISTS tg_tree_export_dirty ON trees_watered;
+    DROP TRIGGER IF EXISTS tg_tree_export_dirty ON trees_adopted;
+    DROP FUNCTION IF EXISTS tree_export_mark_dirty();
+    DROP TABLE IF EXISTS tree_export_snapshot, tree_export_dirty, tree_export_snapshot_state;
+"""
+
+GRID_EXTENT_SQL = """
+    SELECT ST_AsText(ST_SetSRID(ST_Extent(geometry)::geometry, 4326)) FROM radolan_geometry;
+"""
+
+# Rows of the snapshot like the former export query, {trees_filter} restricts them to some trees.
+# WARNING: The coordinates in the database columns lat and lng are mislabeled! They mean the opposite.
+SNAPSHOT_ROWS_SQL_TEMPLATE = """
+    INSERT INTO tree_export_snapshot
+    SELECT
+        trees.id,
+        ST_Y(trees.geom),
+        ST_X(trees.geom),
+        {radolan_sum},
+        trees.pflanzjahr,
+        COALESCE(waterings.watering_sum, 0),
+        EXISTS (SELECT 1 FROM trees_adopted ad WHERE ad.tree_id = trees.id AND ad.uuid IS NOT NULL),
+        trees.bezirk,
+        COALESCE(ST_Contains(ST_GeomFromText(%(grid_extent)s, 4326), trees.geom), FALSE)
+    FROM
+        trees
+        {radolan_join}
+        LEFT JOIN (
+            SELECT w.tree_id, SUM(w.amount) AS watering_sum
+            FROM trees_watered w
+            WHERE w.timestamp >= CURRENT_DATE - INTERVAL '30 days' AND w.timestamp < CURRENT_DATE
+            {waterings_filter}
+            GROUP BY w.tree_id
+        ) AS waterings ON waterings.tree_id = trees.id
+    WHERE TRUE {trees_filter};
+"""
+
+# Trees with waterings which entered or left the 30 day window since the last refresh
+MARK_WINDOW_CHANGES_DIRTY_SQL = """
+    INSERT INTO tree_export_dirty (tree_id)
+    SELECT DISTINCT tree_id FROM trees_watered
+    WHERE tree_id IS NOT NULL AND (
+        (timestamp >= LEAST(%(old_start)s, %(new_start)s) AND timestamp < GREATEST(%(old_start)s, %(new_start)s))
+        OR (timestamp >= LEAST(%(old_end)s, %(new_end)s) AND timestamp < GREATEST(%(old_end)s, %(new_end)s))
+    )
+    ON CONFLICT DO NOTHING;
+"""
+
+# Takes the dirty trees, trees marked during the refresh stay dirty for the next one
+TAKE_DIRTY_TREES_SQL = """
+    CREATE TEMP TABLE refreshed_trees (tree_id text PRIMARY KEY) ON COMMIT DROP;
+    WITH dirty AS (DELETE FROM tree_export_dirty RETURNING tree_id)
+    INSERT INTO refreshed_trees SELECT tree_id FROM dirty;
+    DELETE FROM tree_export_snapshot WHERE tree_id IN (SELECT tree_id FROM refreshed_trees);
+"""
+
+UPDATE_STATE_SQL = """
+    INSERT INTO tree_export_snapshot_state (id, window_end, grid_extent, refreshed_at)
+    VALUES (TRUE, CURRENT_DATE, %s, NOW())
+    ON CONFLICT (id) DO UPDATE
+    SET window_end = EXCLUDED.window_end, grid_extent = EXCLUDED.grid_extent, refreshed_at = NOW();
+"""
+
+TREES_EXPORT_SNAPSHOT_SQL = """
+    SELECT tree_id, lat, lng, radolan_sum, pflanzjahr, watering_sum, is_adopted_by_users, district
+    FROM tree_export_snapshot
+    WHERE in_region;
+"""
+
+
+def get_radolan_sum_source(storage_mode):
+    """Returns the radolan_sum expression and join of the storage mode
+
+    Args:
+        storage_mode (str): RADOLAN_STORAGE_MODE, "trees" or "cells"
+
+    Returns:
+        tuple[str, str]: the expression and the join, "" if trees hold the values
+    """
+    if storage_mode == "cells":
+        return (
+            "radolan_cell_series.radolan_sum",
+            "LEFT JOIN radolan_cell_series ON radolan_cell_series.geom_id = trees.radolan_geom_id",
+        )
+    return "trees.radolan_sum", ""
+
+
+def get_snapshot_rows_sql(storage_mode, dirty_only):
+    """Returns the query inserting the snapshot rows of all or of the refreshed trees
+
+    Args:
+        storage_mode (str): RADOLAN_STORAGE_MODE, "trees" or "cells"
+        dirty_only (bool): only the trees in refreshed_trees
+
+    Returns:
+        str: the query
+    """
+    radolan_sum, radolan_join = get_radolan_sum_source(storage_mode)
+    return SNAPSHOT_ROWS_SQL_TEMPLATE.format(
+        radolan_sum=radolan_sum,
+        radolan_join=radolan_join,
+        waterings_filter="AND w.tree_id IN (SELECT tree_id FROM refreshed_trees)" if dirty_only else "",
+        trees_filter="AND trees.id IN (SELECT tree_id FROM refreshed_trees)" if dirty_only else "",
+    )
+
+
+def get_sync_radolan_sums_sql(storage_mode):
+    """Returns the update copying changed radolan sums into the snapshot
+
+    Args:
+        storage_mode (str): RADOLAN_STORAGE_MODE, "trees" or "cells"
+
+    Returns:
+        str: the query
+    """
+    radolan_sum, radolan_join = get_radolan_sum_source(storage_mode)
+    return f"""
+        UPDATE tree_export_snapshot
+        SET radolan_sum = {radolan_sum}
+        FROM trees {radolan_join}
+        WHERE trees.id = tree_export_snapshot.tree_id
+        AND tree_export_snapshot.radolan_sum IS DISTINCT FROM {radolan_sum};
+    """
+
+
+def ensure_tree_export_snapshot(db_conn):
+    """Creates the snapshot tables and the triggers recording changed trees
+
+    Args:
+        db_conn (_type_): the database connection
+    """
+    with db_conn.cursor() as cur:
+        cur.execute(CREATE_SNAPSHOT_SQL)
+        db_conn.commit()
+
+
+def drop_tree_export_snapshot(db_conn):
+    """Drops the snapshot tables and the triggers recording changed trees if they exist
+
+    Args:
+        db_conn (_type_): the database connection
+
+    Returns:
+        bool: whether the snapshot existed
+    """
+    with db_conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('tree_export_dirty') IS NOT NULL;")
+        exists = cur.fetchone()[0]
+        if exists:
+            cur.execute(DROP_SNAPSHOT_SQL)
+            logging.info("Dropped tree_export_snapshot and its triggers")
+        db_conn.commit()
+    return exists
+
+
+def refresh_tree_export_snapshot(db_conn, storage_mode=RADOLAN_STORAGE_MODE):
+    """Brings the snapshot up to date, rebuilds it on the first run or after a grid change
+
+    Args:
+        db_conn (_type_): the database connection
+        storage_mode (str): RADOLAN_STORAGE_MODE, "trees" or "cells"
+
+    Returns:
+        int: number of recomputed trees, all trees if the snapshot was rebuilt
+    """
+    ensure_tree_export_snapshot(db_conn)
+    with db_conn.cursor() as cur:
+        cur.execute("SET LOCAL statement_timeout = '10min';")
+        cur.execute(GRID_EXTENT_SQL)
+        grid_extent = cur.fetchone()[0]
+        cur.execute("SELECT window_end, grid_extent, CURRENT_DATE FROM tree_export_snapshot_state;")
+        state = cur.fetchone()
+
+        if state is None or state[1] != grid_extent:
+            logging.info("Rebuilding tree_export_snapshot...")
+            cur.execute("TRUNCATE tree_export_snapshot, tree_export_dirty;")
+            cur.execute(get_snapshot_rows_sql(storage_mode, False), {"grid_extent": grid_extent})
+            refreshed_rows = cur.rowcount
+        else:
+            old_end, _, new_end = state
+            cur.execute(
+                MARK_WINDOW_CHANGES_DIRTY_SQL,
+                {
+                    "old_start": old_end - timedelta(days=30),
+                    "new_start": new_end - timedelta(days=30),
+                    "old_end": old_end,
+                    "new_end": new_end,
+                },
+            )
+            cur.execute(TAKE_DIRTY_TREES_SQL)
+            cur.execute(get_snapshot_rows_sql(storage_mode, True), {"grid_extent": grid_extent})
+            refreshed_rows = cur.rowcount
+            cur.execute(get_sync_radolan_sums_sql(storage_mode))
+            logging.info(f"Updated radolan_sum of {cur.rowcount} trees in tree_export_snapshot")
+
+        cur.execute(UPDATE_STATE_SQL, (grid_extent,))
+        db_conn.commit()
+    logging.info(f"Recomputed {refreshed_rows} trees in tree_export_snapshot")
+    return refreshed_rows
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The harvester modules are imported like the scripts in src do it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
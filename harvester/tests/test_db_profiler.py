@@ -0,0 +1,94 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from db_profiler import ProfilingCursor, StatementProfiler
+
+
+class FakeExplainCursor:
+    """Cursor of the EXPLAIN, records the statements like the database would receive them"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, vars=None):
+        if not isinstance(query, str):
+            raise TypeError("query must be str")
+        self.connection.statements.append(query)
+        if query.startswith("EXPLAIN") and self.connection.explain_error:
+            raise self.connection.explain_error
+
+    def fetchall(self):
+        return [("Insert on radolan_temp",)]
+
+
+class FakeConnection:
+    def __init__(self, explain_error=None):
+        self.profiler = StatementProfiler(explain_threshold_ms=0)
+        self.autocommit = False
+        self.statements = []
+        self.explain_error = explain_error
+
+    def cursor(self, cursor_factory=None):
+        return FakeExplainCursor(self)
+
+
+class FakeProfilingCursor:
+    """Runs the profiling of ProfilingCursor without a database"""
+
+    _profile = ProfilingCursor._profile
+    _explain = ProfilingCursor._explain
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 2
+
+    def execute(self, query, vars=None):
+        return self._profile(query, vars, lambda *args: None, (query, vars))
+
+
+# execute_values composes the statement with its values as bytes
+BYTES_QUERY = b"INSERT INTO radolan_temp (geometry, value, measured_at) VALUES (ST_Multi(ST_GeomFromWKB('\\x01'::bytea, 4326)), 3, '2024-01-01T00:50:00'::timestamp)"
+
+
+def test_bytes_query_is_explained():
+    connection = FakeConnection()
+    FakeProfilingCursor(connection).execute(BYTES_QUERY)
+
+    assert connection.statements == [
+        "SAVEPOINT db_profiler_explain;",
+        "EXPLAIN (ANALYZE, BUFFERS) " + BYTES_QUERY.decode(),
+        "ROLLBACK TO SAVEPOINT db_profiler_explain;",
+        "RELEASE SAVEPOINT db_profiler_explain;",
+    ]
+    (statement,) = connection.profiler.summary()
+    assert statement["explain"] == ["Insert on radolan_temp"]
+    assert statement["rows"] == 2
+
+
+def test_failing_explain_does_not_fail_statement():
+    connection = FakeConnection(explain_error=ValueError("unexpected"))
+    FakeProfilingCursor(connection).execute(BYTES_QUERY)
+
+    assert connection.statements[-2:] == [
+        "ROLLBACK TO SAVEPOINT db_profiler_explain;",
+        "RELEASE SAVEPOINT db_profiler_explain;",
+    ]
+    (statement,) = connection.profiler.summary()
+    assert statement["explain"] == ["(not explained: unexpected)"]
+
+
+def test_bytes_query_in_autocommit():
+    connection = FakeConnection()
+    connection.autocommit = True
+    FakeProfilingCursor(connection).execute(BYTES_QUERY)
+
+    assert connection.statements == []
+    (statement,) = connection.profiler.summary()
+    assert statement["explain"] == ["(not explained: data modifying statement in autocommit mode)"]
@@ -0,0 +1,35 @@
+import pytest
+from harvest_metrics import HarvestMetrics, _current_rss_bytes
+
+MiB = 1024 * 1024
+
+pytestmark = pytest.mark.skipif(
+    _current_rss_bytes() is None, reason="needs /proc/self/statm"
+)
+
+
+def test_rss_is_measured_per_stage():
+    metrics = HarvestMetrics()
+    with metrics.stage("allocate"):
+        data = bytearray(64 * MiB)
+        data[:: 4096] = b"\x01" * len(data[:: 4096])
+    del data
+    with metrics.stage("small"):
+        sum(range(1000))
+
+    stages = metrics.report(True)["stages"]
+    assert stages["allocate"]["rss_increase_bytes"] >= 48 * MiB
+    assert stages["small"]["rss_increase_bytes"] < 16 * MiB
+    assert stages["small"]["process_peak_rss_bytes"] >= stages["allocate"]["rss_increase_bytes"]
+
+
+def test_prometheus_textfile(tmp_path):
+    metrics = HarvestMetrics()
+    with metrics.stage("download") as stage:
+        stage.add_rows(3)
+    path = tmp_path / "harvester.prom"
+    metrics.write_prometheus_textfile(str(path), True)
+
+    content = path.read_text()
+    assert 'harvester_stage_rows{job="dwd_harvester",stage="download"} 3' in content
+    assert 'harvester_stage_rss_increase_bytes{job="dwd_harvester",stage="download"}' in content
@@ -0,0 +1,105 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+
+import mv_refresh
+from mv_refresh import refresh_materialized_views
+
+VIEWS = ["trees_count", "most_frequent_tree_species", "total_tree_species_count"]
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, vars=None):
+        self.connection.statements.append(query)
+
+    def fetchall(self):
+        # None of the views reads a radolan column
+        return [(view, "gattung") for view in VIEWS]
+
+
+class FakeConnection:
+    def __init__(self, dsn="dbname=berlin"):
+        self.dsn = dsn
+        self.closed = 0
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakeConnectionPool:
+    def __init__(self, max_connections):
+        self.connections = [FakeConnection() for _ in range(max_connections)]
+        self.taken = 0
+
+    def getconn(self):
+        self.taken += 1
+        return self.connections.pop()
+
+    def putconn(self, connection, close=False):
+        self.connections.append(connection)
+
+
+def refreshed_views(connections):
+    return sorted(
+        statement.split()[-1].rstrip(";")
+        for connection in connections
+        for statement in connection.statements
+        if statement.startswith("REFRESH")
+    )
+
+
+def test_views_are_refreshed_on_pooled_connections():
+    db_conn = FakeConnection()
+    connection_pool = FakeConnectionPool(3)
+
+    timings = refresh_materialized_views(
+        VIEWS, None, db_conn, connection_pool=connection_pool
+    )
+
+    assert sorted(timings) == sorted(VIEWS)
+    assert connection_pool.taken == 3
+    assert len(connection_pool.connections) == 3
+    assert refreshed_views(connection_pool.connections) == sorted(VIEWS)
+    assert refreshed_views([db_conn]) == []
+
+
+def test_pool_is_reused_per_database(monkeypatch):
+    created_pools = []
+
+    def create_connection_pool(max_connections, db_conn=None):
+        created_pools.append(FakeConnectionPool(max_connections))
+        return created_pools[-1]
+
+    monkeypatch.setattr(mv_refresh, "create_connection_pool", create_connection_pool)
+    monkeypatch.setattr(mv_refresh, "_connection_pools", {})
+
+    refresh_materialized_views(VIEWS, None, FakeConnection())
+    refresh_materialized_views(VIEWS, None, FakeConnection())
+    refresh_materialized_views(VIEWS, None, FakeConnection("dbname=hamburg"))
+
+    assert len(created_pools) == 2
+    assert created_pools[0].taken == 6
+
+
+def test_unchanged_columns_skip_the_refresh():
+    db_conn = FakeConnection()
+    connection_pool = FakeConnectionPool(3)
+
+    assert refresh_materialized_views(VIEWS, ["radolan_sum"], db_conn, connection_pool=connection_pool) == {}
+    assert connection_pool.taken == 0
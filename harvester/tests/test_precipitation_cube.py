@@ -0,0 +1,86 @@
+from datetime import datetime
+from datetime import timedelta
+import numpy
+from precipitation_cube import PrecipitationCube
+from build_radolan_grid import build_radolan_grid_from_cube
+
+START_DATE = datetime(2024, 6, 1, 0, 50)
+END_DATE = datetime(2024, 6, 30, 23, 50)
+HOURS = int((END_DATE - START_DATE).total_seconds() // 3600) + 1
+
+
+class FakeCursor:
+    """Answers the checkpoint and radolan_data queries of sync_precipitation_cube"""
+
+    def __init__(self, radolan_data):
+        self.radolan_data = radolan_data
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def execute(self, sql, params=None):
+        if "FROM radolan_checkpoints" in sql:
+            start_date, end_date = params
+            hours = sorted(set(measured_at for measured_at, _, _ in self.radolan_data))
+            self.rows = [(hour,) for hour in hours if start_date <= hour <= end_date]
+        elif "FROM radolan_data" in sql:
+            (hours,) = params
+            self.rows = [row for row in self.radolan_data if row[0] in hours]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, radolan_data):
+        self.radolan_data = radolan_data
+
+    def cursor(self):
+        return FakeCursor(self.radolan_data)
+
+    def commit(self):
+        pass
+
+
+def hourly_rain(geom_id, value):
+    return [(START_DATE + timedelta(hours=hour), geom_id, value) for hour in range(HOURS)]
+
+
+def test_build_grid_from_fresh_cube(tmp_path):
+    cube = PrecipitationCube.open(str(tmp_path), numpy.array([1, 2, 3], dtype=numpy.int32))
+    db_conn = FakeConnection(hourly_rain(2, 8))
+
+    radolan_grid = build_radolan_grid_from_cube(cube, START_DATE, END_DATE, db_conn)
+
+    assert radolan_grid.geom_ids.tolist() == [2]
+    assert radolan_grid.values.shape == (1, HOURS)
+    assert radolan_grid.sums.tolist() == [8 * HOURS]
+    assert len(cube.loaded) == HOURS
+
+
+def test_build_grid_after_window_moved_back(tmp_path):
+    cube = PrecipitationCube.open(str(tmp_path), numpy.array([1, 2, 3], dtype=numpy.int32))
+    cube.write_hour(END_DATE, [(1, 4), (3, 2)])
+    db_conn = FakeConnection(hourly_rain(3, 2) + [(END_DATE, 1, 4)])
+
+    radolan_grid = build_radolan_grid_from_cube(cube, START_DATE, END_DATE, db_conn)
+
+    assert radolan_grid.geom_ids.tolist() == [1, 3]
+    assert radolan_grid.sums.tolist() == [4, 2 * HOURS]
+
+
+def test_write_hour_starts_empty_cube(tmp_path):
+    geom_ids = numpy.array([1, 2, 3], dtype=numpy.int32)
+    cube = PrecipitationCube.open(str(tmp_path), geom_ids)
+    cube.write_hour(START_DATE, [(3, 7)])
+
+    reopened = PrecipitationCube.open(str(tmp_path), geom_ids)
+    assert reopened.has_hour(START_DATE)
+    assert reopened.window(START_DATE, START_DATE).tolist() == [[0, 0, 7]]
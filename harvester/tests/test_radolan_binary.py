@@ -0,0 +1,115 @@
+import os
+import gzip
+import numpy
+import pytest
+from datetime import datetime
+from radolan_binary import (
+    convert_radolan_binary_to_ascii,
+    read_radolan_ascii,
+    read_radolan_binary,
+)
+
+# 2024-01-01 00:50, 4 rows x 5 cols
+HEADER = b"RW010050100000124BY  1620130VS 3SW   2.28.1PR E-01INT  60GP   4x   5MS 33<asb,boo,ros>\x03"
+
+# Little-endian 16 bit words as specified in DWD's RADOLAN format description, written out by hand
+# so the expectations don't depend on the decoder's constants. Rows start at the south-west corner,
+# 0x29C4 is how DWD encodes missing cells (2500 with the missing flag 0x2000).
+BINARY_ROWS = [
+    b"\x00\x00" b"\x00\x00" b"\x09\x00" b"\x00\x00" b"\x96\x00",  # 0, 0, 9, 0, 15.0 mm
+    b"\xc4\x29" b"\x19\x80" b"\x00\x00" b"\x00\x00" b"\x02\x00",  # missing, 2.5 mm with clutter flag, 0, 0, 0.2 mm
+    b"\x03\x40" b"\x00\x00" b"\x00\x00" b"\x07\x10" b"\x00\x00",  # -0.3 mm, 0, 0, 0.7 mm secondary, 0
+    b"\x00\x00" b"\x01\x00" b"\x0c\x00" b"\xff\x0f" b"\xc4\x29",  # 0, 0.1 mm, 1.2 mm, 409.5 mm, missing
+]
+
+# The same hour in the layout of DWD's ASCII export, north-west corner first, values in 0.1 mm
+ASCII_ROWS = """0 1 12 4095 -1
+-3 0 0 7 0
+-1 25 0 0 2
+0 0 9 0 150
+"""
+
+# Header of DWD's ASCII export of the national composite
+ASCII_HEADER = """ncols 900
+nrows 900
+xllcorner -523462
+yllcorner -4658645
+cellsize 1000
+NODATA_value -1
+"""
+
+
+def write_file(path, content):
+    with (gzip.open(path, "wb") if str(path).endswith(".gz") else open(path, "wb")) as f:
+        f.write(content)
+    return str(path)
+
+
+def test_binary_matches_ascii(tmp_path):
+    binary_file = write_file(
+        tmp_path / "raa01-rw_10000-2401010050-dwd---bin.gz", HEADER + b"".join(BINARY_ROWS)
+    )
+    ascii_file = write_file(tmp_path / "RW_20240101-0050.asc", (ASCII_HEADER + ASCII_ROWS).encode())
+
+    header, values = read_radolan_binary(binary_file)
+
+    assert header["measured_at"] == datetime(2024, 1, 1, 0, 50)
+    assert (header["precision"], header["rows"], header["cols"]) == (-1, 4, 5)
+    numpy.testing.assert_array_equal(values, read_radolan_ascii(ascii_file))
+
+
+def test_clutter_as_missing(tmp_path):
+    binary_file = write_file(tmp_path / "rw.bin", HEADER + b"".join(BINARY_ROWS))
+
+    _, values = read_radolan_binary(binary_file, clutter_as_missing=True)
+
+    assert values[2, 1] == -1
+    assert values[1, 0] == -3
+
+
+def test_converted_ascii_matches_ascii_export(tmp_path):
+    # National 900 x 900 composite, zero except for the south-west and north-east corners
+    header = HEADER.replace(b"GP   4x   5", b"GP 900x 900")
+    words = bytearray(900 * 900 * 2)
+    words[0:2] = b"\x2a\x00"
+    words[-2:] = b"\xc4\x29"
+    binary_file = write_file(tmp_path / "raa01-rw_10000-2401010050-dwd---bin.gz", header + bytes(words))
+    output_dir = tmp_path / "converted"
+    output_dir.mkdir()
+
+    converted_file = convert_radolan_binary_to_ascii(binary_file, str(output_dir))
+
+    assert converted_file.endswith("RW_20240101-0050.asc")
+    with open(converted_file) as converted:
+        lines = converted.read().splitlines()
+    assert "\n".join(lines[:6]) + "\n" == ASCII_HEADER
+    assert len(lines) == 6 + 900
+    assert lines[6] == " ".join(["0"] * 899 + ["-1"])
+    assert lines[-1] == " ".join(["42"] + ["0"] * 899)
+
+
+def test_conversion_of_other_grids_is_rejected(tmp_path):
+    binary_file = write_file(tmp_path / "rw.bin", HEADER + b"".join(BINARY_ROWS))
+
+    with pytest.raises(ValueError, match="grid"):
+        convert_radolan_binary_to_ascii(binary_file, str(tmp_path))
+
+
+def test_unsupported_precision(tmp_path):
+    binary_file = write_file(
+        tmp_path / "rw.bin", HEADER.replace(b"PR E-01", b"PR E-02") + b"".join(BINARY_ROWS)
+    )
+
+    with pytest.raises(ValueError, match="precision"):
+        read_radolan_binary(binary_file)
+
+
+@pytest.mark.skipif(
+    not os.getenv("RADOLAN_GOLDEN_BINARY") or not os.getenv("RADOLAN_GOLDEN_ASCII"),
+    reason="RADOLAN_GOLDEN_BINARY and RADOLAN_GOLDEN_ASCII point to no DWD files of the same hour",
+)
+def test_dwd_binary_matches_dwd_ascii():
+    header, values = read_radolan_binary(os.getenv("RADOLAN_GOLDEN_BINARY"))
+
+    assert header["product"] == "RW"
+    numpy.testing.assert_array_equal(values, read_radolan_ascii(os.getenv("RADOLAN_GOLDEN_ASCII")))
@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+from radolan_checkpoints import get_retention_days, get_first_retained_day
+
+
+def test_retention_defaults_to_limit_days(monkeypatch):
+    monkeypatch.delenv("RADOLAN_RETENTION_DAYS", raising=False)
+    assert get_retention_days(30) == 30
+
+    monkeypatch.setenv("RADOLAN_RETENTION_DAYS", "")
+    assert get_retention_days(30) == 30
+
+
+def test_retention_is_never_shorter_than_limit_days(monkeypatch):
+    monkeypatch.setenv("RADOLAN_RETENTION_DAYS", "3650")
+    assert get_retention_days(30) == 3650
+
+    monkeypatch.setenv("RADOLAN_RETENTION_DAYS", "7")
+    assert get_retention_days(30) == 30
+
+
+def test_first_retained_day_survives_the_next_cleanup():
+    retention_days = 30
+    first_retained_day = get_first_retained_day(retention_days)
+
+    # The cleanup of a run within the next day deletes everything before NOW() - retention_days
+    next_cleanup_limit = datetime.now() + timedelta(days=1 - retention_days)
+    assert first_retained_day >= next_cleanup_limit
+    assert first_retained_day - next_cleanup_limit <= timedelta(days=1)
+    assert first_retained_day.time() == datetime.min.time()
@@ -0,0 +1,56 @@
+import numpy
+from datetime import date, datetime, timedelta
+from radolan_grid import RadolanGrid
+
+
+def build_grid(start_date, end_date):
+    """One cell with the value 1 in every hour, so daily values are the hours of the day"""
+    hours = int((end_date - start_date).total_seconds() // 3600) + 1
+    return RadolanGrid(
+        numpy.array([1], dtype=numpy.int32),
+        numpy.ones((1, hours), dtype=numpy.int32),
+        start_date=start_date,
+    )
+
+
+def test_partial_edge_days_are_dropped():
+    # Window of build_radolan_grid for 3 days in winter (UTC+1): the first Berlin day starts
+    # at 01:50, the last hour 23:50 UTC is 00:50 of the next Berlin day
+    grid = build_grid(datetime(2024, 1, 1, 0, 50), datetime(2024, 1, 3, 23, 50))
+
+    assert grid.daily_start_date == date(2024, 1, 2)
+    numpy.testing.assert_array_equal(grid.daily_values, [[24, 24]])
+
+
+def test_window_aligned_to_berlin_days():
+    # Berlin 2024-01-01 00:50 until 2024-01-03 23:50 in UTC
+    grid = build_grid(datetime(2023, 12, 31, 23, 50), datetime(2024, 1, 3, 22, 50))
+
+    assert grid.daily_start_date == date(2024, 1, 1)
+    numpy.testing.assert_array_equal(grid.daily_values, [[24, 24, 24]])
+
+
+def test_daylight_saving_days():
+    # 2024-03-31 has 23 hours and 2024-10-27 25 hours in Europe/Berlin
+    spring = build_grid(datetime(2024, 3, 29, 23, 50), datetime(2024, 4, 1, 21, 50))
+    autumn = build_grid(datetime(2024, 10, 25, 22, 50), datetime(2024, 10, 28, 22, 50))
+
+    numpy.testing.assert_array_equal(spring.daily_values, [[24, 23, 24]])
+    numpy.testing.assert_array_equal(autumn.daily_values, [[24, 25, 24]])
+
+
+def test_window_without_complete_day():
+    grid = build_grid(datetime(2024, 1, 1, 3, 50), datetime(2024, 1, 1, 10, 50))
+
+    assert grid.daily_values.shape == (1, 0)
+    assert grid.daily_start_date is None
+
+
+def test_daily_values_sum_the_hours_of_each_day():
+    start_date = datetime(2023, 12, 31, 23, 50)
+    grid = build_grid(start_date, start_date + timedelta(hours=47))
+    grid.values[0, :] = numpy.arange(48)
+
+    numpy.testing.assert_array_equal(
+        grid.daily_values, [[sum(range(24)), sum(range(24, 48))]]
+    )
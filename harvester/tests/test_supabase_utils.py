@@ -0,0 +1,122 @@
+import gzip
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from supabase_utils import upload_file_to_supabase_storage
+
+# Local stand-in for the object API of Supabase storage: POST /storage/v1/object/<bucket>/<name>
+# rejects existing objects without "x-upsert: true". Objects are stored with the request body
+# and headers as sent, nothing is decoded.
+
+OBJECT_PATH_PREFIX = "/storage/v1/object/"
+SERVICE_ROLE_KEY = "stand-in-service-role-key"
+BUCKET_NAME = "data_assets"
+
+
+class StorageRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, message):
+        body = message.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.server.requests.append(self.path)
+        if not self.path.startswith(OBJECT_PATH_PREFIX):
+            return self.reply(404, '{"error": "not found"}')
+        if self.headers.get("Authorization") != f"Bearer {SERVICE_ROLE_KEY}":
+            return self.reply(403, '{"error": "unauthorized"}')
+        bucket, _, name = self.path[len(OBJECT_PATH_PREFIX) :].partition("/")
+        if (bucket, name) in self.server.objects and self.headers.get("x-upsert") != "true":
+            return self.reply(400, '{"error": "Duplicate", "message": "The resource already exists"}')
+        self.server.objects[(bucket, name)] = {
+            "content": self.rfile.read(int(self.headers.get("Content-Length", 0))),
+            "content_type": self.headers.get("Content-Type"),
+            "content_encoding": self.headers.get("Content-Encoding"),
+        }
+        self.reply(200, f'{{"Key": "{bucket}/{name}"}}')
+
+
+@pytest.fixture
+def storage():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StorageRequestHandler)
+    server.objects = {}
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def upload(storage, file_path, file_name, compression):
+    return upload_file_to_supabase_storage(
+        storage.url, BUCKET_NAME, SERVICE_ROLE_KEY, str(file_path), file_name, compression
+    )
+
+
+def test_upload_replaces_object(storage, tmp_path):
+    file_path = tmp_path / "trees.csv"
+    file_path.write_text("id,lat,lng\n1,52.5,13.4\n")
+    assert upload(storage, file_path, "trees.csv", "none")
+
+    file_path.write_text("id,lat,lng\n2,52.4,13.3\n")
+    assert upload(storage, file_path, "trees.csv", "none")
+
+    stored = storage.objects[(BUCKET_NAME, "trees.csv")]
+    assert stored["content"] == file_path.read_bytes()
+    assert stored["content_type"] == "text/csv"
+    assert stored["content_encoding"] is None
+    assert storage.requests == [f"{OBJECT_PATH_PREFIX}{BUCKET_NAME}/trees.csv"] * 2
+
+
+@pytest.mark.parametrize(
+    "file_name, content_type",
+    [
+        ("trees.parquet", "application/vnd.apache.parquet"),
+        ("trees-preprocessed.mbtiles", "application/vnd.sqlite3"),
+        ("weather.json", "application/json"),
+        ("unknown.bin", "application/octet-stream"),
+    ],
+)
+def test_upload_content_type(storage, tmp_path, file_name, content_type):
+    file_path = tmp_path / file_name
+    file_path.write_bytes(b"\x00\x01content")
+    assert upload(storage, file_path, file_name, "none")
+    assert storage.objects[(BUCKET_NAME, file_name)]["content_type"] == content_type
+
+
+def test_upload_gzip_round_trip(storage, tmp_path):
+    file_path = tmp_path / "trees.csv"
+    file_path.write_text("id,lat,lng\n" + "1,52.5,13.4\n" * 1000)
+    for _ in range(2):
+        assert upload(storage, file_path, "trees.csv", "gzip")
+
+    stored = storage.objects[(BUCKET_NAME, "trees.csv")]
+    assert stored["content_encoding"] == "gzip"
+    assert stored["content_type"] == "text/csv"
+    assert len(stored["content"]) < file_path.stat().st_size
+    assert gzip.decompress(stored["content"]) == file_path.read_bytes()
+    assert list(tmp_path.iterdir()) == [file_path]
+
+
+def test_gzip_skips_binary_artifacts(storage, tmp_path):
+    file_path = tmp_path / "trees.parquet"
+    file_path.write_bytes(b"PAR1" + b"\x00" * 100)
+    assert upload(storage, file_path, "trees.parquet", "gzip")
+    stored = storage.objects[(BUCKET_NAME, "trees.parquet")]
+    assert stored["content_encoding"] is None
+    assert stored["content"] == file_path.read_bytes()
+
+
+def test_upload_failure(storage, tmp_path):
+    file_path = tmp_path / "trees.csv"
+    file_path.write_text("id\n")
+    assert not upload_file_to_supabase_storage(
+        storage.url, BUCKET_NAME, "wrong-key", str(file_path), "trees.csv", "none"
+    )